@@ -1,9 +1,221 @@
-from fastapi import APIRouter
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.settings import settings
+from app.db.analytics import check_analytics, check_range, run_analytics
+from app.db.backfill import backfill_file
+from app.db.db import get_async_db, get_engine
+from app.db.export import (
+    ExportError, check_export, export_chunks, export_filename, export_media_type
+)
+from app.db.history import default_range, downsample, fetch_history_cached_async, parse_bucket
+from app.db.persistence import SENSOR_UNITS
+from app.db.query_cache import query_cache
+from app.ingest.recent import recent_cache
 
 router = APIRouter(prefix="/readings", tags=["readings"])
 
 
+def _ts_iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def _check_sensor(sensor: Optional[str]):
+    if sensor is not None and sensor not in SENSOR_UNITS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown sensor '{sensor}'. Expected one of: {', '.join(SENSOR_UNITS)}"
+        )
+
+
 @router.get("/latest")
-async def get_latest():
-    # todo: implement this
-    return {}
+async def get_latest(device: Optional[str] = None):
+    # newest value of every sensor per device, straight from the in-memory cache
+    devices = {}
+    for key in recent_cache.keys(device):
+        latest = recent_cache.latest(key)
+        if latest is None:
+            continue
+        device_id, sensor = key
+        ts, value = latest
+        devices.setdefault(device_id, {})[sensor] = {
+            "ts": _ts_iso(ts),
+            "value": value,
+            "unit": SENSOR_UNITS[sensor]
+        }
+    return {
+        "devices": [
+            {"device": device_id or None, "sensors": sensors}
+            for device_id, sensors in devices.items()
+        ]
+    }
+
+
+@router.get("/recent")
+async def get_recent(
+    window: str = "15m",
+    sensor: Optional[str] = None,
+    device: Optional[str] = None
+):
+    # raw samples from the last `window`, no database round trip.
+    # points are [epoch_ms, value] pairs to keep big windows small
+    _check_sensor(sensor)
+    try:
+        width = parse_bucket(window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    since = time.time() - width.total_seconds()
+    series = []
+    for key in recent_cache.keys(device, sensor):
+        points = recent_cache.since(key, since)
+        series.append({
+            "device": key[0] or None,
+            "sensor": key[1],
+            "unit": SENSOR_UNITS[key[1]],
+            "points": [[round(ts * 1000), value] for ts, value in points]
+        })
+    return {"window": window, "from": _ts_iso(since), "series": series}
+
+
+@router.get("/history")
+async def get_history(
+    sensor: str,
+    device: Optional[str] = None,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    bucket: str = "1m",
+    max_points: int = Query(1000, ge=3, le=10000),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # min/max/avg/count per time bucket, aggregated in postgres, whole buckets cached
+    _check_sensor(sensor)
+
+    start, end = default_range(start, end)
+    try:
+        width = parse_bucket(bucket)
+        points = await fetch_history_cached_async(db, sensor, start, end, width, device)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    reduced = points
+    if len(points) > max_points:
+        # LTTB is plain python, keep it off the event loop
+        reduced = await run_in_threadpool(downsample, points, max_points)
+    return {
+        "sensor": sensor,
+        "device": device,
+        "unit": SENSOR_UNITS[sensor],
+        "bucket": bucket,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "buckets": len(points),
+        "downsampled": len(reduced) < len(points),
+        "points": [p.to_dict() for p in reduced]
+    }
+
+
+@router.get("/analytics")
+async def get_analytics(
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    device: Optional[str] = None,
+    sensor: Optional[str] = None,
+    window: str = settings.analytics_window,
+    z: float = Query(settings.analytics_z, gt=0),
+    max_points: int = Query(1000, ge=3, le=10000),
+    max_anomalies: int = Query(100, ge=0, le=10000)
+):
+    # rolling mean/std, percentiles, z-score anomalies and dew point / heat index,
+    # computed with numpy over the raw values (all sensors unless one is given)
+    _check_sensor(sensor)
+    start, end = default_range(start, end)
+    try:
+        check_analytics()
+        width = parse_bucket(window)
+        check_range(start, end)
+        # whole columns are decoded and crunched in one go, keep it off the event loop
+        result = await run_in_threadpool(
+            run_analytics, start, end, device, [sensor] if sensor else None,
+            width.total_seconds(), z, max_points, max_anomalies
+        )
+    except ValueError as e:  # AnalyticsError included: range, row and device limits
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    return {
+        "device": device,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "window": window,
+        "z": z,
+        **result
+    }
+
+
+@router.get("/cache")
+async def get_cache_stats():
+    # hit ratio and memory of the history query cache
+    return query_cache.get_stats()
+
+
+def _export_stream(fmt, start, end, device, sensor, compression):
+    # sync generator, starlette iterates it in the threadpool
+    with get_engine().connect() as conn:
+        yield from export_chunks(conn, fmt, start, end, device, sensor, compression)
+
+
+@router.get("/export")
+async def export_readings(
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    format: str = "csv",
+    compression: str = "none",
+    device: Optional[str] = None,
+    sensor: Optional[str] = None
+):
+    # raw readings as a download, streamed in chunks so any range fits in memory
+    start, end = default_range(start, end)
+    try:
+        check_export(format, compression, sensor)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    filename = export_filename(format, compression, start, end)
+    return StreamingResponse(
+        _export_stream(format, start, end, device, sensor, compression),
+        media_type=export_media_type(format, compression),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@router.post("/import")
+async def import_readings(
+    request: Request,
+    device: Optional[str] = None,
+    anchor_ms: Optional[int] = None,
+    anchor_ts: Optional[datetime] = None
+):
+    # NDJSON body (optionally gzipped) of samples a device buffered offline,
+    # see app.db.backfill. anchor_ms + anchor_ts pin its clock if the lines have no wall time
+    if (anchor_ms is None) != (anchor_ts is None):
+        raise HTTPException(status_code=400, detail="anchor_ms and anchor_ts go together")
+    anchor = None
+    if anchor_ms is not None:
+        anchor = (anchor_ms, anchor_ts if anchor_ts.tzinfo else anchor_ts.replace(tzinfo=timezone.utc))
+
+    # spool the upload first, the import itself is sync and runs in the threadpool
+    with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as body:
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+        try:
+            return await run_in_threadpool(backfill_file, body, device=device, anchor=anchor)
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=500, detail=f"Import failed: {e}") from e
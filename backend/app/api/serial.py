@@ -1,8 +1,11 @@
 # api routes for serial port stuff
+from typing import Optional
+
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
-from app.serial.serial_reader import esp32_reader
+from app.serial.device_manager import device_manager
+from app.serial.serial_reader import ESP32SerialReader
 
 router = APIRouter(prefix="/serial", tags=["serial"])
 
@@ -12,11 +15,24 @@ class ConnectRequest(BaseModel):
     baudrate: int = 115200
 
 
+class DeviceConnectRequest(BaseModel):
+    port: str
+    baudrate: int = 115200
+    device_id: Optional[str] = None
+
+
+def _get_device(device_id: str) -> ESP32SerialReader:
+    reader = device_manager.get(device_id)
+    if reader is None:
+        raise HTTPException(status_code=404, detail=f"Unknown device '{device_id}'")
+    return reader
+
+
 @router.get("/ports")
 async def list_ports():
     # get list of serial ports
     try:
-        ports = esp32_reader.list_available_ports()
+        ports = ESP32SerialReader.list_available_ports()
         return {"ports": ports}
     except (OSError, RuntimeError) as e:
         raise HTTPException(
@@ -26,11 +42,12 @@ async def list_ports():
 
 
 @router.post("/connect")
-async def connect(request: ConnectRequest):
-    success = esp32_reader.connect(request.port, request.baudrate)
-    if success:
+def connect(request: ConnectRequest):
+    device_id = device_manager.connect(request.port, request.baudrate)
+    if device_id:
         return {
             "status": "connected",
+            "device_id": device_id,
             "port": request.port,
             "baudrate": request.baudrate
         }
@@ -45,19 +62,20 @@ async def connect(request: ConnectRequest):
 
 
 @router.post("/auto-connect")
-async def auto_connect(baudrate: int = 115200):
+def auto_connect(baudrate: int = 115200):
     # try to find ESP32 automatically
-    esp32_port = esp32_reader.find_esp32_port()
+    esp32_port = ESP32SerialReader.find_esp32_port()
     if not esp32_port:
         raise HTTPException(
             status_code=404,
             detail="No ESP32 device found. Make sure it's plugged in and drivers are installed."
         )
 
-    success = esp32_reader.connect(esp32_port, baudrate)
-    if success:
+    device_id = device_manager.connect(esp32_port, baudrate)
+    if device_id:
         return {
             "status": "connected",
+            "device_id": device_id,
             "port": esp32_port,
             "baudrate": baudrate,
             "auto_detected": True
@@ -69,9 +87,10 @@ async def auto_connect(baudrate: int = 115200):
 
 
 @router.post("/disconnect")
-async def disconnect():
+def disconnect():
+    # disconnects every device
     try:
-        esp32_reader.disconnect()
+        device_manager.disconnect_all()
         return {"status": "disconnected"}
     except (OSError, RuntimeError) as e:
         raise HTTPException(
@@ -82,16 +101,80 @@ async def disconnect():
 
 @router.get("/status")
 async def get_status():
-    return esp32_reader.get_status()
+    reader = device_manager.primary()
+    if reader is None:
+        return {"device_id": None, "connected": False, "port": None,
+                "has_data": False, "devices": 0}
+    return {**reader.get_status(), "devices": len(device_manager.devices)}
 
 
 @router.get("/data")
 async def get_data():
-    data = esp32_reader.get_latest_data()
-    status = esp32_reader.get_status()
+    reader = device_manager.primary()
+    if reader is None:
+        return {"connected": False, "port": None, "data": None}
+    status = reader.get_status()
 
     return {
         "connected": status["connected"],
+        "device_id": status["device_id"],
         "port": status["port"],
-        "data": data
+        "data": reader.get_latest_data()
     }
+
+
+# multi-device routes
+
+@router.get("/devices")
+async def list_devices():
+    return {
+        "devices": device_manager.list_devices(),
+        "discovery_running": device_manager.discovery_running
+    }
+
+
+@router.post("/devices")
+def connect_device(request: DeviceConnectRequest):
+    device_id = device_manager.connect(request.port, request.baudrate, request.device_id)
+    if device_id is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Failed to connect to {request.port}."
+        )
+    return _get_device(device_id).get_status()
+
+
+@router.post("/devices/discover")
+def discover_devices(baudrate: int = 115200):
+    # one discovery pass right now
+    return device_manager.discover(baudrate)
+
+
+@router.post("/devices/discovery/{action}")
+def toggle_discovery(action: str):
+    # background hot-plug scanning
+    if action == "start":
+        device_manager.start_discovery()
+    elif action == "stop":
+        device_manager.stop_discovery()
+    else:
+        raise HTTPException(status_code=400, detail="Action must be 'start' or 'stop'")
+    return {"discovery_running": device_manager.discovery_running}
+
+
+@router.get("/devices/{device_id}")
+async def get_device(device_id: str):
+    return _get_device(device_id).get_status()
+
+
+@router.get("/devices/{device_id}/data")
+async def get_device_data(device_id: str):
+    reader = _get_device(device_id)
+    return {**reader.get_status(), "data": reader.get_latest_data()}
+
+
+@router.delete("/devices/{device_id}")
+def disconnect_device(device_id: str):
+    if not device_manager.disconnect(device_id):
+        raise HTTPException(status_code=404, detail=f"Unknown device '{device_id}'")
+    return {"status": "disconnected", "device_id": device_id}
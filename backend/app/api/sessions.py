@@ -0,0 +1,134 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.settings import settings
+from app.db.db import get_async_db
+from app.db.history import default_range
+from app.db.sessions import day_totals, fetch_days_async, fetch_open_async, fetch_sessions_async
+from app.ingest.sessions import SESSION_STATES, SessionChange, session_detector
+
+router = APIRouter(prefix="/sessions", tags=["sessions"])
+
+# a single request shouldn't ask for years of days
+MAX_DAYS = 366
+
+
+def _ts_iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+async def _open_sessions(db: AsyncSession, device: Optional[str]) -> List[SessionChange]:
+    # the detector in this process is ahead of the last checkpoint in the db.
+    # in bus mode it runs in the ingest process, the checkpoint is all there is
+    if settings.sessions_enabled and settings.ingest_mode != "bus":
+        return session_detector.open_sessions(device)
+    return await fetch_open_async(db, device)
+
+
+def _session_dict(session: SessionChange, is_open: bool) -> Dict:
+    # open sessions last until their latest reading so far
+    return {
+        "device": session.device or None,
+        "state": session.state,
+        "start": _ts_iso(session.started),
+        "end": None if is_open else _ts_iso(session.ended),
+        "duration_s": round(session.ended - session.started, 1),
+        "open": is_open
+    }
+
+
+@router.get("")
+async def get_sessions(
+    device: Optional[str] = None,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    state: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # present/away intervals overlapping the range, straight from the sessions index
+    if state is not None and state not in SESSION_STATES:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown state '{state}'. Expected one of: {', '.join(SESSION_STATES)}")
+    start, end = default_range(start, end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+
+    stored = await fetch_sessions_async(db, start, end, device, state)
+    live = {(s.device, s.started): s for s in await _open_sessions(db, device)
+            if state is None or s.state == state}
+    sessions = [_session_dict(s, False) for s in stored if s.ended is not None]
+    sessions.extend(
+        _session_dict(s, True) for s in live.values()
+        if s.started < end.timestamp() and s.ended >= start.timestamp()
+    )
+    sessions.sort(key=lambda s: s["start"])
+    return {
+        "device": device,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "sessions": sessions
+    }
+
+
+async def _daily(db: AsyncSession, device: Optional[str], first: date, last: date) -> Dict:
+    if last < first:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    if (last - first).days >= MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_DAYS} days per request")
+
+    totals = {
+        (row[0], row[1]): list(row[2:])
+        for row in await fetch_days_async(db, first, last, device)
+    }
+    # open sessions aren't in session_days yet, add their share so far
+    tz = ZoneInfo(settings.session_timezone)
+    for (live_device, day), agg in day_totals(await _open_sessions(db, device), tz).items():
+        if first <= day <= last:
+            row = totals.setdefault((live_device, day), [0.0, 0.0, 0, 0.0])
+            row[0] += agg[0]
+            row[1] += agg[1]
+            row[2] += agg[2]
+            row[3] = max(row[3], agg[3])
+
+    return {
+        "device": device,
+        "timezone": settings.session_timezone,
+        "from": first.isoformat(),
+        "to": last.isoformat(),
+        "days": [
+            {
+                "device": row_device or None,
+                "day": day.isoformat(),
+                "present_s": round(present_s, 1),
+                "away_s": round(away_s, 1),
+                "sessions": sessions,
+                "longest_present_s": round(longest, 1)
+            }
+            for (row_device, day), (present_s, away_s, sessions, longest) in sorted(totals.items())
+        ]
+    }
+
+
+@router.get("/daily")
+async def get_daily(
+    device: Optional[str] = None,
+    first: Optional[date] = Query(None, alias="from"),
+    last: Optional[date] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # time at / away from the desk per local day (session_timezone), last 7 days by default
+    today = datetime.now(ZoneInfo(settings.session_timezone)).date()
+    last = last or today
+    first = first or last - timedelta(days=6)
+    return await _daily(db, device, first, last)
+
+
+@router.get("/today")
+async def get_today(device: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    # "how long did I sit today"
+    today = datetime.now(ZoneInfo(settings.session_timezone)).date()
+    return await _daily(db, device, today, today)
@@ -0,0 +1,341 @@
+"""Vectorized analytics over raw readings (/readings/analytics).
+
+Values never become ORM objects or even python floats: postgres packs each
+sensor's ts and value columns into one bytea apiece (float8send() of every
+row, concatenated in ts order) and numpy reads those with np.frombuffer.
+That is one round trip and two buffers per LOAD_SLICE of the range, where
+`COPY ... (FORMAT binary)` hands psycopg one message per row and costs
+more in python than the query does in postgres. Everything after that works
+on whole arrays:
+
+- rolling mean/std over a trailing time window, from cumulative sums and
+  np.searchsorted, so O(n) whatever the window
+- count/mean/std/min/max and percentiles
+- z-score anomaly flags, each value against the window before it. The std
+  is floored at the sensor's noise (Settings.compression_tolerances) so a
+  flat signal moving by one step isn't an anomaly
+- dew point (Magnus) and heat index (NOAA) for samples that have both
+  temp_c and hum_pct
+
+A request covers at most MAX_SPAN and MAX_ROWS values over all its
+sensors, and one device: the rolling windows and the comfort join go by ts,
+so samples of two devices can't be mixed. Without device= the range must
+hold only one. Sensors are loaded and analysed one after the other (only
+temp_c and hum_pct are kept for the comfort join), and a worker runs one
+request at a time, the others wait for it.
+
+numpy is optional and only imported by the first request, asking for
+analytics without it raises AnalyticsError. python -m benchmarks.bench_analytics
+runs it on 10M samples.
+"""
+import importlib.util
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.config.settings import settings
+from app.db.db import get_engine
+from app.db.history import parse_bucket, to_db_time
+from app.db.persistence import SENSOR_UNITS
+
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+# bytea values top out at 1GB, a week at 10 Hz is ~50MB per column
+LOAD_SLICE = timedelta(days=7)
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# upper bounds for one request, a month at 10 Hz is ~27M values per sensor.
+# MAX_ROWS counts every sensor, a sensor's analysis holds ~10 float64 arrays
+# of its length so 10M values peak at a bit under 1GB
+MAX_SPAN = timedelta(days=31)
+MAX_ROWS = 10_000_000
+
+# one request at a time per worker, MAX_ROWS bounds one request's memory not several
+_running = threading.BoundedSemaphore(1)
+
+# narrow: one row per value, wide: the sensor is a column (callers only pass
+# names from persistence.SENSOR_UNITS)
+SERIES_SQL = """
+    SELECT string_agg(float8send(extract(epoch FROM ts)::float8), ''::bytea ORDER BY ts),
+           string_agg(float8send(value), ''::bytea ORDER BY ts),
+           min(coalesce(device, '')), max(coalesce(device, ''))
+    FROM readings
+    WHERE sensor = :sensor AND ts >= :start AND ts < :end
+      AND value IS NOT NULL {device_filter}
+"""
+WIDE_SERIES_SQL = """
+    SELECT string_agg(float8send(extract(epoch FROM ts)::float8), ''::bytea ORDER BY ts),
+           string_agg(float8send({column}::float8), ''::bytea ORDER BY ts),
+           min(coalesce(device, '')), max(coalesce(device, ''))
+    FROM samples
+    WHERE ts >= :start AND ts < :end AND {column} IS NOT NULL {device_filter}
+"""
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+def check_analytics():
+    if not HAS_NUMPY:
+        raise AnalyticsError("analytics needs numpy (pip install numpy)")
+
+
+def _numpy():
+    # imported on first use, like pyarrow in app.db.export
+    import numpy
+    return numpy
+
+
+def series_sql(sensor: str, device: Optional[str] = None) -> str:
+    if sensor not in SENSOR_UNITS:
+        raise AnalyticsError(f"Unknown sensor '{sensor}'")
+    device_filter = "AND device = :device" if device is not None else ""
+    if settings.storage_layout == "wide":
+        return WIDE_SERIES_SQL.format(column=sensor, device_filter=device_filter)
+    return SERIES_SQL.format(device_filter=device_filter)
+
+
+def check_range(start: datetime, end: datetime):
+    start, end = to_db_time(start), to_db_time(end)
+    if end <= start:
+        raise AnalyticsError("'to' must be after 'from'")
+    if end - start > MAX_SPAN:
+        raise AnalyticsError(f"Range is too long for analytics (more than {MAX_SPAN.days} days)")
+
+
+def load_series(conn: Connection, sensor: str, start: datetime, end: datetime,
+                device: Optional[str] = None, max_rows: int = MAX_ROWS):
+    """(epoch seconds, values) of one sensor in [start, end), float64 arrays in ts order.
+
+    Raises AnalyticsError past max_rows (checked per LOAD_SLICE) and, with no
+    device, when the range holds more than one.
+    """
+    np = _numpy()
+    query = text(series_sql(sensor, device))
+    start, end = to_db_time(start), to_db_time(end)
+    ts_parts, value_parts = [], []
+    devices = set()
+    rows = 0
+    while start < end:
+        upper = min(start + LOAD_SLICE, end)
+        ts_bytes, value_bytes, first_device, last_device = conn.execute(
+            query, {"sensor": sensor, "start": start, "end": upper, "device": device}
+        ).one()
+        if ts_bytes:
+            devices.update((first_device, last_device))
+            if len(devices) > 1:
+                raise AnalyticsError("Readings from more than one device in this range, pass device")
+            rows += len(ts_bytes) // 8
+            if rows > max_rows:
+                raise AnalyticsError(f"Too many values for analytics (at most {MAX_ROWS} per request, "
+                                     f"all sensors together), narrow the range or pick a sensor")
+            # float8send is big-endian
+            ts_parts.append(np.frombuffer(ts_bytes, dtype=">f8").astype(np.float64))
+            value_parts.append(np.frombuffer(value_bytes, dtype=">f8").astype(np.float64))
+        start = upper
+
+    if not ts_parts:
+        return np.empty(0), np.empty(0)
+    if len(ts_parts) == 1:
+        return ts_parts[0], value_parts[0]
+    return np.concatenate(ts_parts), np.concatenate(value_parts)
+
+
+def _window_sums(np, ts, values, window_s: float):
+    # window start per sample plus prefix sums of centered values (centered
+    # so the sums of squares keep their precision over millions of samples)
+    start = np.searchsorted(ts, ts - window_s, side="right")
+    offset = float(values.mean())
+    centered = values - offset
+    s1 = np.concatenate(([0.0], np.cumsum(centered)))
+    s2 = np.concatenate(([0.0], np.cumsum(centered * centered)))
+    return start, s1, s2, offset
+
+
+def _mean_std(np, s1, s2, lo, hi, offset):
+    # mean/std of samples [lo, hi) per element, nan where empty
+    count = (hi - lo).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (s1[hi] - s1[lo]) / count
+        var = np.maximum((s2[hi] - s2[lo]) / count - mean * mean, 0.0)
+    return mean + offset, np.sqrt(var), count
+
+
+def rolling_stats(ts, values, window_s: float):
+    """Mean and std of the trailing window (ts - window_s, ts] at every sample"""
+    np = _numpy()
+    start, s1, s2, offset = _window_sums(np, ts, values, window_s)
+    mean, std, _ = _mean_std(np, s1, s2, start, np.arange(1, len(values) + 1), offset)
+    return mean, std
+
+
+def zscores(ts, values, window_s: float, min_samples: int = settings.analytics_min_samples,
+            noise_floor: float = 0.0):
+    """z of every value against the window before it, nan with fewer than min_samples there"""
+    np = _numpy()
+    start, s1, s2, offset = _window_sums(np, ts, values, window_s)
+    mean, std, count = _mean_std(np, s1, s2, start, np.arange(len(values)), offset)
+    z = (values - mean) / np.maximum(std, noise_floor or np.finfo(np.float64).tiny)
+    z[count < min_samples] = np.nan
+    return z
+
+
+def dew_point(temp_c, hum_pct):
+    """Magnus formula, °C"""
+    np = _numpy()
+    a, b = 17.62, 243.12
+    gamma = np.log(np.clip(hum_pct, 0.1, 100.0) / 100.0) + a * temp_c / (b + temp_c)
+    return b * gamma / (a - gamma)
+
+
+def heat_index(temp_c, hum_pct):
+    """NOAA heat index (Rothfusz regression with its adjustments), °C"""
+    np = _numpy()
+    t = temp_c * 9.0 / 5.0 + 32.0
+    rh = np.clip(hum_pct, 0.0, 100.0)
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    full = (-42.379 + 2.04901523 * t + 10.14333127 * rh - 0.22475541 * t * rh
+            - 0.00683783 * t * t - 0.05481717 * rh * rh + 0.00122874 * t * t * rh
+            + 0.00085282 * t * rh * rh - 0.00000199 * t * t * rh * rh)
+    dry = (rh < 13.0) & (t >= 80.0) & (t <= 112.0)
+    with np.errstate(invalid="ignore"):
+        full = np.where(dry, full - (13.0 - rh) / 4.0 * np.sqrt((17.0 - np.abs(t - 95.0)) / 17.0), full)
+    humid = (rh > 85.0) & (t >= 80.0) & (t <= 87.0)
+    full = np.where(humid, full + (rh - 85.0) / 10.0 * (87.0 - t) / 5.0, full)
+    hi = np.where((simple + t) / 2.0 >= 80.0, full, simple)
+    return (hi - 32.0) * 5.0 / 9.0
+
+
+def summary(values) -> Optional[Dict]:
+    if not len(values):
+        return None
+    np = _numpy()
+    percentiles = np.percentile(values, PERCENTILES)
+    return {
+        "count": int(len(values)),
+        "mean": round(float(values.mean()), 4),
+        "std": round(float(values.std()), 4),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        **{f"p{p}": round(float(v), 4) for p, v in zip(PERCENTILES, percentiles)}
+    }
+
+
+def _thin(np, n: int, max_points: int):
+    # evenly spaced indices, the rolling series are smooth enough for that
+    if n <= max_points:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, max_points).astype(np.int64))
+
+
+def _ms(np, ts) -> List[int]:
+    return np.round(ts * 1000).astype(np.int64).tolist()
+
+
+def _rounded(np, values) -> List[Optional[float]]:
+    # nan isn't json, None is
+    values = np.round(values, 4)
+    return [None if v != v else v for v in values.tolist()]
+
+
+def sensor_analytics(ts, values, sensor: str, window_s: float, z: float,
+                     max_points: int, max_anomalies: int) -> Dict:
+    np = _numpy()
+    result = {"unit": SENSOR_UNITS[sensor], "stats": summary(values)}
+    if not len(values):
+        return {**result, "rolling": None, "anomalies": {"count": 0, "points": []}}
+
+    mean, std = rolling_stats(ts, values, window_s)
+    picks = _thin(np, len(values), max_points)
+    scores = zscores(ts, values, window_s, noise_floor=settings.compression_tolerances.get(sensor, 0.0))
+    with np.errstate(invalid="ignore"):
+        flagged = np.flatnonzero(np.abs(scores) > z)
+    # the strongest ones, back in time order
+    strongest = np.sort(flagged[np.argsort(-np.abs(scores[flagged]), kind="stable")[:max_anomalies]])
+    return {
+        **result,
+        "rolling": {
+            "ts": _ms(np, ts[picks]),
+            "mean": _rounded(np, mean[picks]),
+            "std": _rounded(np, std[picks])
+        },
+        "anomalies": {
+            "count": int(len(flagged)),
+            "points": [[t, v, s] for t, v, s in zip(
+                _ms(np, ts[strongest]), values[strongest].tolist(), _rounded(np, scores[strongest])
+            )]
+        }
+    }
+
+
+def comfort_analytics(temp: Tuple, hum: Tuple, max_points: int) -> Dict:
+    # temp_c and hum_pct of the same sample share its ts
+    np = _numpy()
+    (temp_ts, temp_values), (hum_ts, hum_values) = temp, hum
+    ts, ti, hi = np.intersect1d(temp_ts, hum_ts, assume_unique=False, return_indices=True)
+    dew = dew_point(temp_values[ti], hum_values[hi])
+    heat = heat_index(temp_values[ti], hum_values[hi])
+    picks = _thin(np, len(ts), max_points)
+    return {
+        "samples": int(len(ts)),
+        "dew_point_c": summary(dew),
+        "heat_index_c": summary(heat),
+        "series": {
+            "ts": _ms(np, ts[picks]),
+            "dew_point_c": _rounded(np, dew[picks]),
+            "heat_index_c": _rounded(np, heat[picks])
+        }
+    }
+
+
+def analyze(
+    conn: Connection,
+    start: datetime,
+    end: datetime,
+    device: Optional[str] = None,
+    sensors: Optional[Iterable[str]] = None,
+    window_s: float = parse_bucket(settings.analytics_window).total_seconds(),
+    z: float = settings.analytics_z,
+    max_points: int = 1000,
+    max_anomalies: int = 100
+) -> Dict:
+    """Everything /readings/analytics returns, check_analytics() first"""
+    check_range(start, end)
+    sensors = list(sensors or SENSOR_UNITS)
+    comfort = "temp_c" in sensors and "hum_pct" in sensors
+    started = time.perf_counter()
+    load_s = 0.0
+    samples = 0
+    kept = {}  # temp_c and hum_pct for the comfort join
+
+    # one sensor at a time, its arrays go before the next one loads
+    result = {"sensors": {}}
+    for sensor in sensors:
+        loading = time.perf_counter()
+        ts, values = load_series(conn, sensor, start, end, device, max_rows=MAX_ROWS - samples)
+        load_s += time.perf_counter() - loading
+        samples += len(values)
+        result["sensors"][sensor] = sensor_analytics(
+            ts, values, sensor, window_s, z, max_points, max_anomalies
+        )
+        if comfort and sensor in ("temp_c", "hum_pct"):
+            kept[sensor] = (ts, values)
+        del ts, values
+    if comfort:
+        result["comfort"] = comfort_analytics(kept.pop("temp_c"), kept.pop("hum_pct"), max_points)
+    result["samples"] = samples
+    result["load_ms"] = round(load_s * 1000, 1)
+    result["compute_ms"] = round((time.perf_counter() - started - load_s) * 1000, 1)
+    return result
+
+
+def run_analytics(*args, **kwargs) -> Dict:
+    # for the threadpool, on its own pooled connection once it's this request's turn
+    with _running, get_engine().connect() as conn:
+        return analyze(conn, *args, **kwargs)
@@ -0,0 +1,428 @@
+"""Bulk import of samples the ESP32 buffered while it was offline.
+
+Takes NDJSON, one sample per line in the same shape the device sends
+({"ts_ms":76336,"temp_c":17.8,...}) or the FileSink writes (which adds
+"ts_utc" and "device"):
+
+    python -m app.db.backfill esp32_log.ndjson --device desk-1
+    python -m app.db.backfill samples.ndjson.gz
+    python -m app.db.backfill esp32_log.ndjson --anchor 86400000@2024-05-02T10:00:00Z
+
+or POST it to /readings/import. How it works:
+
+1. Lines are parsed in order and COPYed, backfill_chunk_rows at a time, into
+   an unlogged staging table by backfill_workers threads in parallel. When
+   ts_ms jumps backwards the device rebooted, which starts a new "boot";
+   a jump from near 2**32 to near 0 is a millis() rollover and the boot
+   carries on (MillisCounter, staged as clock_ms).
+2. ts_ms is mapped to wall-clock time with a ClockModel per (device, boot),
+   fitted from the lines that carry a wall time (ts_utc / ts). If a boot has
+   none, its last boot falls back to --anchor, or to a model fitted from the
+   live rows already in the database for that device (same boot, so the
+   samples it buffered offline line up with the ones it sent live).
+   Boots that can't be mapped are skipped and reported.
+3. In one transaction: duplicates within the file are dropped, then rows
+   matching an existing (device, device_ts_ms) within
+   backfill_dedup_window_s. The rest is inserted with one INSERT ... SELECT
+   and merged into the rollups in the same transaction, added to what is
+   there like the live writer does, so the open hour and day keep the live
+   samples the api wrote meanwhile.
+
+Everything heavy happens in postgres, so millions of lines take seconds.
+"""
+import argparse
+import gzip
+import logging
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Deque, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.config.settings import settings
+from app.db.db import get_engine
+from app.db.maintenance import ensure_partitions
+from app.db.persistence import SENSOR_UNITS
+from app.db.rollups import EPOCH, ROLLUP_LEVELS
+from app.db.query_cache import query_cache
+from app.ingest.clock import BOOT_RESET_MS, ClockModel, MillisCounter
+from app.stream.bus import send_invalidations
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # optional speedup
+    import json
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+# live rows looked at to learn a device's current clock
+LIVE_ANCHOR_ROWS = 3000
+# device_ts_ms is the raw value (kept for dedup), clock_ms the same without rollovers
+STAGING_COLUMNS = ("device", "boot", "device_ts_ms", "clock_ms", "anchor_s", "temp_c", "hum_pct", "distance_cm")
+
+
+def _anchor_seconds(value) -> Optional[float]:
+    # wall time from a log line: ISO string or epoch seconds/milliseconds
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value / 1000.0 if value > 1e11 else float(value)
+    ts = datetime.fromisoformat(value)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+class _LineReader:
+    """Turns NDJSON lines into staging rows, tracking reboots per device"""
+
+    def __init__(self, device: Optional[str]):
+        self.device = device
+        self.lines = 0
+        self.invalid = 0
+        self.boots: Dict[Optional[str], int] = {}
+        self._counters: Dict[Optional[str], MillisCounter] = {}
+        self.boot_ranges: Dict[Tuple[Optional[str], int], List[int]] = {}  # -> [min ms, max ms]
+
+    def rows(self, lines: Iterable[bytes]):
+        for line in lines:
+            self.lines += 1
+            start = line.find(b"{")
+            if start < 0:
+                if line.strip():
+                    self.invalid += 1
+                continue
+            try:
+                data = _loads(line[start:])
+                device = data.get("device") or self.device
+                device_ts_ms = data.get("ts_ms", data.get("device_ts_ms"))
+                anchor_s = _anchor_seconds(data.get("ts_utc", data.get("ts")))
+                values = [data.get(name) for name in SENSOR_UNITS]
+                values = [None if v is None else float(v) for v in values]
+                device_ts_ms = None if device_ts_ms is None else int(device_ts_ms)
+            except (AttributeError, TypeError, ValueError):
+                self.invalid += 1
+                continue
+            if all(v is None for v in values) or (device_ts_ms is None and anchor_s is None):
+                self.invalid += 1
+                continue
+
+            boot = self.boots.setdefault(device, 0)
+            clock_ms = None
+            if device_ts_ms is not None:
+                counter = self._counters.get(device)
+                if counter is None:
+                    counter = self._counters[device] = MillisCounter()
+                clock_ms, _ = counter.update(device_ts_ms)
+                boot = self.boots[device] = counter.boot
+                span = self.boot_ranges.setdefault((device, boot), [clock_ms, clock_ms])
+                span[0] = min(span[0], clock_ms)
+                span[1] = max(span[1], clock_ms)
+            yield (device, boot, device_ts_ms, clock_ms, anchor_s, *values)
+
+
+def _copy_chunk(table: str, rows: List[Tuple]):
+    with get_engine().begin() as conn:
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            with cursor.copy(f"COPY {table} ({', '.join(STAGING_COLUMNS)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+        finally:
+            cursor.close()
+
+
+def _stage(table: str, rows: Iterable[Tuple], workers: int, chunk_rows: int) -> int:
+    # parsing stays on this thread, the COPYs overlap with it on the pool
+    staged = 0
+    pending: Deque = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill-copy") as pool:
+        chunk: List[Tuple] = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                pending.append(pool.submit(_copy_chunk, table, chunk))
+                staged += len(chunk)
+                chunk = []
+                # bounded, so a huge file never sits in memory
+                while len(pending) > workers * 2:
+                    pending.popleft().result()
+        if chunk:
+            pending.append(pool.submit(_copy_chunk, table, chunk))
+            staged += len(chunk)
+        while pending:
+            pending.popleft().result()
+    return staged
+
+
+def live_clock_model(conn: Connection, device: Optional[str],
+                     table: str) -> Optional[Tuple[ClockModel, int]]:
+    """Model of the device's current boot from its newest live rows, plus the highest ts_ms seen"""
+    rows = conn.execute(text(f"""
+        SELECT device_ts_ms, extract(epoch FROM ts)::float8
+        FROM {table}
+        WHERE coalesce(device, '') = :device AND device_ts_ms IS NOT NULL
+        ORDER BY ts DESC
+        LIMIT :limit
+    """), {"device": device or "", "limit": LIVE_ANCHOR_ROWS}).all()
+    if not rows:
+        return None
+    # newest first, stop where an earlier boot begins
+    pairs = [rows[0]]
+    for device_ts_ms, wall_s in rows[1:]:
+        if device_ts_ms > pairs[-1][0] + BOOT_RESET_MS:
+            break
+        pairs.append((device_ts_ms, wall_s))
+    return ClockModel.fit(pairs), rows[0][0]
+
+
+def _fit_models(conn: Connection, staging: str, reader: _LineReader, table: str,
+                anchor: Optional[Tuple[int, datetime]]) -> Dict[Tuple[Optional[str], int], ClockModel]:
+    # only boots with lines lacking a wall time need a model
+    groups = conn.execute(text(
+        f"SELECT DISTINCT device, boot FROM {staging} "
+        f"WHERE anchor_s IS NULL AND clock_ms IS NOT NULL"
+    )).all()
+    models = {}
+    for device, boot in groups:
+        result = conn.execute(text(
+            f"SELECT clock_ms, anchor_s FROM {staging} "
+            f"WHERE coalesce(device, '') = :device AND boot = :boot "
+            f"AND anchor_s IS NOT NULL AND clock_ms IS NOT NULL"
+        ), {"device": device or "", "boot": boot}, execution_options={"yield_per": 50_000})
+        model = ClockModel.fit(tuple(row) for row in result)
+        if model is None and boot == reader.boots.get(device):
+            if anchor is not None:
+                model = ClockModel.from_offset(anchor[0], anchor[1].timestamp())
+            else:
+                live = live_clock_model(conn, device, table)
+                # only if the log is from the boot the device is still on
+                if live and reader.boot_ranges[(device, boot)][1] <= live[1] + BOOT_RESET_MS:
+                    model = live[0]
+        if model is None:
+            logger.warning("Backfill: no clock for device %s boot %d, skipping it", device, boot)
+            continue
+        models[(device, boot)] = model
+    return models
+
+
+def _insert_sql(table: str) -> str:
+    if table == "samples":
+        columns = ", ".join(SENSOR_UNITS)
+        return f"""
+            INSERT INTO samples (ts, device_ts_ms, device, {columns})
+            SELECT ts, device_ts_ms, device, {columns} FROM backfill_rows
+        """
+    values = ", ".join(f"('{name}', m.{name}, '{unit}')" for name, unit in SENSOR_UNITS.items())
+    return f"""
+        INSERT INTO readings (ts, sensor, value, unit, device_ts_ms, device)
+        SELECT m.ts, v.sensor, v.value, v.unit, m.device_ts_ms, m.device
+        FROM backfill_rows m
+        CROSS JOIN LATERAL (VALUES {values}) AS v(sensor, value, unit)
+        WHERE v.value IS NOT NULL
+    """
+
+
+def _merge_rollups_sql(target: str) -> str:
+    # the inserted rows' aggregates added onto the existing buckets, sorted so
+    # rows are locked in the same order as the live writer's upsert
+    values = ", ".join(f"('{name}', m.{name})" for name in SENSOR_UNITS)
+    return f"""
+        INSERT INTO {target} (sensor, bucket, device, min, max, sum, count)
+        SELECT v.sensor, date_bin(:width, m.ts, :origin), coalesce(m.device, ''),
+               min(v.value), max(v.value), sum(v.value), count(*)
+        FROM backfill_rows m
+        CROSS JOIN LATERAL (VALUES {values}) AS v(sensor, value)
+        WHERE v.value IS NOT NULL
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+        ON CONFLICT (sensor, bucket, device) DO UPDATE SET
+            min = LEAST({target}.min, excluded.min),
+            max = GREATEST({target}.max, excluded.max),
+            sum = {target}.sum + excluded.sum,
+            count = {target}.count + excluded.count
+    """
+
+
+def _load(conn: Connection, staging: str, models: Dict, table: str) -> Dict:
+    conn.execute(text(
+        "CREATE TEMP TABLE backfill_clock (device text, boot int, intercept float8, slope float8) "
+        "ON COMMIT DROP"
+    ))
+    if models:
+        conn.execute(
+            text("INSERT INTO backfill_clock VALUES (:device, :boot, :intercept, :slope)"),
+            [{"device": device, "boot": boot, "intercept": m.intercept, "slope": m.slope}
+             for (device, boot), m in models.items()]
+        )
+
+    unmapped = conn.execute(text(f"""
+        SELECT count(*)
+        FROM {staging} s
+        LEFT JOIN backfill_clock c
+            ON coalesce(c.device, '') = coalesce(s.device, '') AND c.boot = s.boot
+        WHERE s.anchor_s IS NULL AND c.intercept IS NULL
+    """)).scalar()
+
+    # wall time for every line, one row per distinct sample
+    mapped = conn.execute(text(f"""
+        CREATE TEMP TABLE backfill_rows ON COMMIT DROP AS
+        SELECT DISTINCT ON (s.device, s.boot, s.clock_ms,
+                            CASE WHEN s.clock_ms IS NULL THEN s.anchor_s END)
+               to_timestamp(coalesce(s.anchor_s, c.intercept + c.slope * s.clock_ms))
+                   AT TIME ZONE 'UTC' AS ts,
+               s.device, s.device_ts_ms, {", ".join(f"s.{name}" for name in SENSOR_UNITS)}
+        FROM {staging} s
+        LEFT JOIN backfill_clock c
+            ON coalesce(c.device, '') = coalesce(s.device, '') AND c.boot = s.boot
+        WHERE s.anchor_s IS NOT NULL OR (s.clock_ms IS NOT NULL AND c.intercept IS NOT NULL)
+    """)).rowcount
+
+    expired = 0
+    if settings.retention_days > 0:
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=settings.retention_days)
+        expired = conn.execute(text("DELETE FROM backfill_rows WHERE ts < :cutoff"),
+                               {"cutoff": cutoff}).rowcount
+
+    first, last = conn.execute(text("SELECT min(ts), max(ts) FROM backfill_rows")).one()
+    duplicates = 0
+    if first is not None:
+        window = timedelta(seconds=settings.backfill_dedup_window_s)
+        params = {"window": window, "low": first - window, "high": last + window}
+        # two statements so each one stays a plain hash join
+        duplicates += conn.execute(text(f"""
+            DELETE FROM backfill_rows m
+            USING {table} r
+            WHERE r.ts >= :low AND r.ts <= :high
+              AND r.device_ts_ms = m.device_ts_ms
+              AND coalesce(r.device, '') = coalesce(m.device, '')
+              AND r.ts BETWEEN m.ts - :window AND m.ts + :window
+        """), params).rowcount
+        duplicates += conn.execute(text(f"""
+            DELETE FROM backfill_rows m
+            USING {table} r
+            WHERE m.device_ts_ms IS NULL AND r.ts >= :low AND r.ts <= :high
+              AND r.ts = m.ts AND coalesce(r.device, '') = coalesce(m.device, '')
+        """), params).rowcount
+        ensure_partitions(conn, first, last, parent=table)
+
+    inserted = conn.execute(text(_insert_sql(table))).rowcount
+    if settings.rollups_enabled and inserted:
+        for level in ROLLUP_LEVELS:
+            conn.execute(text(_merge_rollups_sql(level.table.name)),
+                         {"width": level.width, "origin": EPOCH})
+    return {
+        "unmapped": unmapped,
+        "mapped": mapped,
+        "expired": expired,
+        "existing_duplicates": duplicates,
+        "samples_inserted": mapped - expired - duplicates,
+        "rows_inserted": inserted,
+        "from": first,
+        "to": last
+    }
+
+
+def backfill_lines(
+    lines: Iterable[bytes],
+    device: Optional[str] = None,
+    anchor: Optional[Tuple[int, datetime]] = None,
+    workers: int = settings.backfill_workers,
+    chunk_rows: int = settings.backfill_chunk_rows
+) -> Dict:
+    """Import NDJSON lines, returns counts for every stage.
+
+    device is used for lines without one, anchor is a (ts_ms, wall time)
+    pair for the device's last boot in the file.
+    """
+    started = time.perf_counter()
+    table = "samples" if settings.storage_layout == "wide" else "readings"
+    staging = f"backfill_{uuid.uuid4().hex[:12]}"
+    reader = _LineReader(device)
+
+    with get_engine().begin() as conn:
+        conn.execute(text(
+            f"CREATE UNLOGGED TABLE {staging} (device text, boot int, device_ts_ms bigint, "
+            f"clock_ms bigint, anchor_s float8, {', '.join(f'{name} float8' for name in SENSOR_UNITS)})"
+        ))
+    try:
+        staged = _stage(staging, reader.rows(lines), workers, chunk_rows)
+        staged_at = time.perf_counter()
+        with get_engine().begin() as conn:
+            conn.execute(text(f"ANALYZE {staging}"))
+            models = _fit_models(conn, staging, reader, table, anchor)
+            result = _load(conn, staging, models, table)
+    finally:
+        with get_engine().begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+
+    loaded_at = time.perf_counter()
+    if result["rows_inserted"]:
+        # old buckets changed, cached ones included
+        query_cache.invalidate(result["from"])
+
+    return {
+        "lines": reader.lines,
+        "invalid": reader.invalid,
+        "staged": staged,
+        **{k: v for k, v in result.items() if k not in ("from", "to")},
+        "file_duplicates": staged - result["unmapped"] - result["mapped"],
+        "from": result["from"].replace(tzinfo=timezone.utc).isoformat() if result["from"] else None,
+        "to": result["to"].replace(tzinfo=timezone.utc).isoformat() if result["to"] else None,
+        "boots": sum(count + 1 for count in reader.boots.values()),
+        "clocks": {f"{d or ''}#{b}": m.to_dict() for (d, b), m in models.items()},
+        "stage_s": round(staged_at - started, 3),
+        "load_s": round(loaded_at - staged_at, 3),
+        "total_s": round(time.perf_counter() - started, 3)
+    }
+
+
+def backfill_file(f: BinaryIO, **kwargs) -> Dict:
+    # gzip is detected from the magic bytes, so .gz files and gzip uploads just work
+    if f.read(2) == b"\x1f\x8b":
+        f.seek(0)
+        f = gzip.GzipFile(fileobj=f, mode="rb")
+    else:
+        f.seek(0)
+    return backfill_lines(f, **kwargs)
+
+
+def _parse_anchor(value: str) -> Tuple[int, datetime]:
+    # "<ts_ms>@<ISO wall time>"
+    ms, _, wall = value.partition("@")
+    ts = datetime.fromisoformat(wall)
+    return int(ms), ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Import buffered ESP32 samples from NDJSON")
+    parser.add_argument("files", nargs="+", help="NDJSON files (.gz is fine), - for stdin")
+    parser.add_argument("--device", help="device id for lines that don't have one")
+    parser.add_argument("--anchor", type=_parse_anchor,
+                        help="TS_MS@ISO_TIME, a known wall time for the last boot in the log")
+    parser.add_argument("--workers", type=int, default=settings.backfill_workers)
+    parser.add_argument("--chunk-rows", type=int, default=settings.backfill_chunk_rows)
+    args = parser.parse_args()
+    if settings.ingest_mode == "bus":
+        # the api workers cache history too, the ingest process passes this on to them
+        query_cache.add_listener(send_invalidations)
+
+    for path in args.files:
+        options = dict(device=args.device, anchor=args.anchor,
+                       workers=args.workers, chunk_rows=args.chunk_rows)
+        if path == "-":
+            summary = backfill_lines(sys.stdin.buffer, **options)
+        else:
+            with open(path, "rb") as f:
+                summary = backfill_file(f, **options)
+        print(f"✓ {path}")
+        for key, value in summary.items():
+            print(f"  {key}: {value}")
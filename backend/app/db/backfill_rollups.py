@@ -0,0 +1,77 @@
+"""Backfill the 1m/1h/1d rollup tables from existing readings.
+
+Run this once after upgrading an existing database (or any time the
+rollups need rebuilding):
+
+    python -m app.db.backfill_rollups
+    python -m app.db.backfill_rollups --since 2024-01-01
+
+Buckets in the range are recomputed from scratch, so running it twice is
+safe. Only buckets that are over are rebuilt, each level up to the start of
+its own current bucket: the live writer adds to the open minute, hour and
+day, and overwriting those with a partial recount would lose its updates.
+The live writer keeps the rollups current from then on.
+"""
+import argparse
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.db.db import get_engine
+from app.db.history import raw_source
+from app.db.models import Base
+from app.db.rollups import EPOCH, ROLLUP_LEVELS, bucket_start
+
+UPSERT_SQL = """
+    INSERT INTO {target} (sensor, bucket, device, min, max, sum, count)
+    SELECT sensor, date_bin(:width, {ts_col}, :origin), coalesce(device, ''), {aggregates}
+    FROM {source}
+    WHERE {ts_col} >= :since AND {ts_col} < :before
+    GROUP BY 1, 2, 3
+    ON CONFLICT (sensor, bucket, device) DO UPDATE SET
+        min = excluded.min,
+        max = excluded.max,
+        sum = excluded.sum,
+        count = excluded.count
+"""
+
+RAW_AGGREGATES = "min(value), max(value), sum(value), count(*)"
+ROLLUP_AGGREGATES = "min(min), max(max), sum(sum), sum(count)"
+
+
+def backfill_rollups(since: Optional[datetime] = None, before: Optional[datetime] = None):
+    """Rebuild rollups for [since, before), each level from the one below it."""
+    coarsest = ROLLUP_LEVELS[-1].width
+    since = bucket_start(since, coarsest) if since else EPOCH
+    before = before or datetime.now(timezone.utc)
+
+    Base.metadata.create_all(bind=get_engine(), tables=[level.table for level in ROLLUP_LEVELS])
+
+    source, ts_col, aggregates = raw_source(), "ts", RAW_AGGREGATES
+    for level in ROLLUP_LEVELS:
+        print(f"Building {level.table.name}...")
+        with get_engine().begin() as conn:
+            result = conn.execute(
+                text(UPSERT_SQL.format(
+                    target=level.table.name, source=source,
+                    ts_col=ts_col, aggregates=aggregates
+                )),
+                # only whole buckets of this level, the live writer owns the current one
+                {"width": level.width, "origin": EPOCH, "since": since,
+                 "before": bucket_start(before, level.width)}
+            )
+        print(f"✓ {level.table.name}: {result.rowcount} buckets")
+        source, ts_col, aggregates = level.table.name, "bucket", ROLLUP_AGGREGATES
+
+
+def _parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill readings rollup tables")
+    parser.add_argument("--since", type=_parse_date, help="ISO date/time to start from")
+    parser.add_argument("--before", type=_parse_date, help="ISO date/time to stop at (default: now)")
+    args = parser.parse_args()
+    backfill_rollups(args.since, args.before)
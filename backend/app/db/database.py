@@ -1,13 +1,29 @@
+import asyncio
+
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
-from app.db.db import engine
+from app.config.settings import settings
+from app.db.db import get_async_engine, get_engine
 
 
 def check_db_connection() -> bool:
     """Check if database connection is working"""
     try:
-        with engine.connect() as conn:
+        with get_engine().connect() as conn:
             conn.execute(text("SELECT 1"))
         return True
     except SQLAlchemyError:
         return False
+
+
+async def check_db_connection_async(timeout: float = settings.db_health_timeout_s) -> bool:
+    """Same check without blocking the event loop, gives up after timeout seconds"""
+    async def ping():
+        async with get_async_engine().connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    try:
+        await asyncio.wait_for(ping(), timeout)
+        return True
+    except (SQLAlchemyError, OSError, asyncio.TimeoutError):
+        return False
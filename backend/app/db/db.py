@@ -1,26 +1,97 @@
-"""Database connection and session management"""
-from typing import Generator
+"""Database connection and session management
+
+Engines are created on first use, not at import: create_engine loads the
+psycopg driver, which is most of what importing the app would otherwise
+wait for. App code calls get_engine() / get_async_engine(); the old
+module attributes (engine, async_engine, SessionLocal, AsyncSessionLocal)
+still work for scripts and resolve through the same factories.
+"""
+import threading
+from typing import AsyncGenerator, Generator, Optional
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 from app.config.settings import settings
 
-# Create engine
-engine = create_engine(
-    settings.database_url,
-    echo=False,
-    pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=10
-)
+POOL_OPTIONS = {
+    "pool_pre_ping": True,
+    "pool_size": settings.db_pool_size,
+    "max_overflow": settings.db_max_overflow,
+    "pool_timeout": settings.db_pool_timeout_s,
+    "pool_recycle": settings.db_pool_recycle_s
+}
+
+_lock = threading.Lock()
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+_session_local: Optional[sessionmaker] = None
+_async_session_local: Optional[async_sessionmaker] = None
+
+
+def get_engine() -> Engine:
+    """Sync engine (writer thread, maintenance, scripts)"""
+    global _engine, _session_local
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                _session_local = sessionmaker(autocommit=False, autoflush=False)
+                _engine = create_engine(settings.database_url, echo=False, **POOL_OPTIONS)
+                _session_local.configure(bind=_engine)
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """Async engine for the api routes, same url (psycopg 3 does both)"""
+    global _async_engine, _async_session_local
+    if _async_engine is None:
+        with _lock:
+            if _async_engine is None:
+                engine = create_async_engine(settings.database_url, echo=False, **POOL_OPTIONS)
+                _async_session_local = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+                _async_engine = engine
+    return _async_engine
+
+
+def get_sessionmaker() -> sessionmaker:
+    get_engine()
+    return _session_local
 
-# Create session
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def get_async_sessionmaker() -> async_sessionmaker:
+    get_async_engine()
+    return _async_session_local
+
+
+def engines_created() -> bool:
+    # lets shutdown skip disposing what was never used
+    return _engine is not None or _async_engine is not None
+
+
+def __getattr__(name: str):
+    # engine, async_engine, SessionLocal, AsyncSessionLocal, created on first access
+    factories = {
+        "engine": get_engine,
+        "async_engine": get_async_engine,
+        "SessionLocal": get_sessionmaker,
+        "AsyncSessionLocal": get_async_sessionmaker,
+    }
+    if name in factories:
+        return factories[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_db() -> Generator[Session, None, None]:
     """Dependency to get database session"""
-    db = SessionLocal()
+    db = get_sessionmaker()()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """Dependency to get an async database session"""
+    async with get_async_sessionmaker()() as db:
+        yield db
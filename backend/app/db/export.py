@@ -0,0 +1,237 @@
+"""Bulk export of raw readings as CSV, Parquet or Arrow.
+
+Every export is a generator of byte chunks meant for a StreamingResponse,
+so memory use stays flat no matter how long the range is:
+
+- csv goes through postgres `COPY (...) TO STDOUT`, the rows never become
+  python objects, the chunks are just regrouped into bigger blocks
+- parquet and arrow read from a server-side cursor, EXPORT_CHUNK_ROWS at a
+  time, and each chunk becomes one record batch (one row group for parquet)
+  that is handed on as soon as it's encoded
+
+Rows come out in ts order in the long shape (ts, device, sensor, value,
+device_ts_ms) for either storage layout. Timestamps are UTC.
+
+pyarrow (parquet, arrow) and zstandard (zstd) are optional, asking for them
+when they are not installed raises ExportError. pyarrow is only imported by
+the first parquet/arrow export, it takes longer to load than the rest of
+the app.
+"""
+import importlib.util
+import zlib
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.db.history import raw_source, to_db_time
+from app.db.persistence import SENSOR_UNITS
+
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None  # only needed for parquet/arrow
+
+try:
+    import zstandard
+except ImportError:  # only needed for zstd
+    zstandard = None
+
+EXPORT_FORMATS = {
+    # format -> (media type, file extension)
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+EXPORT_CHUNK_ROWS = 50_000
+CSV_BLOCK_BYTES = 256 * 1024
+
+EXPORT_SQL = """
+    SELECT {ts}, device, sensor, value, device_ts_ms
+    FROM {source}
+    WHERE ts >= {start} AND ts < {end} {filters}
+    ORDER BY ts
+"""
+
+
+class ExportError(ValueError):
+    pass
+
+
+def check_export(fmt: str, compression: str, sensor: Optional[str] = None):
+    """Raises ExportError for anything export_chunks() can't produce"""
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"Unknown format '{fmt}'. Expected one of: {', '.join(EXPORT_FORMATS)}")
+    if compression not in COMPRESSIONS:
+        raise ExportError(
+            f"Unknown compression '{compression}'. Expected one of: {', '.join(COMPRESSIONS)}"
+        )
+    if sensor is not None and sensor not in SENSOR_UNITS:
+        raise ExportError(f"Unknown sensor '{sensor}'")
+    if fmt != "csv" and not HAS_PYARROW:
+        raise ExportError(f"{fmt} export needs pyarrow (pip install pyarrow)")
+    if compression == "zstd" and zstandard is None:
+        raise ExportError("zstd compression needs zstandard (pip install zstandard)")
+
+
+def export_filename(fmt: str, compression: str, start: datetime, end: datetime) -> str:
+    name = f"deskbuddy_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.{EXPORT_FORMATS[fmt][1]}"
+    # parquet compresses its own pages, the others get a compressed stream
+    if fmt != "parquet" and compression == "gzip":
+        name += ".gz"
+    elif fmt != "parquet" and compression == "zstd":
+        name += ".zst"
+    return name
+
+
+def export_media_type(fmt: str, compression: str) -> str:
+    if fmt != "parquet" and compression == "gzip":
+        return "application/gzip"
+    if fmt != "parquet" and compression == "zstd":
+        return "application/zstd"
+    return EXPORT_FORMATS[fmt][0]
+
+
+def _filters(device: Optional[str], sensor: Optional[str], placeholder) -> Tuple[str, Dict]:
+    clauses, params = [], {}
+    if device is not None:
+        clauses.append(f"AND device = {placeholder('device')}")
+        params["device"] = device
+    if sensor is not None:
+        clauses.append(f"AND sensor = {placeholder('sensor')}")
+        params["sensor"] = sensor
+    return " ".join(clauses), params
+
+
+def export_chunks(
+    conn: Connection,
+    fmt: str,
+    start: datetime,
+    end: datetime,
+    device: Optional[str] = None,
+    sensor: Optional[str] = None,
+    compression: str = "none"
+) -> Iterator[bytes]:
+    """Byte chunks of the whole export, check_export() first"""
+    if fmt == "csv":
+        chunks = _csv_chunks(conn, start, end, device, sensor)
+    else:
+        chunks = _arrow_chunks(conn, fmt, start, end, device, sensor, compression)
+    if fmt == "parquet" or compression == "none":
+        return chunks
+    return _compressed(chunks, compression)
+
+
+def _csv_chunks(conn: Connection, start, end, device, sensor) -> Iterator[bytes]:
+    filters, params = _filters(device, sensor, lambda name: f"%({name})s")
+    query = EXPORT_SQL.format(
+        ts="""to_char(ts, 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"') AS ts""",
+        source=raw_source(), start="%(start)s", end="%(end)s", filters=filters
+    )
+    params.update(start=to_db_time(start), end=to_db_time(end))
+
+    # COPY hands back one message per row, regroup them into bigger blocks
+    block = bytearray()
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        with cursor.copy(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", params) as copy:
+            for data in copy:
+                block += data
+                if len(block) >= CSV_BLOCK_BYTES:
+                    yield bytes(block)
+                    block.clear()
+    finally:
+        cursor.close()
+    if block:
+        yield bytes(block)
+
+
+class _ChunkSink:
+    # file-like target for the pyarrow writers, collects what they write until drained
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _pyarrow():
+    # imported on first use, see above
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    return pyarrow
+
+
+def _arrow_schema(pyarrow):
+    return pyarrow.schema([
+        ("ts", pyarrow.timestamp("us", tz="UTC")),
+        ("device", pyarrow.string()),
+        ("sensor", pyarrow.string()),
+        ("value", pyarrow.float64()),
+        ("device_ts_ms", pyarrow.int64()),
+    ])
+
+
+def _arrow_chunks(conn: Connection, fmt, start, end, device, sensor, compression) -> Iterator[bytes]:
+    filters, params = _filters(device, sensor, lambda name: f":{name}")
+    query = EXPORT_SQL.format(
+        ts="ts", source=raw_source(), start=":start", end=":end", filters=filters
+    )
+    params.update(start=to_db_time(start), end=to_db_time(end))
+
+    pyarrow = _pyarrow()
+    schema = _arrow_schema(pyarrow)
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(sink, schema, compression=compression)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+
+    # named (server-side) cursor, only one chunk of rows is in memory at a time
+    result = conn.execution_options(yield_per=EXPORT_CHUNK_ROWS).execute(text(query), params)
+    try:
+        for rows in result.partitions(EXPORT_CHUNK_ROWS):
+            columns = list(zip(*rows))
+            batch = pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            )
+            writer.write_batch(batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        result.close()
+    writer.close()
+    yield sink.drain()
+
+
+def _compressed(chunks: Iterator[bytes], compression: str) -> Iterator[bytes]:
+    if compression == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = gzip header
+    else:
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,372 @@
+"""Time-bucketed history queries over the raw readings (either layout).
+
+Aggregation runs in postgres (date_bin over the ts/sensor index, or over
+the matching rollup tables) and the results come back as plain tuples,
+never ORM objects. With rollups the range is split by rollup_segments and
+the pieces are merged back into the requested buckets, so the buckets at
+a range edge that isn't aligned hold the same samples as without rollups.
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import TextClause, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config.settings import settings
+from app.db.persistence import SENSOR_UNITS
+from app.db.query_cache import BLOCK_BUCKETS, CLOSE_AFTER, QueryCache, points_size, query_cache
+from app.db.rollups import bucket_start, pick_rollup, rollup_rows_sql, rollup_segments
+
+BUCKET_PATTERN = re.compile(r"^(\d+)\s*(s|m|h|d)$")
+BUCKET_UNITS = {
+    "s": timedelta(seconds=1),
+    "m": timedelta(minutes=1),
+    "h": timedelta(hours=1),
+    "d": timedelta(days=1),
+}
+
+# upper bound on buckets postgres is asked to produce for one request
+MAX_BUCKETS = 100_000
+
+BUCKET_ORIGIN = datetime(1970, 1, 1)
+
+# a range ending this close to now gets its last bucket whole from the
+# cache, nothing later than now is in it yet
+OPEN_END_SLACK = timedelta(seconds=1)
+
+HISTORY_SQL = """
+    SELECT date_bin(:bucket, ts, :origin) AS bucket,
+           min(value) AS min,
+           max(value) AS max,
+           avg(value) AS avg,
+           count(*) AS count
+    FROM readings
+    WHERE ts >= :start AND ts < :end AND sensor = :sensor {device_filter}
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+# wide layout: the sensor is a column, so it is spliced in (callers only pass
+# names from persistence.SENSOR_UNITS)
+WIDE_HISTORY_SQL = """
+    SELECT date_bin(:bucket, ts, :origin) AS bucket,
+           min({column}) AS min,
+           max({column}) AS max,
+           avg({column}) AS avg,
+           count({column}) AS count
+    FROM samples
+    WHERE ts >= :start AND ts < :end AND {column} IS NOT NULL {device_filter}
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+# the pieces of a rollup-backed query as (ts, min, max, sum, count) rows,
+# merged into the requested buckets
+SEGMENTED_HISTORY_SQL = """
+    SELECT date_bin(:bucket, ts, :origin) AS bucket,
+           min(min) AS min,
+           max(max) AS max,
+           sum(sum) / sum(count) AS avg,
+           sum(count)::bigint AS count
+    FROM ({rows}) AS parts
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+RAW_ROWS_SQL = """
+        SELECT ts, value AS min, value AS max, value AS sum, 1 AS count
+        FROM readings
+        WHERE sensor = :sensor AND ts >= :start_{n} AND ts < :end_{n} {device_filter}"""
+
+WIDE_RAW_ROWS_SQL = """
+        SELECT ts, {column}::float8 AS min, {column}::float8 AS max, {column}::float8 AS sum, 1 AS count
+        FROM samples
+        WHERE ts >= :start_{n} AND ts < :end_{n} AND {column} IS NOT NULL {device_filter}"""
+
+
+def raw_source(layout: Optional[str] = None) -> str:
+    """FROM-clause exposing (id, ts, sensor, value, device_ts_ms, device) for either layout."""
+    if (layout or settings.storage_layout) != "wide":
+        return "readings"
+    values = ", ".join(f"('{name}', s.{name}::float8)" for name in SENSOR_UNITS)
+    return f"""(
+        SELECT s.id, s.ts, v.sensor, v.value, s.device_ts_ms, s.device
+        FROM samples s
+        CROSS JOIN LATERAL (VALUES {values}) AS v(sensor, value)
+        WHERE v.value IS NOT NULL
+    ) AS readings"""
+
+
+def raw_history_sql(sensor: str, device: Optional[str] = None, layout: Optional[str] = None):
+    device_filter = "AND device = :device" if device is not None else ""
+    if (layout or settings.storage_layout) != "wide":
+        return text(HISTORY_SQL.format(device_filter=device_filter))
+    if sensor not in SENSOR_UNITS:
+        raise ValueError(f"Unknown sensor '{sensor}'")
+    return text(WIDE_HISTORY_SQL.format(column=sensor, device_filter=device_filter))
+
+
+def segmented_history_sql(sensor: str, segments: List, device: Optional[str] = None,
+                          layout: Optional[str] = None) -> Tuple[TextClause, Dict]:
+    """History query over rollup_segments() output, plus the per-segment params"""
+    device_filter = "AND device = :device" if device is not None else ""
+    wide = (layout or settings.storage_layout) == "wide"
+    if wide and sensor not in SENSOR_UNITS:
+        raise ValueError(f"Unknown sensor '{sensor}'")
+    rows, params = [], {}
+    for n, (level, start, end) in enumerate(segments):
+        if level is not None:
+            rows.append(rollup_rows_sql(level, n, device))
+        elif wide:
+            rows.append(WIDE_RAW_ROWS_SQL.format(column=sensor, n=n, device_filter=device_filter))
+        else:
+            rows.append(RAW_ROWS_SQL.format(n=n, device_filter=device_filter))
+        params[f"start_{n}"], params[f"end_{n}"] = start, end
+    return text(SEGMENTED_HISTORY_SQL.format(rows="\n        UNION ALL".join(rows))), params
+
+
+@dataclass
+class HistoryPoint:
+    ts: datetime
+    min: float
+    max: float
+    avg: float
+    count: int
+
+    def to_dict(self) -> Dict:
+        return {
+            "ts": self.ts.replace(tzinfo=timezone.utc).isoformat(),
+            "min": self.min,
+            "max": self.max,
+            "avg": self.avg,
+            "count": self.count
+        }
+
+
+def parse_bucket(value: str) -> timedelta:
+    """Parse a bucket width like '30s', '1m', '5m', '1h' or '1d'."""
+    match = BUCKET_PATTERN.match(value.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid bucket '{value}', expected e.g. 30s, 1m, 1h, 1d")
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+
+
+def to_db_time(value: datetime) -> datetime:
+    """readings.ts is naive UTC, so convert aware datetimes to match."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def history_query(
+    sensor: str,
+    start: datetime,
+    end: datetime,
+    bucket: timedelta,
+    device: Optional[str] = None
+) -> Tuple[TextClause, Dict]:
+    """Validate the range and build the bucketed query (raw or rollup) with its params."""
+    start, end = to_db_time(start), to_db_time(end)
+    if end <= start:
+        raise ValueError("'to' must be after 'from'")
+    if (end - start) / bucket > MAX_BUCKETS:
+        raise ValueError(
+            f"Bucket {bucket} is too small for this range "
+            f"(more than {MAX_BUCKETS} buckets)"
+        )
+
+    sql = raw_history_sql(sensor, device)
+    params = {}
+    level = pick_rollup(bucket) if settings.rollups_enabled else None
+    if level is not None:
+        # whole rollup buckets only, the partial ones at the edges come from finer data
+        sql, params = segmented_history_sql(sensor, rollup_segments(level, start, end), device)
+
+    return sql, {
+        "bucket": bucket,
+        "origin": BUCKET_ORIGIN,
+        "start": start,
+        "end": end,
+        "sensor": sensor,
+        "device": device,
+        **params
+    }
+
+
+def fetch_history(
+    db: Session,
+    sensor: str,
+    start: datetime,
+    end: datetime,
+    bucket: timedelta,
+    device: Optional[str] = None
+) -> List[HistoryPoint]:
+    """Return min/max/avg/count per bucket for one sensor in [start, end).
+
+    With no device the buckets cover every device.
+    """
+    sql, params = history_query(sensor, start, end, bucket, device)
+    return [HistoryPoint(*row) for row in db.execute(sql, params)]
+
+
+async def fetch_history_async(
+    db: AsyncSession,
+    sensor: str,
+    start: datetime,
+    end: datetime,
+    bucket: timedelta,
+    device: Optional[str] = None
+) -> List[HistoryPoint]:
+    """fetch_history for the api routes (AsyncSession)."""
+    sql, params = history_query(sensor, start, end, bucket, device)
+    result = await db.execute(sql, params)
+    return [HistoryPoint(*row) for row in result]
+
+
+async def fetch_history_cached_async(
+    db: AsyncSession,
+    sensor: str,
+    start: datetime,
+    end: datetime,
+    bucket: timedelta,
+    device: Optional[str] = None,
+    cache: Optional[QueryCache] = None
+) -> List[HistoryPoint]:
+    """fetch_history_async through the query cache (app.db.query_cache).
+
+    Whole buckets come from cached blocks. A partial first or last bucket,
+    when the range doesn't start or end on a bucket boundary, is queried
+    directly, so the result is the same as fetch_history_async's (rollups
+    or not, see rollup_segments).
+    """
+    cache = cache or query_cache
+    history_query(sensor, start, end, bucket, device)  # same validation as uncached
+    start, end = to_db_time(start), to_db_time(end)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    first = bucket_start(start, bucket)
+    if first < start:
+        first += bucket
+    last = bucket_start(end, bucket)
+    if last < end and end >= now - OPEN_END_SLACK:
+        last += bucket
+    if not cache.enabled or last <= first or (last - first) / bucket > MAX_BUCKETS - 2 * BLOCK_BUCKETS:
+        return await fetch_history_async(db, sensor, start, end, bucket, device)
+
+    points = []
+    if start < first:
+        points += await fetch_history_async(db, sensor, start, first, bucket, device)
+    points += await _fetch_blocks(db, cache, sensor, first, last, bucket, device, now)
+    if last < end:
+        points += await fetch_history_async(db, sensor, last, end, bucket, device)
+    return points
+
+
+async def _fetch_blocks(db: AsyncSession, cache: QueryCache, sensor: str, first: datetime,
+                        last: datetime, bucket: timedelta, device: Optional[str],
+                        now: datetime) -> List[HistoryPoint]:
+    # whole buckets in [first, last), cached per block, one query per run of missing blocks
+    span = bucket * BLOCK_BUCKETS
+    width_s = bucket.total_seconds()
+    blocks = []
+    block = bucket_start(first, span)
+    while block < last:
+        blocks.append(block)
+        block += span
+
+    cached = {block: cache.get((device, sensor, width_s, block)) for block in blocks}
+    runs: List[List[datetime]] = []
+    for block in blocks:
+        if cached[block] is not None:
+            continue
+        if runs and runs[-1][-1] + span == block:
+            runs[-1].append(block)
+        else:
+            runs.append([block])
+
+    for run in runs:
+        version = cache.version()
+        fetched = await fetch_history_async(db, sensor, run[0], run[-1] + span, bucket, device)
+        by_block: Dict[datetime, List[HistoryPoint]] = {block: [] for block in run}
+        for point in fetched:
+            by_block[bucket_start(point.ts, span)].append(point)
+        for block, block_points in by_block.items():
+            # closed once nothing on its way through the live path can land in it,
+            # only late writes (invalidated on commit) change it after that
+            cache.put((device, sensor, width_s, block), block_points, block + span,
+                      block + span <= now - CLOSE_AFTER, version, points_size(block_points))
+            cached[block] = block_points
+
+    return [point for block in blocks for point in cached[block] if first <= point.ts < last]
+
+
+async def fetch_recent_async(db: AsyncSession, since: datetime) -> List[Tuple[str, str, float, float]]:
+    """(device, sensor, epoch seconds, value) for every raw reading since `since`, oldest first."""
+    result = await db.execute(text(f"""
+        SELECT coalesce(device, ''), sensor,
+               extract(epoch FROM ts)::float8, value
+        FROM {raw_source()}
+        WHERE ts >= :since
+        ORDER BY ts
+    """), {"since": to_db_time(since)})
+    return result.all()
+
+
+def lttb_indices(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Picks `threshold` indices that keep the visual shape of the series,
+    always including the first and last point.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # average point of the next bucket
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        # point in the current bucket forming the largest triangle with a
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        best_area = -1.0
+        best = range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+
+        selected.append(best)
+        a = best
+
+    selected.append(n - 1)
+    return selected
+
+
+def downsample(points: List[HistoryPoint], max_points: int) -> List[HistoryPoint]:
+    """Reduce buckets to at most max_points using LTTB on the bucket averages."""
+    if len(points) <= max_points:
+        return points
+    xs = [p.ts.timestamp() for p in points]
+    ys = [p.avg for p in points]
+    return [points[i] for i in lttb_indices(xs, ys, max_points)]
+
+
+def default_range(start: Optional[datetime], end: Optional[datetime]):
+    # last 24h unless told otherwise
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(hours=24)
+    return start, end
@@ -3,6 +3,7 @@
 Run this once to create all tables from models.
 """
 from app.db.db import engine
+from app.db.maintenance import PARTITIONED_TABLES, ensure_partitions
 from app.db.models import Base
 
 
@@ -10,6 +11,9 @@ def init_db():
     """Create all database tables."""
     print("Creating database tables...")
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for parent in PARTITIONED_TABLES:
+            ensure_partitions(conn, parent=parent)
     print("✓ Database tables created successfully")
 
 
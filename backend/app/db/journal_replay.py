@@ -0,0 +1,274 @@
+"""Drains the sample journal (app.ingest.journal) into the database.
+
+Takes the place of the in-memory write-behind queue when Settings.journal_dir
+is set. The serial thread only appends to the journal. This replayer thread
+reads batches from the last committed offset and writes them through the
+usual persistence path. The new offset goes into journal_offsets in the
+same transaction, so after a crash or restart it resumes exactly where the
+database left off, with no gaps and no duplicates. While postgres is
+unreachable it backs off and retries, and the journal keeps growing on
+disk in the meantime.
+
+Only connection-level errors are retried. A batch the database rejects (a
+DataError, a row with no partition to go to) would fail the same way
+forever, so it is replayed one sample at a time, and the samples that
+still fail are appended to rejected.ndjson in the journal directory
+(importable with app.db.backfill once fixed) and skipped.
+
+It has the same start/stop/submit/get_stats interface as ReadingWriter, so
+DbSink can drive either one.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError, TimeoutError
+
+from app import metrics
+from app.config.settings import settings
+from app.db.db import get_engine
+from app.db.models import JournalOffset
+from app.db.persistence import build_rows, persist_reading_rows, rows_committed
+from app.db.write_behind import reading_writer
+from app.ingest.journal import Journal
+from app.serial.parser import Sample
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF_S = 30.0
+REJECTED_FILE = "rejected.ndjson"
+
+# the database being away or busy, worth retrying as is. The COPY path raises
+# the driver's errors unwrapped, so those are told apart by SQLSTATE class:
+# connection, transaction rollback (serialization, deadlock), resources,
+# operator intervention (shutdown), system error
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, TimeoutError)
+TRANSIENT_SQLSTATE_CLASSES = ("08", "40", "53", "57", "58")
+
+
+def is_db_error(error: Exception) -> bool:
+    # DB-API errors carry a sqlstate (None when the server never answered)
+    return isinstance(error, SQLAlchemyError) or hasattr(error, "sqlstate")
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, TRANSIENT_ERRORS) or getattr(error, "connection_invalidated", False):
+        return True
+    sqlstate = getattr(getattr(error, "orig", None) or error, "sqlstate", None)
+    return sqlstate is None or sqlstate[:2] in TRANSIENT_SQLSTATE_CLASSES
+
+
+def load_committed_offset(conn: Connection, journal_id: str) -> Optional[int]:
+    return conn.execute(
+        select(JournalOffset.committed_offset).where(JournalOffset.journal_id == journal_id)
+    ).scalar()
+
+
+def store_committed_offset(conn: Connection, journal_id: str, offset: int):
+    stmt = pg_insert(JournalOffset.__table__).values(
+        journal_id=journal_id, committed_offset=offset,
+        updated_at=datetime.now(timezone.utc).replace(tzinfo=None)
+    )
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=["journal_id"],
+        set_={"committed_offset": stmt.excluded.committed_offset,
+              "updated_at": stmt.excluded.updated_at}
+    ))
+
+
+class JournalReplayer:
+    """Journal-backed replacement for ReadingWriter"""
+
+    def __init__(
+        self,
+        journal: Journal,
+        batch_size: int = settings.write_batch_size,
+        flush_interval_ms: int = settings.write_flush_interval_ms
+    ):
+        self.journal = journal
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.committed: Optional[int] = None  # unknown until the db answers
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # counters, rows like ReadingWriter so /health looks the same
+        self._rows_written = 0
+        self._samples_written = 0
+        self._flushes = 0
+        self._failures = 0
+        self._last_error: Optional[str] = None
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._backoff = 0.0
+        self._rejected = 0
+        self._isolate_until = 0  # offsets below this are replayed one sample at a time
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        if not self.journal.is_open:
+            self.journal.open()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="journal-replayer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        # one last attempt to write what's left, the rest stays in the journal
+        self._stopping.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                logger.warning("Journal replayer did not finish in %.1fs", timeout)
+        self._thread = None
+        self.journal.close()
+
+    def submit(self, sample: Sample) -> bool:
+        # serial thread: one file append, never waits on the database
+        self.journal.append(sample)
+        return True
+
+    def pending(self) -> Optional[int]:
+        if self.committed is None:
+            return None
+        return self.journal.next_offset - max(self.committed, self.journal.first_offset)
+
+    def _run(self):
+        while True:
+            stopping = self._stopping.is_set()
+            try:
+                self.journal.flush()
+                if self.committed is None:
+                    self._load_offset()
+                while self._replay_batch():
+                    pass
+                self._backoff = 0.0
+            except Exception as e:
+                self._retry_later(e)
+                if isinstance(e, OSError) or is_db_error(e):
+                    logger.error("Journal replay failed, retrying in %.1fs: %s", self._backoff, e)
+                else:
+                    # a bug, not the database: keep the thread, the journal keeps everything
+                    logger.exception("Journal replay failed, retrying in %.1fs", self._backoff)
+            if stopping:
+                return
+            self._wake.wait(self._backoff or self.flush_interval)
+            self._wake.clear()
+
+    def _retry_later(self, error: Exception):
+        self._failures += 1
+        self._last_error = str(error)
+        self._backoff = min(MAX_BACKOFF_S, max(self.flush_interval, self._backoff * 2))
+
+    def _load_offset(self):
+        with get_engine().begin() as conn:
+            JournalOffset.__table__.create(conn, checkfirst=True)
+            committed = load_committed_offset(conn, self.journal.journal_id)
+        self.committed = committed if committed is not None else self.journal.first_offset
+        logger.info("Journal replay resumes at offset %d (journal at %d)",
+                    self.committed, self.journal.next_offset)
+
+    def _replay_batch(self) -> bool:
+        """Writes one batch, returns True if there may be more"""
+        # one at a time while looking for the sample(s) a batch was rejected for
+        limit = 1 if self.committed < self._isolate_until else self.batch_size
+        samples, next_offset = self.journal.read(self.committed, limit)
+        if next_offset == self.committed:
+            return False
+
+        rows = [row for sample in samples for row in build_rows(sample)]
+        started = time.perf_counter()
+        try:
+            with get_engine().connect() as conn:
+                metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+                with conn.begin():
+                    persist_reading_rows(conn, rows)
+                    store_committed_offset(conn, self.journal.journal_id, next_offset)
+        except Exception as e:
+            if not is_db_error(e):
+                raise
+            metrics.DB_FAILURES.inc()
+            if is_transient(e) or not samples:
+                raise
+            if len(samples) > 1:
+                # find the bad sample(s): replay this stretch one at a time
+                logger.warning("Journal replay: batch at offset %d rejected, replaying it sample by sample: %s",
+                               self.committed, getattr(e, "orig", e))
+                self._isolate_until = next_offset
+                return True
+            self._reject(samples, next_offset, e)
+            return True
+        rows_committed(rows)
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        metrics.DB_FLUSH_SECONDS.observe(elapsed_ms / 1000.0)
+        metrics.DB_ROWS.inc(len(rows))
+        if metrics.ENABLED and samples:
+            oldest = samples[0].ts
+            metrics.DB_COMMIT_LAG_SECONDS.observe((datetime.now(timezone.utc) - oldest).total_seconds())
+
+        self.committed = next_offset
+        self.journal.release(next_offset)
+        with self._lock:
+            self._rows_written += len(rows)
+            self._samples_written += len(samples)
+            self._flushes += 1
+            self._last_flush_ms = elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+        return len(samples) == limit
+
+    def _reject(self, samples, next_offset: int, error: Exception):
+        # quarantine, then move the offset past it so the journal doesn't stall
+        with open(os.path.join(self.journal.directory, REJECTED_FILE), "a", encoding="utf-8") as f:
+            for sample in samples:
+                f.write(json.dumps(sample.to_dict()) + "\n")
+        with get_engine().begin() as conn:
+            store_committed_offset(conn, self.journal.journal_id, next_offset)
+        self.committed = next_offset
+        self.journal.release(next_offset)
+        with self._lock:
+            self._rejected += len(samples)
+            self._last_error = str(error)
+        logger.error("Journal replay: skipped %d sample(s) the database rejected, kept in %s: %s",
+                     len(samples), REJECTED_FILE, getattr(error, "orig", error))
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "mode": "journal",
+                "committed_offset": self.committed,
+                "pending_samples": self.pending(),
+                "samples_written": self._samples_written,
+                "rows_written": self._rows_written,
+                "flushes": self._flushes,
+                "last_flush_ms": round(self._last_flush_ms, 3),
+                "max_flush_ms": round(self._max_flush_ms, 3),
+                "failures": self._failures,
+                "rejected_samples": self._rejected,
+                "last_error": self._last_error,
+                "retry_in_s": self._backoff,
+                "journal": self.journal.get_stats()
+            }
+
+
+def create_db_writer():
+    """JournalReplayer when Settings.journal_dir is set, else the in-memory write-behind queue"""
+    if not settings.journal_dir:
+        return reading_writer
+    journal = Journal(
+        settings.journal_dir,
+        segment_bytes=settings.journal_segment_mb * 1024 * 1024,
+        max_bytes=settings.journal_max_mb * 1024 * 1024,
+        fsync=settings.journal_fsync
+    )
+    return JournalReplayer(journal)
@@ -0,0 +1,206 @@
+"""Partition and retention maintenance for the raw reading tables.
+
+On postgres `readings` (and `samples`, the wide layout) is partitioned by
+range on ts (one partition per day or month, see
+Settings.partition_interval). This module creates
+partitions ahead of time and drops whole partitions once they are older
+than Settings.retention_days, so inserts and vacuum only ever touch a
+few small tables.
+
+Run it by hand with:
+
+    python -m app.db.maintenance
+"""
+import logging
+import re
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.config.settings import settings
+from app.db.db import get_engine
+from app.db.query_cache import query_cache
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "readings"
+PARTITIONED_TABLES = ("readings", "samples")
+INTERVALS = ("day", "month")
+
+BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def period_start(day: date, interval: str) -> date:
+    if interval == "day":
+        return day
+    return day.replace(day=1)
+
+
+def next_period(start: date, interval: str) -> date:
+    if interval == "day":
+        return start + timedelta(days=1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def partition_name(start: date, interval: str, parent: str = PARENT_TABLE) -> str:
+    suffix = start.strftime("%Y%m%d" if interval == "day" else "%Y%m")
+    return f"{parent}_p{suffix}"
+
+
+def is_partitioned(conn: Connection, parent: str = PARENT_TABLE) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+        {"name": parent}
+    ).scalar()
+    return relkind == "p"
+
+
+def list_partitions(conn: Connection, parent: str = PARENT_TABLE) -> List[Tuple[str, datetime, datetime]]:
+    """(name, lower bound, upper bound) for every partition of parent."""
+    rows = conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:name)
+        ORDER BY c.relname
+    """), {"name": parent})
+
+    partitions = []
+    for name, bound in rows:
+        match = BOUND_PATTERN.search(bound or "")
+        if match:
+            partitions.append((
+                name,
+                datetime.fromisoformat(match.group(1)),
+                datetime.fromisoformat(match.group(2))
+            ))
+    return partitions
+
+
+def ensure_partitions(
+    conn: Connection,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: str = settings.partition_interval,
+    premake: int = settings.partition_premake,
+    parent: str = PARENT_TABLE
+) -> List[str]:
+    """Create any missing partitions covering [start, end].
+
+    Defaults to the current period plus `premake` periods ahead. Returns the
+    names of the partitions that were created.
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"Unknown partition interval: {interval}")
+    if not is_partitioned(conn, parent):
+        return []
+
+    today = datetime.now(timezone.utc).date()
+    current = period_start((start.date() if start else today), interval)
+    if end is not None:
+        last = period_start(end.date(), interval)
+    else:
+        last = period_start(today, interval)
+        for _ in range(premake):
+            last = next_period(last, interval)
+
+    existing = {name for name, _, _ in list_partitions(conn, parent)}
+    created = []
+    while current <= last:
+        upper = next_period(current, interval)
+        name = partition_name(current, interval, parent)
+        if name not in existing:
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent} "
+                f"FOR VALUES FROM ('{current.isoformat()}') TO ('{upper.isoformat()}')"
+            ))
+            created.append(name)
+        current = upper
+    return created
+
+
+def drop_expired_partitions(
+    conn: Connection,
+    retention_days: int = settings.retention_days,
+    parent: str = PARENT_TABLE
+) -> List[str]:
+    """Drop partitions whose whole range is older than retention_days."""
+    if retention_days <= 0 or not is_partitioned(conn, parent):
+        return []
+
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=retention_days)
+    dropped = []
+    for name, _, upper in list_partitions(conn, parent):
+        if upper <= cutoff:
+            conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            dropped.append(name)
+    return dropped
+
+
+def run_maintenance():
+    """Create upcoming partitions and apply retention, each in its own transaction."""
+    created, dropped = [], []
+    for parent in PARTITIONED_TABLES:
+        with get_engine().begin() as conn:
+            created += ensure_partitions(conn, parent=parent)
+        with get_engine().begin() as conn:
+            dropped += drop_expired_partitions(conn, parent=parent)
+
+    for name in created:
+        logger.info("Created partition %s", name)
+    for name in dropped:
+        logger.info("Dropped expired partition %s", name)
+    if dropped:
+        query_cache.clear()  # cached blocks may cover the dropped days
+    return created, dropped
+
+
+class PartitionMaintainer:
+    """Runs run_maintenance() on a fixed interval in a background thread"""
+
+    def __init__(self, interval_s: int = settings.maintenance_interval_s):
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="partition-maintainer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+        self._thread = None
+
+    def _loop(self):
+        # first run straight away so a fresh process always has partitions
+        while True:
+            try:
+                run_maintenance()
+            except SQLAlchemyError as e:
+                logger.error("Partition maintenance failed: %s", e)
+            if self._stop.wait(self.interval_s):
+                return
+
+
+partition_maintainer = PartitionMaintainer()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    new, old = run_maintenance()
+    print(f"✓ Created {len(new)} partition(s), dropped {len(old)} expired partition(s)")
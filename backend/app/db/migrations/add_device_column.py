@@ -0,0 +1,71 @@
+"""Add a device column to the raw reading tables and the rollups.
+
+Raw tables (readings, samples) get a nullable device column. Rollup
+tables get device as part of their primary key, with '' for rows written
+before devices were tracked.
+
+To run this migration:
+1. Make sure PostgreSQL is running: docker-compose up -d
+2. cd backend
+3. source .venv/bin/activate
+4. python -m app.db.migrations.add_device_column
+"""
+import sys
+from pathlib import Path
+
+from sqlalchemy import text
+
+from app.db.db import engine
+from app.db.rollups import ROLLUP_LEVELS
+
+# Add backend directory to path
+backend_dir = Path(__file__).resolve().parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+RAW_TABLES = ("readings", "samples")
+
+
+def _has_column(conn, table: str, column: str) -> bool:
+    result = conn.execute(text("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name = :table AND column_name = :column
+    """), {"table": table, "column": column})
+    return result.fetchone() is not None
+
+
+def _table_exists(conn, table: str) -> bool:
+    return conn.execute(text("SELECT to_regclass(:name)"), {"name": table}).scalar() is not None
+
+
+def upgrade():
+    """Add device columns where they don't exist yet."""
+    with engine.begin() as conn:
+        for table in RAW_TABLES:
+            if not _table_exists(conn, table):
+                continue
+            if _has_column(conn, table, "device"):
+                print(f"✓ {table}.device already exists")
+                continue
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN device VARCHAR"))
+            print(f"✓ Added device column to {table}")
+
+        for level in ROLLUP_LEVELS:
+            table = level.table.name
+            if not _table_exists(conn, table):
+                continue
+            if _has_column(conn, table, "device"):
+                print(f"✓ {table}.device already exists")
+                continue
+            conn.execute(text(
+                f"ALTER TABLE {table} ADD COLUMN device VARCHAR NOT NULL DEFAULT ''"
+            ))
+            conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {table}_pkey"))
+            conn.execute(text(
+                f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey "
+                "PRIMARY KEY (sensor, bucket, device)"
+            ))
+            print(f"✓ Added device column to {table} primary key")
+
+if __name__ == "__main__":
+    upgrade()
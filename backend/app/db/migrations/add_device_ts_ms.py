@@ -30,7 +30,7 @@ def upgrade():
 
         if result.fetchone() is None:
             # Add column if it doesn't exist
-            conn.execute(text("ALTER TABLE readings ADD COLUMN device_ts_ms INTEGER"))
+            conn.execute(text("ALTER TABLE readings ADD COLUMN device_ts_ms BIGINT"))
             conn.commit()
             print("✓ Added device_ts_ms column to readings table")
         else:
@@ -0,0 +1,57 @@
+"""Create the wide samples table and copy existing readings into it.
+
+Every group of readings written for the same sample (same ts and
+device_ts_ms) becomes one samples row. The readings table is left as it
+is; once the copy looks right, set STORAGE_LAYOUT=wide in .env.
+
+To run this migration:
+1. Make sure PostgreSQL is running: docker-compose up -d
+2. Stop the backend so nothing writes while the table is copied
+3. cd backend
+4. source .venv/bin/activate
+5. python -m app.db.migrations.add_samples_table
+"""
+import sys
+from pathlib import Path
+
+from sqlalchemy import text
+
+from app.db.db import engine
+from app.db.maintenance import ensure_partitions
+from app.db.models import WideReading
+from app.db.persistence import SENSOR_UNITS
+
+# Add backend directory to path
+backend_dir = Path(__file__).resolve().parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+
+def upgrade():
+    """Create samples if needed and pivot readings into it."""
+    with engine.begin() as conn:
+        WideReading.__table__.create(conn, checkfirst=True)
+
+        if conn.execute(text("SELECT 1 FROM samples LIMIT 1")).first() is not None:
+            print("✓ samples table already has data, nothing to copy")
+            return
+
+        bounds = conn.execute(text("SELECT min(ts), max(ts) FROM readings")).first()
+        ensure_partitions(conn, start=bounds[0], parent="samples")
+        if bounds[1] is not None:
+            ensure_partitions(conn, start=bounds[0], end=bounds[1], parent="samples")
+
+        columns = ", ".join(SENSOR_UNITS)
+        pivots = ", ".join(
+            f"max(value) FILTER (WHERE sensor = '{name}')" for name in SENSOR_UNITS
+        )
+        result = conn.execute(text(f"""
+            INSERT INTO samples (ts, device_ts_ms, {columns})
+            SELECT ts, device_ts_ms, {pivots}
+            FROM readings
+            GROUP BY ts, device_ts_ms
+        """))
+        print(f"✓ Copied readings into {result.rowcount} samples rows")
+        print("  Set STORAGE_LAYOUT=wide in .env to start writing to samples")
+
+if __name__ == "__main__":
+    upgrade()
@@ -0,0 +1,31 @@
+"""Create the sessions and session_days tables and fill them from history.
+
+The backend creates both tables on startup when sessions are enabled, this
+is for existing installs that want their past readings turned into sessions
+too (and after changing the session_* thresholds).
+
+To run this migration:
+1. Make sure PostgreSQL is running: docker-compose up -d
+2. Stop the backend so the live detector doesn't write at the same time
+3. cd backend
+4. source .venv/bin/activate
+5. python -m app.db.migrations.add_sessions_tables
+"""
+import sys
+from pathlib import Path
+
+from app.db.sessions import rebuild
+
+# Add backend directory to path
+backend_dir = Path(__file__).resolve().parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+
+def upgrade():
+    """Create sessions/session_days and replay the distance readings into them."""
+    summary = rebuild()
+    print(f"✓ {summary['sessions']} sessions from {summary['readings']} distance readings"
+          f" ({summary['open']} still open)")
+
+if __name__ == "__main__":
+    upgrade()
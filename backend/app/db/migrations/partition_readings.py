@@ -0,0 +1,87 @@
+"""Convert the readings table into a ts-range partitioned table.
+
+Also widens readings.id to BIGINT and drops the redundant single-column
+indexes on id and ts (both are covered by the primary key and
+ix_readings_ts_sensor).
+
+To run this migration:
+1. Make sure PostgreSQL is running: docker-compose up -d
+2. Stop the backend so nothing writes while the table is copied
+3. cd backend
+4. source .venv/bin/activate
+5. python -m app.db.migrations.partition_readings
+"""
+import sys
+from pathlib import Path
+
+from sqlalchemy import text
+
+from app.db.db import engine
+from app.db.maintenance import ensure_partitions, is_partitioned
+from app.db.models import Reading
+
+# Add backend directory to path
+backend_dir = Path(__file__).resolve().parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+LEGACY_TABLE = "readings_legacy"
+
+
+def upgrade():
+    """Move existing rows into a new partitioned readings table."""
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            print("✓ readings table is already partitioned")
+            return
+
+        exists = conn.execute(text("SELECT to_regclass('readings')")).scalar()
+        if exists is None:
+            Reading.__table__.create(conn)
+            ensure_partitions(conn)
+            print("✓ Created partitioned readings table")
+            return
+
+        # Move the old table out of the way, along with every name the new
+        # table is going to need
+        conn.execute(text(f"ALTER TABLE readings RENAME TO {LEGACY_TABLE}"))
+        conn.execute(text(
+            f"ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT readings_pkey TO {LEGACY_TABLE}_pkey"
+        ))
+        conn.execute(text(
+            "DROP INDEX IF EXISTS ix_readings_id, ix_readings_ts, "
+            "ix_readings_sensor, ix_readings_ts_sensor"
+        ))
+        conn.execute(text(
+            f"ALTER SEQUENCE IF EXISTS readings_id_seq RENAME TO {LEGACY_TABLE}_id_seq"
+        ))
+
+        Reading.__table__.create(conn)
+
+        oldest = conn.execute(text(f"SELECT min(ts) FROM {LEGACY_TABLE}")).scalar()
+        ensure_partitions(conn, start=oldest)
+        newest = conn.execute(text(f"SELECT max(ts) FROM {LEGACY_TABLE}")).scalar()
+        if newest is not None:
+            ensure_partitions(conn, start=oldest, end=newest)
+
+        # every column both tables have (device, device_ts_ms, ... depending on
+        # which migrations ran before this one), so none is left behind
+        legacy_columns = set(conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = :table
+        """), {"table": LEGACY_TABLE}).scalars())
+        columns = ", ".join(c.name for c in Reading.__table__.columns if c.name in legacy_columns)
+        result = conn.execute(text(f"""
+            INSERT INTO readings ({columns})
+            OVERRIDING SYSTEM VALUE
+            SELECT {columns} FROM {LEGACY_TABLE}
+        """))
+        conn.execute(text("""
+            SELECT setval(pg_get_serial_sequence('readings', 'id'),
+                          coalesce((SELECT max(id) FROM readings), 0) + 1, false)
+        """))
+        conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+        print(f"✓ Moved {result.rowcount} readings into partitioned readings table")
+
+if __name__ == "__main__":
+    upgrade()
@@ -0,0 +1,50 @@
+"""Widen device_ts_ms to BIGINT on readings and samples.
+
+The boards send millis() as an unsigned 32-bit counter, anything past
+~24.8 days of uptime doesn't fit an INTEGER. The raw value is still what
+gets stored, the clock alignment (app.ingest.clock) does the unwrapping.
+Rewrites the tables, so run it while nothing is ingesting.
+
+To run this migration:
+1. Make sure PostgreSQL is running: docker-compose up -d
+2. cd backend
+3. source .venv/bin/activate
+4. python -m app.db.migrations.widen_device_ts_ms
+"""
+import sys
+from pathlib import Path
+
+from sqlalchemy import text
+
+from app.db.db import engine
+
+# Add backend directory to path
+backend_dir = Path(__file__).resolve().parent.parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+TABLES = ("readings", "samples")
+
+
+def upgrade():
+    """Change device_ts_ms to BIGINT where it is still narrower."""
+    with engine.connect() as conn:
+        for table in TABLES:
+            data_type = conn.execute(text("""
+                SELECT data_type
+                FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                  AND table_name = :table AND column_name = 'device_ts_ms'
+            """), {"table": table}).scalar()
+
+            if data_type is None:
+                print(f"- {table}.device_ts_ms doesn't exist, skipping")
+            elif data_type == "bigint":
+                print(f"✓ {table}.device_ts_ms is already BIGINT")
+            else:
+                conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN device_ts_ms TYPE BIGINT"))
+                conn.commit()
+                print(f"✓ Widened {table}.device_ts_ms to BIGINT")
+
+
+if __name__ == "__main__":
+    upgrade()
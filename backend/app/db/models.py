@@ -1,21 +1,123 @@
 """Database models for sensor readings."""
-from sqlalchemy import Column, Integer, String, Float, DateTime, Index
+from sqlalchemy import (
+    BigInteger, Boolean, Column, Date, Integer, String, Float, DateTime, Identity, Index, REAL
+)
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
 
 
 class Reading(Base):
-    """Sensor reading model"""
+    """Sensor reading model
+
+    On postgres the table is range-partitioned by ts (see app.db.maintenance),
+    which is why ts is part of the primary key.
+    """
     __tablename__ = "readings"
 
-    id = Column(Integer, primary_key=True, index=True)
-    ts = Column(DateTime, nullable=False, index=True)
+    id = Column(BigInteger, Identity(), primary_key=True)
+    ts = Column(DateTime, primary_key=True, nullable=False)
     sensor = Column(String, nullable=False, index=True)
     value = Column(Float, nullable=False)
     unit = Column(String, nullable=True)
-    device_ts_ms = Column(Integer, nullable=True)
+    device_ts_ms = Column(BigInteger, nullable=True)
+    device = Column(String, nullable=True)
 
     __table_args__ = (
         Index('ix_readings_ts_sensor', 'ts', 'sensor'),
+        {"postgresql_partition_by": "RANGE (ts)"},
+    )
+
+
+class WideReading(Base):
+    """One row per ESP32 sample with a typed column per sensor
+
+    Used instead of Reading when Settings.storage_layout is "wide". Partitioned
+    by ts on postgres just like readings.
+    """
+    __tablename__ = "samples"
+
+    id = Column(BigInteger, Identity(), primary_key=True)
+    ts = Column(DateTime, primary_key=True, nullable=False)
+    device_ts_ms = Column(BigInteger, nullable=True)
+    temp_c = Column(REAL, nullable=True)
+    hum_pct = Column(REAL, nullable=True)
+    distance_cm = Column(REAL, nullable=True)
+    device = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index('ix_samples_ts', 'ts'),
+        {"postgresql_partition_by": "RANGE (ts)"},
+    )
+
+
+class RollupColumns:
+    """Per-sensor aggregates for one time bucket and device ("" if unknown)"""
+    sensor = Column(String, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    device = Column(String, primary_key=True, default="", server_default="")
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+    sum = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False)
+
+
+class ReadingRollup1m(RollupColumns, Base):
+    """1-minute rollup of readings"""
+    __tablename__ = "readings_1m"
+
+
+class ReadingRollup1h(RollupColumns, Base):
+    """1-hour rollup of readings"""
+    __tablename__ = "readings_1h"
+
+
+class ReadingRollup1d(RollupColumns, Base):
+    """1-day rollup of readings"""
+    __tablename__ = "readings_1d"
+
+
+class JournalOffset(Base):
+    """How far the on-disk sample journal has been written to the database
+
+    Updated in the same transaction as the rows it covers, see
+    app.db.journal_replay.
+    """
+    __tablename__ = "journal_offsets"
+
+    journal_id = Column(String, primary_key=True)
+    committed_offset = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class DeskSession(Base):
+    """Occupancy interval detected from distance_cm (see app.ingest.sessions)
+
+    state is "present" or "away". Open rows are still going, their ended_at
+    is the last checkpoint.
+    """
+    __tablename__ = "sessions"
+
+    id = Column(BigInteger, Identity(), primary_key=True)
+    device = Column(String, nullable=False, default="", server_default="")
+    state = Column(String, nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    ended_at = Column(DateTime, nullable=False)
+    is_open = Column(Boolean, nullable=False, default=False, server_default="false")
+
+    __table_args__ = (
+        Index('ux_sessions_device_started', 'device', 'started_at', unique=True),
+        Index('ix_sessions_device_ended', 'device', 'ended_at'),
     )
+
+
+class SessionDay(Base):
+    """Per-day totals of closed sessions, one row per device and day"""
+    __tablename__ = "session_days"
+
+    device = Column(String, primary_key=True, default="", server_default="")
+    day = Column(Date, primary_key=True)
+    present_s = Column(Float, nullable=False, default=0.0)
+    away_s = Column(Float, nullable=False, default=0.0)
+    sessions = Column(Integer, nullable=False, default=0)  # present sessions started that day
+    longest_present_s = Column(Float, nullable=False, default=0.0)
@@ -1,40 +1,138 @@
 # saves sensor data to postgres
 from datetime import datetime, timezone
-from typing import Dict
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
+from sqlalchemy import insert
+from sqlalchemy.engine import Connection
 from sqlalchemy.exc import SQLAlchemyError
 
-from app.db.db import SessionLocal
-from app.db.models import Reading
+from app.config.settings import settings
+from app.db.db import get_engine
+from app.db.models import Reading, WideReading
+from app.db.query_cache import query_cache
+from app.db.rollups import update_rollups
+from app.serial.parser import Sample
 
+# sensor key in the ESP32 json -> unit stored with the reading
+SENSOR_UNITS = {
+    "temp_c": "°C",
+    "hum_pct": "%",
+    "distance_cm": "cm",
+}
+
+LAYOUTS = ("narrow", "wide")
+
+READING_COLUMNS = ("ts", "sensor", "value", "unit", "device_ts_ms", "device")
+SAMPLE_COLUMNS = ("ts", "device_ts_ms", "device") + tuple(SENSOR_UNITS)
+
+
+def build_reading_rows(sample: Sample, ts: Optional[datetime] = None) -> List[Dict]:
+    # turns one ESP32 sample into plain row dicts for the readings table
+    ts = ts or sample.ts or datetime.now(timezone.utc)
+    device_ts_ms = sample.device_ts_ms
+    device = sample.device
+
+    rows = []
+    for sensor_name, value in (
+        ("temp_c", sample.temp_c),
+        ("hum_pct", sample.hum_pct),
+        ("distance_cm", sample.distance_cm),
+    ):
+        if value is not None:
+            rows.append({
+                "ts": ts,
+                "sensor": sensor_name,
+                "value": value,
+                "unit": SENSOR_UNITS[sensor_name],
+                "device_ts_ms": device_ts_ms,
+                "device": device
+            })
+    return rows
 
-def save_reading_to_db(data: Dict):
-    # saves reading to db
-    db = SessionLocal()
-    try:
-        ts = datetime.now(timezone.utc)
-        device_ts_ms = data.get("ts_ms")
 
-        sensors = {
-            "temp_c": ("°C", data.get("temp_c")),
-            "hum_pct": ("%", data.get("hum_pct")),
-            "distance_cm": ("cm", data.get("distance_cm"))
-        }
+def build_sample_row(sample: Sample, ts: Optional[datetime] = None) -> Optional[Dict]:
+    # one row for the wide samples table, None if the sample has no sensor values
+    if not sample.has_values():
+        return None
+    return {
+        "ts": ts or sample.ts or datetime.now(timezone.utc),
+        "device_ts_ms": sample.device_ts_ms,
+        "device": sample.device,
+        "temp_c": sample.temp_c,
+        "hum_pct": sample.hum_pct,
+        "distance_cm": sample.distance_cm
+    }
 
-        for sensor_name, (unit, value) in sensors.items():
+
+def build_rows(sample: Sample, ts: Optional[datetime] = None,
+               layout: Optional[str] = None) -> List[Dict]:
+    # rows for whichever storage layout is configured
+    if (layout or settings.storage_layout) == "wide":
+        row = build_sample_row(sample, ts)
+        return [row] if row else []
+    return build_reading_rows(sample, ts)
+
+
+def sensor_points(rows: Sequence[Dict]) -> Iterator[Tuple[str, str, datetime, float]]:
+    # (device, sensor, ts, value) for every value in a batch of either layout
+    for row in rows:
+        device = row.get("device") or ""
+        if "sensor" in row:
+            yield device, row["sensor"], row["ts"], row["value"]
+            continue
+        for sensor_name in SENSOR_UNITS:
+            value = row.get(sensor_name)
             if value is not None:
-                reading = Reading(
-                    ts=ts,
-                    sensor=sensor_name,
-                    value=float(value),
-                    unit=unit,
-                    device_ts_ms=device_ts_ms
-                )
-                db.add(reading)
-
-        db.commit()
+                yield device, sensor_name, row["ts"], value
+
+
+def insert_rows(conn: Connection, rows: Sequence[Dict], table=Reading.__table__,
+                columns: Sequence[str] = READING_COLUMNS):
+    """Write a batch of row dicts in one round trip.
+
+    Uses COPY when running on postgres through psycopg, otherwise a single
+    multi-row INSERT.
+    """
+    if not rows:
+        return
+
+    if conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg":
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            copy_sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN"
+            with cursor.copy(copy_sql) as copy:
+                for row in rows:
+                    copy.write_row(tuple(row[c] for c in columns))
+        finally:
+            cursor.close()
+        return
+
+    conn.execute(insert(table).values(list(rows)))
+
+
+def persist_reading_rows(conn: Connection, rows: Sequence[Dict], layout: Optional[str] = None):
+    # raw rows plus the rollups, in the caller's transaction
+    if (layout or settings.storage_layout) == "wide":
+        insert_rows(conn, rows, WideReading.__table__, SAMPLE_COLUMNS)
+    else:
+        insert_rows(conn, rows)
+    if settings.rollups_enabled:
+        update_rollups(conn, sensor_points(rows))
+
+
+def rows_committed(rows: Sequence[Dict]):
+    # after the commit, so the query cache drops the open tail (or a late block)
+    query_cache.invalidate_points(sensor_points(rows))
+
+
+def save_reading_to_db(data: Union[Sample, Dict]):
+    # saves one reading straight away (the app goes through write_behind instead)
+    try:
+        if not isinstance(data, Sample):
+            data = Sample.from_dict(data)
+        rows = build_rows(data)
+        with get_engine().begin() as conn:
+            persist_reading_rows(conn, rows)
+        rows_committed(rows)
     except (SQLAlchemyError, ValueError) as e:
         print(f"Database error: {e}")
-        db.rollback()
-    finally:
-        db.close()
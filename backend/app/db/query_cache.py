@@ -0,0 +1,249 @@
+"""In-memory cache for the bucketed history queries.
+
+Dashboards poll the same windows over and over ("last 24h at 5m"), and
+every open tab would run the same aggregation again. history.py splits a
+range into blocks of BLOCK_BUCKETS whole buckets and keeps each block's
+points here, keyed by (device, sensor, bucket width, block start):
+
+- a block that had already ended when it was fetched is closed. Its
+  buckets don't change any more, so it stays until LRU eviction, unless a
+  late write lands in it (a backfill import, the journal catching up).
+- the block holding "now" is the open tail. Every write to the series
+  drops it, and it expires after Settings.query_cache_open_ttl_s anyway,
+  for writes this process doesn't see.
+
+The write path calls invalidate() after each commit. A fetch that raced a
+commit is not stored: put() refuses a block that an invalidation covered
+while the query ran. Listeners (add_listener) get every invalidation too,
+that is how the ingest process tells the api workers over the bus.
+
+Samples reach the database up to a reorder delay plus a write-behind flush
+after they were taken, so a block only counts as closed once it ended
+more than CLOSE_AFTER ago.
+"""
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.config.settings import settings
+
+# whole buckets per cached block
+BLOCK_BUCKETS = 256
+
+# (device, sensor, bucket seconds, block start), device None = every device
+CacheKey = Tuple[Optional[str], str, float, datetime]
+
+# invalidations remembered to check puts against
+INVALIDATION_LOG = 4096
+
+# how long after it ended a block can still get rows from the live path
+CLOSE_AFTER = timedelta(
+    seconds=settings.ingest_reorder_delay_s + settings.write_flush_interval_ms / 1000.0 + 2.0
+)
+
+# (device, sensor, oldest ts) per changed series, None = all of them
+Invalidation = Tuple[Optional[str], Optional[str], datetime]
+
+
+def _naive_utc(ts: datetime) -> datetime:
+    # readings.ts and the cached bucket times are naive UTC
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _matches(series: Tuple[Optional[str], str], sensor: Optional[str], device: Optional[str]) -> bool:
+    # a device's writes also change the all-devices series (device None)
+    series_device, series_sensor = series
+    return ((sensor is None or series_sensor == sensor)
+            and (device is None or series_device is None or series_device == device))
+
+
+def points_size(points: List) -> int:
+    """Rough bytes held by a list of dataclass points"""
+    size = sys.getsizeof(points)
+    for point in points:
+        fields = vars(point)
+        size += sys.getsizeof(point) + sys.getsizeof(fields)
+        size += sum(sys.getsizeof(value) for value in fields.values())
+    return size
+
+
+class _Entry:
+    __slots__ = ("value", "end", "size", "expires")
+
+    def __init__(self, value, end: datetime, size: int, expires: Optional[float]):
+        self.value = value
+        self.end = end
+        self.size = size
+        self.expires = expires  # None for closed blocks
+
+
+class QueryCache:
+    """LRU over entries and bytes, shared by the api routes and the write path"""
+
+    def __init__(
+        self,
+        max_entries: int = settings.query_cache_max_entries,
+        max_bytes: int = settings.query_cache_max_mb * 1024 * 1024,
+        open_ttl_s: float = settings.query_cache_open_ttl_s,
+        enabled: bool = settings.query_cache_enabled
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.open_ttl_s = open_ttl_s
+        self.enabled = enabled
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        # (device, sensor) -> bucket seconds -> sorted block starts, so an
+        # invalidation only visits the blocks it drops
+        self._index: Dict[Tuple[Optional[str], str], Dict[float, List[datetime]]] = {}
+        self._listeners: List[Callable[[List[Invalidation]], None]] = []
+        # the writers run on their own threads
+        self._lock = threading.Lock()
+        self._version = 0
+        self._log = deque(maxlen=INVALIDATION_LOG)  # (version, since, sensor, device)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def add_listener(self, listener: Callable[[List[Invalidation]], None]):
+        """Called with every batch of invalidations, on the thread that made them"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[List[Invalidation]], None]):
+        self._listeners.remove(listener)
+
+    def version(self) -> int:
+        # taken before a query, handed back to put()
+        return self._version
+
+    def get(self, key: CacheKey):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key: CacheKey, value, end: datetime, closed: bool, version: int, size: int):
+        with self._lock:
+            if self._raced(key, end, version):
+                # a write landed in this block while the query ran, the result may predate it
+                self.stale_puts += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            expires = None if closed else time.monotonic() + self.open_ttl_s
+            self._entries[key] = _Entry(value, end, size, expires)
+            insort(self._index.setdefault(key[:2], {}).setdefault(key[2], []), key[3])
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, since: datetime, sensor: Optional[str] = None, device: Optional[str] = None):
+        """Drop cached blocks ending after `since`. sensor/device None match every one"""
+        self.invalidate_many([(device, sensor, since)])
+
+    def invalidate_many(self, invalidations: List[Invalidation], notify: bool = True):
+        """Several invalidate() calls at once, notify=False for ones that came from a listener"""
+        with self._lock:
+            for device, sensor, since in invalidations:
+                self._invalidate_locked(_naive_utc(since), sensor, device)
+        if notify:
+            for listener in self._listeners:
+                listener(invalidations)
+
+    def _invalidate_locked(self, since: datetime, sensor: Optional[str], device: Optional[str]):
+        self._version += 1
+        self._log.append((self._version, since, sensor, device))
+        keys = []
+        for series, widths in self._index.items():
+            if not _matches(series, sensor, device):
+                continue
+            for width_s, starts in widths.items():
+                # ends after since <=> starts after since - one block
+                span = timedelta(seconds=width_s) * BLOCK_BUCKETS
+                first = bisect_right(starts, since - span) if since > datetime.min + span else 0
+                keys.extend((*series, width_s, start) for start in starts[first:])
+        for key in keys:
+            self._remove(key)
+            self.invalidations += 1
+
+    def invalidate_points(self, points: Iterable[Tuple[str, str, datetime, float]]):
+        # (device, sensor, ts, value) of a committed batch, oldest ts per series
+        oldest: Dict[Tuple[str, str], datetime] = {}
+        for device, sensor, ts, _ in points:
+            current = oldest.get((device, sensor))
+            if current is None or ts < current:
+                oldest[(device, sensor)] = ts
+        if oldest:
+            self.invalidate_many([(device or None, sensor, ts) for (device, sensor), ts in oldest.items()])
+
+    def _raced(self, key: CacheKey, end: datetime, version: int) -> bool:
+        if version == self._version:
+            return False
+        if not self._log or self._log[0][0] > version + 1:
+            return True  # the log doesn't reach back that far
+        for logged, since, sensor, device in reversed(self._log):
+            if logged <= version:
+                break
+            if end > since and _matches(key[:2], sensor, device):
+                return True
+        return False
+
+    def _remove(self, key: CacheKey):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        widths = self._index[key[:2]]
+        starts = widths[key[2]]
+        del starts[bisect_left(starts, key[3])]
+        if not starts:
+            del widths[key[2]]
+            if not widths:
+                del self._index[key[:2]]
+
+    def clear(self, notify: bool = True):
+        with self._lock:
+            self._version += 1
+            self._log.append((self._version, datetime.min, None, None))
+            self._entries.clear()
+            self._index.clear()
+            self._bytes = 0
+        if notify:
+            for listener in self._listeners:
+                listener([(None, None, datetime.min)])
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            closed = sum(1 for entry in self._entries.values() if entry.expires is None)
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "closed_entries": closed,
+                "open_entries": len(self._entries) - closed,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts
+            }
+
+
+query_cache = QueryCache()
@@ -0,0 +1,123 @@
+"""Rollup tables (1m / 1h / 1d) maintained alongside the raw readings.
+
+Every batch the write path persists is folded into the rollups in the same
+transaction, so they never lag behind or double count. History queries
+read the coarsest rollup that still satisfies the requested bucket, but
+only for the rollup buckets the range covers whole. The ragged ends come
+from the finer levels and finally the raw readings (rollup_segments), so
+the answer is the same as from the raw rows alone. Past RETENTION_DAYS the
+raw rows are gone, there an edge bucket only has what the 1m rollup holds.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection
+
+from app.db.models import ReadingRollup1d, ReadingRollup1h, ReadingRollup1m
+
+RollupLevel = namedtuple("RollupLevel", ["name", "width", "table"])
+
+# finest first
+ROLLUP_LEVELS = (
+    RollupLevel("1m", timedelta(minutes=1), ReadingRollup1m.__table__),
+    RollupLevel("1h", timedelta(hours=1), ReadingRollup1h.__table__),
+    RollupLevel("1d", timedelta(days=1), ReadingRollup1d.__table__),
+)
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_start(ts: datetime, width: timedelta) -> datetime:
+    """Floor a timestamp to its bucket, returned as naive UTC like readings.ts."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts - (ts - EPOCH) % width
+
+
+def pick_rollup(bucket: timedelta) -> Optional[RollupLevel]:
+    """Coarsest rollup whose buckets tile the requested bucket exactly."""
+    for level in reversed(ROLLUP_LEVELS):
+        if bucket >= level.width and bucket % level.width == timedelta(0):
+            return level
+    return None
+
+
+def aggregate_points(points: Iterable[Tuple[str, str, datetime, float]], width: timedelta) -> Dict:
+    # (sensor, bucket, device) -> [min, max, sum, count]
+    groups: Dict = {}
+    for device, sensor, ts, value in points:
+        key = (sensor, bucket_start(ts, width), device)
+        agg = groups.get(key)
+        if agg is None:
+            groups[key] = [value, value, value, 1]
+        else:
+            if value < agg[0]:
+                agg[0] = value
+            if value > agg[1]:
+                agg[1] = value
+            agg[2] += value
+            agg[3] += 1
+    return groups
+
+
+def update_rollups(conn: Connection, points: Iterable[Tuple[str, str, datetime, float]]):
+    """Merge freshly inserted (device, sensor, ts, value) points into every rollup level."""
+    points = list(points)
+    if not points:
+        return
+
+    for level in ROLLUP_LEVELS:
+        groups = aggregate_points(points, level.width)
+        # sorted so concurrent writers lock rows in the same order
+        values = [
+            {"sensor": sensor, "bucket": bucket, "device": device,
+             "min": agg[0], "max": agg[1], "sum": agg[2], "count": agg[3]}
+            for (sensor, bucket, device), agg in sorted(groups.items())
+        ]
+        stmt = pg_insert(level.table).values(values)
+        table = level.table
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.sensor, table.c.bucket, table.c.device],
+            set_={
+                "min": text(f"LEAST({table.name}.min, excluded.min)"),
+                "max": text(f"GREATEST({table.name}.max, excluded.max)"),
+                "sum": table.c.sum + stmt.excluded.sum,
+                "count": table.c.count + stmt.excluded.count,
+            }
+        )
+        conn.execute(stmt)
+
+
+def rollup_segments(level: Optional[RollupLevel], start: datetime,
+                    end: datetime) -> List[Tuple[Optional[RollupLevel], datetime, datetime]]:
+    """Split [start, end) into (level, from, to) runs, level None = raw readings.
+
+    Each level only gets the buckets that lie inside the range whole, the
+    rest goes to the next finer one.
+    """
+    if start >= end:
+        return []
+    if level is None:
+        return [(None, start, end)]
+    index = ROLLUP_LEVELS.index(level)
+    finer = ROLLUP_LEVELS[index - 1] if index else None
+    first = bucket_start(start, level.width)
+    if first < start:
+        first += level.width
+    last = bucket_start(end, level.width)
+    if first >= last:
+        return rollup_segments(finer, start, end)
+    return (rollup_segments(finer, start, first) + [(level, first, last)]
+            + rollup_segments(finer, last, end))
+
+
+def rollup_rows_sql(level: RollupLevel, n: int, device: Optional[str] = None) -> str:
+    # rollup rows of segment n as (ts, min, max, sum, count), see history.segmented_history_sql
+    device_filter = "AND device = :device" if device is not None else ""
+    return f"""
+        SELECT bucket AS ts, min, max, sum, count
+        FROM {level.table.name}
+        WHERE sensor = :sensor AND bucket >= :start_{n} AND bucket < :end_{n} {device_filter}"""
@@ -0,0 +1,279 @@
+"""Storage for desk occupancy sessions (app.ingest.sessions).
+
+sessions holds one row per present/away interval, keyed by (device,
+started_at). An interval that is still going is written with is_open and
+its ended_at moved forward every session_checkpoint_s, so a restart picks
+it up again. When it closes, its length is added to session_days, split
+at local midnight (session_timezone), so a daily summary is one row per
+day however many samples it covers.
+
+To rebuild both tables from the raw distance readings (after changing the
+thresholds, say):
+
+    python -m app.db.sessions --rebuild
+"""
+import argparse
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.settings import settings
+from app.db.db import get_engine
+from app.db.history import raw_source, to_db_time
+from app.db.models import DeskSession, SessionDay
+from app.ingest.sessions import PRESENT, SessionChange, SessionDetector
+
+logger = logging.getLogger(__name__)
+
+sessions_table = DeskSession.__table__
+days_table = SessionDay.__table__
+
+
+def to_epoch(ts: datetime) -> float:
+    # sessions columns are naive UTC like readings.ts
+    return ts.replace(tzinfo=timezone.utc).timestamp()
+
+
+def from_epoch(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+def split_by_day(start: float, end: float, tz: ZoneInfo) -> List[Tuple[date, float]]:
+    """(local day, seconds) pieces of an interval, cut at local midnight"""
+    pieces = []
+    while start < end:
+        day = datetime.fromtimestamp(start, tz).date()
+        midnight = datetime.combine(day + timedelta(days=1), datetime.min.time(), tz).timestamp()
+        piece_end = min(end, midnight)
+        pieces.append((day, piece_end - start))
+        start = piece_end
+    return pieces
+
+
+def day_totals(changes: Iterable[SessionChange], tz: ZoneInfo) -> Dict[Tuple[str, date], List[float]]:
+    # (device, day) -> [present_s, away_s, sessions, longest_present_s]
+    totals: Dict[Tuple[str, date], List[float]] = {}
+    for change in changes:
+        if change.ended is None:
+            continue
+        pieces = split_by_day(change.started, change.ended, tz)
+        if not pieces:
+            pieces = [(datetime.fromtimestamp(change.started, tz).date(), 0.0)]
+        for i, (day, seconds) in enumerate(pieces):
+            agg = totals.setdefault((change.device, day), [0.0, 0.0, 0, 0.0])
+            if change.state == PRESENT:
+                agg[0] += seconds
+                if i == 0:
+                    # a session counts on the day it started, with its full length
+                    agg[2] += 1
+                    agg[3] = max(agg[3], change.ended - change.started)
+            else:
+                agg[1] += seconds
+    return totals
+
+
+class SessionStore:
+    """Writes detector output to sessions / session_days, used by SessionSink"""
+
+    def __init__(self, db_engine: Optional[Engine] = None, timezone_name: str = settings.session_timezone):
+        self._engine = db_engine
+        self.tz = ZoneInfo(timezone_name)
+        self.failures = 0
+
+    @property
+    def engine(self) -> Engine:
+        # resolved on first write, so building the sink doesn't create the engine
+        return self._engine or get_engine()
+
+    def load_open(self) -> List[SessionChange]:
+        """Sessions left open by the last run, ended is their last checkpoint"""
+        try:
+            with self.engine.begin() as conn:
+                sessions_table.create(conn, checkfirst=True)
+                days_table.create(conn, checkfirst=True)
+                rows = conn.execute(
+                    select(sessions_table.c.device, sessions_table.c.state,
+                           sessions_table.c.started_at, sessions_table.c.ended_at)
+                    .where(sessions_table.c.is_open)
+                ).all()
+        except SQLAlchemyError as e:
+            logger.warning("Could not load open sessions: %s", e)
+            return []
+        return [SessionChange(device, state, to_epoch(started), to_epoch(ended))
+                for device, state, started, ended in rows]
+
+    def write(self, changes: List[SessionChange], open_sessions: List[SessionChange]) -> bool:
+        """Applies the changes and checkpoints the open sessions in one transaction"""
+        try:
+            with self.engine.begin() as conn:
+                self.apply(conn, changes)
+                self.checkpoint(conn, open_sessions)
+        except SQLAlchemyError as e:
+            self.failures += 1
+            logger.warning("Could not write %d session changes: %s", len(changes), e)
+            return False
+        return True
+
+    def apply(self, conn: Connection, changes: List[SessionChange]):
+        closed = []
+        for change in changes:
+            stmt = pg_insert(sessions_table).values(
+                device=change.device,
+                state=change.state,
+                started_at=from_epoch(change.started),
+                ended_at=from_epoch(change.started if change.ended is None else change.ended),
+                is_open=change.ended is None
+            )
+            # a session already closed is never reopened or counted twice
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[sessions_table.c.device, sessions_table.c.started_at],
+                set_={"state": stmt.excluded.state, "ended_at": stmt.excluded.ended_at,
+                      "is_open": stmt.excluded.is_open},
+                where=sessions_table.c.is_open
+            ).returning(sessions_table.c.id)
+            if conn.execute(stmt).first() is not None and change.ended is not None:
+                closed.append(change)
+        self.add_days(conn, closed)
+
+    def add_days(self, conn: Connection, closed: List[SessionChange]):
+        totals = day_totals(closed, self.tz)
+        if not totals:
+            return
+        values = [
+            {"device": device, "day": day, "present_s": agg[0], "away_s": agg[1],
+             "sessions": agg[2], "longest_present_s": agg[3]}
+            for (device, day), agg in sorted(totals.items())
+        ]
+        stmt = pg_insert(days_table).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[days_table.c.device, days_table.c.day],
+            set_={
+                "present_s": days_table.c.present_s + stmt.excluded.present_s,
+                "away_s": days_table.c.away_s + stmt.excluded.away_s,
+                "sessions": days_table.c.sessions + stmt.excluded.sessions,
+                "longest_present_s": text(
+                    "GREATEST(session_days.longest_present_s, excluded.longest_present_s)"
+                ),
+            }
+        )
+        conn.execute(stmt)
+
+    def checkpoint(self, conn: Connection, open_sessions: List[SessionChange]):
+        for session in open_sessions:
+            conn.execute(
+                update(sessions_table)
+                .where(sessions_table.c.device == session.device,
+                       sessions_table.c.started_at == from_epoch(session.started),
+                       sessions_table.c.is_open)
+                .values(ended_at=from_epoch(session.ended))
+            )
+
+
+async def fetch_sessions_async(
+    db: AsyncSession,
+    start: datetime,
+    end: datetime,
+    device: Optional[str] = None,
+    state: Optional[str] = None
+) -> List[SessionChange]:
+    """Sessions overlapping [start, end), open ones with ended=None"""
+    query = (
+        select(sessions_table.c.device, sessions_table.c.state, sessions_table.c.started_at,
+               sessions_table.c.ended_at, sessions_table.c.is_open)
+        .where(sessions_table.c.ended_at >= to_db_time(start),
+               sessions_table.c.started_at < to_db_time(end))
+        .order_by(sessions_table.c.started_at)
+    )
+    if device is not None:
+        query = query.where(sessions_table.c.device == device)
+    if state is not None:
+        query = query.where(sessions_table.c.state == state)
+    rows = (await db.execute(query)).all()
+    return [
+        SessionChange(row_device, row_state, to_epoch(started), None if is_open else to_epoch(ended))
+        for row_device, row_state, started, ended, is_open in rows
+    ]
+
+
+async def fetch_open_async(db: AsyncSession, device: Optional[str] = None) -> List[SessionChange]:
+    # open sessions as last checkpointed, ended is the checkpoint
+    query = select(sessions_table.c.device, sessions_table.c.state, sessions_table.c.started_at,
+                   sessions_table.c.ended_at).where(sessions_table.c.is_open)
+    if device is not None:
+        query = query.where(sessions_table.c.device == device)
+    rows = (await db.execute(query)).all()
+    return [SessionChange(row_device, row_state, to_epoch(started), to_epoch(ended))
+            for row_device, row_state, started, ended in rows]
+
+
+async def fetch_days_async(
+    db: AsyncSession,
+    start: date,
+    end: date,
+    device: Optional[str] = None
+) -> List[Tuple]:
+    """(device, day, present_s, away_s, sessions, longest_present_s) for start <= day <= end"""
+    query = (
+        select(days_table.c.device, days_table.c.day, days_table.c.present_s, days_table.c.away_s,
+               days_table.c.sessions, days_table.c.longest_present_s)
+        .where(days_table.c.day >= start, days_table.c.day <= end)
+        .order_by(days_table.c.device, days_table.c.day)
+    )
+    if device is not None:
+        query = query.where(days_table.c.device == device)
+    return [tuple(row) for row in (await db.execute(query)).all()]
+
+
+def rebuild(db_engine: Optional[Engine] = None, batch_size: int = 10_000) -> Dict:
+    """Recomputes both tables from the raw distance readings"""
+    db_engine = db_engine or get_engine()
+    detector = SessionDetector()
+    store = SessionStore(db_engine)
+    rows = sessions = 0
+    with db_engine.begin() as conn:
+        sessions_table.create(conn, checkfirst=True)
+        days_table.create(conn, checkfirst=True)
+        conn.execute(text("TRUNCATE sessions, session_days"))
+        result = conn.execute(
+            text(f"""
+                SELECT device, ts, value FROM {raw_source()}
+                WHERE sensor = 'distance_cm'
+                ORDER BY device, ts
+            """),
+            execution_options={"stream_results": True, "yield_per": batch_size}
+        )
+        for partition in result.partitions(batch_size):
+            changes: List[SessionChange] = []
+            for device, ts, value in partition:
+                rows += 1
+                changes.extend(detector.update(device or "", to_epoch(ts), value))
+            # only closed sessions, the open ones are written once at the end
+            closed = [change for change in changes if change.ended is not None]
+            store.apply(conn, closed)
+            sessions += len(closed)
+        result.close()
+
+        # whatever is still going counts as open, live ingest carries on from there
+        open_sessions = detector.open_sessions()
+        store.apply(conn, [SessionChange(s.device, s.state, s.started) for s in open_sessions])
+        store.checkpoint(conn, open_sessions)
+    return {"readings": rows, "sessions": sessions, "open": len(open_sessions)}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Occupancy sessions maintenance")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompute sessions and session_days from the raw readings")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.error("nothing to do, pass --rebuild")
+    for key, value in rebuild().items():
+        print(f"  {key}: {value}")
@@ -0,0 +1,210 @@
+"""Write-behind queue for sensor readings.
+
+The serial thread only turns a sample into rows and appends them to an
+in-memory queue. A dedicated flusher thread drains the queue in batches
+(by size or by time window) and writes each batch in one round trip, so a
+slow database never stalls serial reads.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import metrics
+from app.config.settings import settings
+from app.db.db import get_engine
+from app.db.persistence import build_rows, persist_reading_rows, rows_committed
+from app.serial.parser import Sample
+
+logger = logging.getLogger(__name__)
+
+DROP_POLICIES = ("drop_oldest", "drop_newest")
+
+
+class ReadingWriter:
+    """Batches readings in memory and flushes them from a background thread"""
+
+    def __init__(
+        self,
+        batch_size: int = settings.write_batch_size,
+        flush_interval_ms: int = settings.write_flush_interval_ms,
+        max_rows: int = settings.write_queue_max_rows,
+        block_timeout_ms: int = settings.write_block_timeout_ms,
+        drop_policy: str = settings.write_drop_policy
+    ):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_rows = max_rows
+        self.block_timeout = block_timeout_ms / 1000.0
+        self.drop_policy = drop_policy
+
+        self._rows: Deque[Dict] = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+        # counters, only touched while holding the lock
+        self._enqueued = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._flushes = 0
+        self._max_depth = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self._last_batch_rows = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._flush_loop, name="reading-writer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        # flushes whatever is still queued before returning
+        with self._lock:
+            self._stopping = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                logger.warning("Reading writer did not finish flushing in %.1fs", timeout)
+        self._thread = None
+
+    def submit(self, sample: Sample) -> bool:
+        # called from the serial thread, never touches the database
+        return self.submit_rows(build_rows(sample))
+
+    def submit_rows(self, rows: List[Dict]) -> bool:
+        if not rows:
+            return True
+
+        with self._lock:
+            # backpressure: give the flusher a moment to catch up before dropping
+            if len(self._rows) + len(rows) > self.max_rows and self.block_timeout > 0:
+                self._not_full.wait_for(
+                    lambda: self._stopping or len(self._rows) + len(rows) <= self.max_rows,
+                    timeout=self.block_timeout
+                )
+
+            overflow = len(self._rows) + len(rows) - self.max_rows
+            if overflow > 0:
+                if self.drop_policy == "drop_newest":
+                    self._dropped += len(rows)
+                    return False
+                for _ in range(min(overflow, len(self._rows))):
+                    self._rows.popleft()
+                self._dropped += overflow
+
+            was_empty = not self._rows
+            self._rows.extend(rows)
+            self._enqueued += len(rows)
+            self._max_depth = max(self._max_depth, len(self._rows))
+            # wake the flusher for the first rows (starts the flush interval)
+            # and again once a full batch is ready
+            if was_empty or len(self._rows) >= self.batch_size:
+                self._not_empty.notify()
+        return True
+
+    def flush(self) -> int:
+        # writes one batch right now, returns the number of rows written
+        with self._lock:
+            batch = self._take_batch()
+        return self._write(batch)
+
+    def _take_batch(self) -> List[Dict]:
+        # caller must hold the lock
+        count = min(self.batch_size, len(self._rows))
+        batch = [self._rows.popleft() for _ in range(count)]
+        if batch:
+            self._not_full.notify_all()
+        return batch
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                # wait for the first row, then give the batch up to
+                # flush_interval to fill before writing it
+                self._not_empty.wait_for(lambda: self._stopping or self._rows)
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._rows) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._not_empty.wait(remaining)
+
+                if self._stopping and not self._rows:
+                    return
+                batch = self._take_batch()
+
+            self._write(batch)
+
+    def _write(self, batch: List[Dict]) -> int:
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            with get_engine().connect() as conn:
+                metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+                with conn.begin():
+                    persist_reading_rows(conn, batch)
+        except (SQLAlchemyError, OSError, ValueError) as e:
+            logger.error("Failed to write %d readings: %s", len(batch), e)
+            metrics.DB_FAILURES.inc()
+            with self._lock:
+                self._failed += len(batch)
+            return 0
+        rows_committed(batch)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        metrics.DB_FLUSH_SECONDS.observe(elapsed_ms / 1000.0)
+        metrics.DB_ROWS.inc(len(batch))
+        if metrics.ENABLED:
+            oldest = batch[0]["ts"]
+            metrics.DB_COMMIT_LAG_SECONDS.observe((datetime.now(oldest.tzinfo) - oldest).total_seconds())
+        with self._lock:
+            self._written += len(batch)
+            self._flushes += 1
+            self._last_flush_ms = elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+            self._last_batch_rows = len(batch)
+        return len(batch)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            flushes = self._flushes
+            return {
+                "running": self._thread is not None and self._thread.is_alive(),
+                "queue_depth": len(self._rows),
+                "max_queue_depth": self._max_depth,
+                "queue_capacity": self.max_rows,
+                "rows_enqueued": self._enqueued,
+                "rows_written": self._written,
+                "rows_dropped": self._dropped,
+                "rows_failed": self._failed,
+                "flushes": flushes,
+                "last_flush_ms": round(self._last_flush_ms, 3),
+                "avg_flush_ms": round(self._total_flush_ms / flushes, 3) if flushes else 0.0,
+                "max_flush_ms": round(self._max_flush_ms, 3),
+                "last_rows_per_flush": self._last_batch_rows,
+                "avg_rows_per_flush": round(self._written / flushes, 1) if flushes else 0.0
+            }
+
+
+reading_writer = ReadingWriter()
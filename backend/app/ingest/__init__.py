@@ -0,0 +1 @@
+"""Ingestion engine and sinks"""
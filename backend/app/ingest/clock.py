@@ -0,0 +1,260 @@
+"""Maps the ESP32's ts_ms (millis() since boot) onto wall-clock time.
+
+The device has no real-time clock, only a counter that starts at 0 on every
+boot and runs a little fast or slow. Within one boot, wall time is close to
+a straight line in the device clock:
+
+    wall_s = intercept + slope * device_ts_ms
+
+slope is 0.001 s/ms for a perfect crystal. The difference is the drift,
+usually a few tens of ppm. ClockModel.fit() learns both from anchor pairs,
+i.e. samples where both clocks are known (live samples stamped by the
+server, or lines in a device log that carry a wall-clock time).
+
+millis() is an unsigned 32-bit counter, so it also wraps to 0 after about
+49.7 days. MillisCounter tells that apart from a reboot and keeps counting
+across it. DeviceClock keeps a ClockModel up to date from live samples, and
+ClockAligner gives every live sample the time its device sent it instead of
+the time the serial thread got to it.
+"""
+import math
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.config.settings import settings
+from app.serial.parser import Sample
+
+NOMINAL_SLOPE = 0.001  # seconds per device millisecond
+
+MILLIS_WRAP = 2 ** 32
+# ts_ms going back by more than this means the device restarted
+BOOT_RESET_MS = 10_000
+# unless it went from this close to the top to this close to 0: a rollover
+WRAP_WINDOW_MS = 600_000
+
+# with anchors spread over less than this, drift can't be told apart from
+# jitter, so only the offset is fitted
+MIN_DRIFT_SPAN_MS = 60_000
+
+
+@dataclass
+class ClockModel:
+    intercept: float  # wall clock (epoch seconds) at device_ts_ms == 0
+    slope: float = NOMINAL_SLOPE
+    anchors: int = 0
+    residual_ms: float = 0.0  # rms error of the fit over its anchors
+
+    @classmethod
+    def from_offset(cls, device_ts_ms: int, wall_s: float) -> "ClockModel":
+        # a single known pair, nominal rate
+        return cls(intercept=wall_s - NOMINAL_SLOPE * device_ts_ms, anchors=1)
+
+    @classmethod
+    def fit(cls, pairs: Iterable[Tuple[int, float]],
+            default_slope: float = NOMINAL_SLOPE) -> Optional["ClockModel"]:
+        """Least squares over (device_ts_ms, wall epoch seconds) pairs, None without any.
+
+        default_slope is used while the pairs are too close together to fit drift.
+        """
+        n, sum_x, sum_y, sum_xx, sum_xy, sum_yy = 0, 0.0, 0.0, 0.0, 0.0, 0.0
+        x_min, x_max = math.inf, -math.inf
+        x0 = y0 = None
+        for x, y in pairs:
+            if x0 is None:
+                x0, y0 = x, y
+            # relative to the first pair and the nominal rate, so the sums
+            # stay small and precise
+            dx = float(x - x0)
+            dy = (y - y0) - NOMINAL_SLOPE * dx
+            n += 1
+            sum_x += dx
+            sum_y += dy
+            sum_xx += dx * dx
+            sum_xy += dx * dy
+            sum_yy += dy * dy
+            x_min, x_max = min(x_min, x), max(x_max, x)
+        if n == 0:
+            return None
+
+        mean_x, mean_y = sum_x / n, sum_y / n
+        var_x = sum_xx / n - mean_x * mean_x
+        cov = sum_xy / n - mean_x * mean_y
+        if x_max - x_min >= MIN_DRIFT_SPAN_MS and var_x > 0:
+            drift = cov / var_x
+        else:
+            drift = default_slope - NOMINAL_SLOPE
+        # variance of what the fitted line doesn't explain
+        var_y = sum_yy / n - mean_y * mean_y
+        residual = math.sqrt(max(0.0, var_y - 2 * drift * cov + drift * drift * var_x))
+        slope = NOMINAL_SLOPE + drift
+        return cls(
+            intercept=y0 + mean_y - drift * mean_x - slope * x0,
+            slope=slope,
+            anchors=n,
+            residual_ms=residual * 1000.0
+        )
+
+    @property
+    def drift_ppm(self) -> float:
+        return (self.slope / NOMINAL_SLOPE - 1.0) * 1e6
+
+    def to_wall(self, device_ts_ms: int) -> float:
+        return self.intercept + self.slope * device_ts_ms
+
+    def to_dict(self):
+        return {
+            "intercept_s": self.intercept,
+            "drift_ppm": round(self.drift_ppm, 3),
+            "anchors": self.anchors,
+            "residual_ms": round(self.residual_ms, 3)
+        }
+
+
+class MillisCounter:
+    """One device's raw ts_ms values as a count that doesn't wrap.
+
+    A step back of more than BOOT_RESET_MS is a reboot (boot goes up, the
+    count starts over). A step from the top of the 32-bit range to just
+    past 0 is a rollover and the count carries on. Negative values (the
+    counter printed as a signed long) are read as the unsigned value.
+    """
+
+    def __init__(self):
+        self.boot = 0
+        self.wraps = 0
+        self.last_raw: Optional[int] = None
+
+    def update(self, raw_ms: int) -> Tuple[int, bool]:
+        """(ms since boot, True when this value started a new boot)"""
+        raw = raw_ms + MILLIS_WRAP if raw_ms < 0 else raw_ms
+        last = self.last_raw
+        rebooted = False
+        if last is not None and raw < last - BOOT_RESET_MS:
+            if last >= MILLIS_WRAP - WRAP_WINDOW_MS and raw < WRAP_WINDOW_MS:
+                self.wraps += 1
+            else:
+                self.boot += 1
+                self.wraps = 0
+                rebooted = True
+            self.last_raw = raw
+        else:
+            # small steps back are lines out of order, not a new boot
+            self.last_raw = raw if last is None else max(last, raw)
+        return self.wraps * MILLIS_WRAP + raw, rebooted
+
+
+class DeviceClock:
+    """ClockModel for one live device, learned online from its samples.
+
+    Receive time is send time plus a delay that is never negative but
+    jitters with the serial polling and spikes when a backlog comes in at
+    once. So the model follows the lower envelope: the lowest-delay sample
+    of every window_ms of device time becomes an anchor, the line is fitted
+    through the last max_anchors of them (with drift once they span a
+    minute) and moved down until no anchor arrived before it was sent. A
+    sample that arrives earlier than the line allows moves it down straight
+    away. Reboots keep the fitted drift, it belongs to the crystal.
+    """
+
+    def __init__(
+        self,
+        window_ms: float = settings.clock_window_s * 1000.0,
+        max_anchors: int = settings.clock_anchors,
+        resync_s: float = settings.clock_resync_s
+    ):
+        self.window_ms = window_ms
+        self.resync_s = resync_s
+        self.counter = MillisCounter()
+        self.model: Optional[ClockModel] = None
+        self.resyncs = 0
+        self.last_delay_s = 0.0
+        self._anchors: Deque[Tuple[int, float]] = deque(maxlen=max_anchors)
+        self._window: Optional[List] = None  # [start ms, best ms, best wall, best delay]
+
+    def wall_time(self, raw_ms: int, received_s: float) -> float:
+        """Epoch seconds the sample with this ts_ms was sent at"""
+        ms, rebooted = self.counter.update(raw_ms)
+        model = self.model
+        if model is None or rebooted:
+            self._restart(ms, received_s)
+            return received_s
+
+        delay = received_s - model.to_wall(ms)
+        if abs(delay) > self.resync_s:
+            # the counter doesn't match the wall clock any more, e.g. the
+            # device rebooted while it was disconnected
+            self.resyncs += 1
+            self._restart(ms, received_s)
+            return received_s
+        if delay < 0:
+            model.intercept += delay
+            delay = 0.0
+
+        window = self._window
+        if window is None or ms - window[0] >= self.window_ms:
+            if window is not None:
+                self._add_anchor(window[1], window[2])
+            self._window = [ms, ms, received_s, delay]
+        elif delay < window[3]:
+            window[1:] = [ms, received_s, delay]
+        self.last_delay_s = delay
+        return self.model.to_wall(ms)
+
+    def _restart(self, ms: int, received_s: float):
+        slope = self.model.slope if self.model is not None else NOMINAL_SLOPE
+        self.model = ClockModel(intercept=received_s - slope * ms, slope=slope, anchors=1)
+        self._anchors.clear()
+        self._window = [ms, ms, received_s, 0.0]
+        self.last_delay_s = 0.0
+
+    def _add_anchor(self, ms: int, wall_s: float):
+        self._anchors.append((ms, wall_s))
+        model = ClockModel.fit(self._anchors, default_slope=self.model.slope)
+        # down to the lower envelope, no anchor may arrive before it was sent
+        model.intercept += min(wall - model.to_wall(x) for x, wall in self._anchors)
+        self.model = model
+
+    def get_stats(self) -> Dict:
+        model = self.model
+        return {
+            "boot": self.counter.boot,
+            "wraps": self.counter.wraps,
+            "resyncs": self.resyncs,
+            "delay_ms": round(self.last_delay_s * 1000.0, 3),
+            **(model.to_dict() if model is not None else {})
+        }
+
+
+class ClockAligner:
+    """Replaces each live sample's receive time with its device's send time"""
+
+    def __init__(self):
+        self._clocks: Dict[str, DeviceClock] = {}
+        self._lock = threading.Lock()
+        self.aligned = 0
+
+    def clock(self, device: Optional[str]) -> DeviceClock:
+        key = device or ""
+        clock = self._clocks.get(key)
+        if clock is None:
+            with self._lock:
+                clock = self._clocks.setdefault(key, DeviceClock())
+        return clock
+
+    def align(self, sample: Sample) -> Sample:
+        # one reader thread per device, so each DeviceClock only sees one thread
+        if sample.device_ts_ms is None or sample.ts is None:
+            return sample
+        wall_s = self.clock(sample.device).wall_time(sample.device_ts_ms, sample.ts.timestamp())
+        sample.ts = datetime.fromtimestamp(wall_s, timezone.utc)
+        self.aligned += 1
+        return sample
+
+    def get_stats(self) -> Dict:
+        return {
+            "aligned": self.aligned,
+            "devices": {device: clock.get_stats() for device, clock in list(self._clocks.items())}
+        }
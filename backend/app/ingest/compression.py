@@ -0,0 +1,221 @@
+"""Per-sensor compression in front of the db and websocket sinks.
+
+Desk sensors mostly repeat themselves, so storing and pushing every value
+is wasted work. A Compressor keeps one filter per (device, sensor) and only
+lets through the points needed to rebuild the series within that sensor's
+tolerance (Settings.compression_tolerances):
+
+- "deadband": a value goes through when it is more than the tolerance away
+  from the last one that went through. Rebuild by holding the last value
+  (step), every dropped value is within the tolerance of it.
+- "swinging_door": a point is kept only when a straight line from the
+  last kept point can no longer pass within the tolerance of everything
+  dropped since. Rebuild by linear interpolation between kept points, every
+  dropped value is within the tolerance of the line. Kept points are
+  always real samples, but they go out one sample late (a point is only
+  known to be needed once the next one breaks the line).
+
+Either way a point goes through at least every compression_heartbeat_s, so
+a flat series still shows up, and flush() (on shutdown) lets the pending
+points through so the tail of each series is exact too.
+
+Filtered samples keep their own ts and device_ts_ms and only carry the
+sensors that passed. Samples with none left are dropped.
+"""
+import dataclasses
+import math
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+from app.ingest.sinks import Sink
+from app.serial.parser import Sample
+
+MODES = ("off", "deadband", "swinging_door")
+SENSORS = ("temp_c", "hum_pct", "distance_cm")
+
+
+class _Series:
+    # filter state for one (device, sensor)
+    __slots__ = ("kept_t", "kept_v", "last_sample", "last_t", "last_v", "low", "high")
+
+    def __init__(self):
+        self.kept_t: Optional[float] = None  # last point that went through
+        self.kept_v = 0.0
+        self.last_sample: Optional[Sample] = None  # swinging door: newest point, not sent yet
+        self.last_t = 0.0
+        self.last_v = 0.0
+        self.low = -math.inf  # slopes from the kept point that still fit every dropped point
+        self.high = math.inf
+
+
+class Compressor:
+    """Decides which sensor values of each sample are worth sending on"""
+
+    def __init__(
+        self,
+        mode: str,
+        tolerances: Optional[Dict[str, float]] = None,
+        heartbeat_s: float = settings.compression_heartbeat_s
+    ):
+        if mode not in MODES or mode == "off":
+            raise ValueError(f"Unknown compression mode: {mode}")
+        self.mode = mode
+        self.tolerances = dict(settings.compression_tolerances if tolerances is None else tolerances)
+        self.heartbeat_s = heartbeat_s
+        self._series: Dict[Tuple[str, str], _Series] = {}
+        self._lock = threading.Lock()
+        self.points_in = {sensor: 0 for sensor in SENSORS}
+        self.points_out = {sensor: 0 for sensor in SENSORS}
+
+    def process(self, sample: Sample) -> List[Sample]:
+        """The samples (this one and/or earlier ones) that should go through now"""
+        t = sample.ts.timestamp()
+        device = sample.device or ""
+        passed: Dict[int, Tuple[Sample, List[str]]] = {}  # id(sample) -> (sample, sensors)
+        with self._lock:
+            for sensor in SENSORS:
+                value = getattr(sample, sensor)
+                if value is None:
+                    continue
+                self.points_in[sensor] += 1
+                series = self._series.get((device, sensor))
+                if series is None:
+                    series = self._series[(device, sensor)] = _Series()
+                if self.mode == "deadband":
+                    out = self._deadband(series, sensor, sample, t, value)
+                else:
+                    out = self._swinging_door(series, sensor, sample, t, value)
+                for kept in out:
+                    self.points_out[sensor] += 1
+                    passed.setdefault(id(kept), (kept, []))[1].append(sensor)
+        return _build(passed)
+
+    def flush(self) -> List[Sample]:
+        """Pending swinging-door points, so nothing past the last kept point is lost"""
+        passed: Dict[int, Tuple[Sample, List[str]]] = {}
+        with self._lock:
+            for (_, sensor), series in self._series.items():
+                if series.last_sample is not None:
+                    self.points_out[sensor] += 1
+                    passed.setdefault(id(series.last_sample), (series.last_sample, []))[1].append(sensor)
+                    series.kept_t, series.kept_v = series.last_t, series.last_v
+                    series.last_sample = None
+                    series.low, series.high = -math.inf, math.inf
+        return _build(passed)
+
+    def _deadband(self, series: _Series, sensor: str, sample: Sample, t: float, value: float):
+        if (series.kept_t is None or abs(value - series.kept_v) > self.tolerances.get(sensor, 0.0)
+                or t - series.kept_t >= self.heartbeat_s):
+            series.kept_t, series.kept_v = t, value
+            return (sample,)
+        return ()
+
+    def _swinging_door(self, series: _Series, sensor: str, sample: Sample, t: float, value: float):
+        if series.kept_t is None:
+            series.kept_t, series.kept_v = t, value
+            return (sample,)
+        if series.last_sample is None:
+            series.last_sample, series.last_t, series.last_v = sample, t, value
+            return ()
+
+        # the pending point becomes one of the dropped ones if the line from
+        # the kept point to this new one still passes within tolerance of it
+        tolerance = self.tolerances.get(sensor, 0.0)
+        span = series.last_t - series.kept_t
+        low, high = series.low, series.high
+        if span > 0:
+            low = max(low, (series.last_v - tolerance - series.kept_v) / span)
+            high = min(high, (series.last_v + tolerance - series.kept_v) / span)
+        elif abs(series.last_v - series.kept_v) > tolerance:
+            low, high = math.inf, -math.inf  # same timestamp, can't be bridged
+        elapsed = t - series.kept_t
+        slope = (value - series.kept_v) / elapsed if elapsed > 0 else 0.0
+        fits = low <= slope <= high
+
+        if fits and elapsed < self.heartbeat_s:
+            series.low, series.high = low, high
+            series.last_sample, series.last_t, series.last_v = sample, t, value
+            return ()
+        if fits:
+            # heartbeat, and this point can end the segment itself
+            series.kept_t, series.kept_v = t, value
+            series.last_sample = None
+            series.low, series.high = -math.inf, math.inf
+            return (sample,)
+
+        # door closed: keep the pending point, the new one starts the next segment
+        kept = series.last_sample
+        series.kept_t, series.kept_v = series.last_t, series.last_v
+        series.last_sample, series.last_t, series.last_v = sample, t, value
+        series.low, series.high = -math.inf, math.inf
+        return (kept,)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            total_in = sum(self.points_in.values())
+            total_out = sum(self.points_out.values())
+            return {
+                "mode": self.mode,
+                "tolerances": self.tolerances,
+                "heartbeat_s": self.heartbeat_s,
+                "series": len(self._series),
+                "points_in": total_in,
+                "points_out": total_out,
+                "ratio": round(total_in / total_out, 2) if total_out else None,
+                "sensors": {
+                    sensor: {
+                        "points_in": self.points_in[sensor],
+                        "points_out": self.points_out[sensor],
+                        "ratio": (round(self.points_in[sensor] / self.points_out[sensor], 2)
+                                  if self.points_out[sensor] else None)
+                    }
+                    for sensor in SENSORS
+                }
+            }
+
+
+def _build(passed: Dict[int, Tuple[Sample, List[str]]]) -> List[Sample]:
+    # copies carrying only the sensors that went through, oldest first
+    out = []
+    for sample, sensors in passed.values():
+        if len(sensors) == len(SENSORS):
+            out.append(sample)
+            continue
+        out.append(dataclasses.replace(
+            sample, **{sensor: None for sensor in SENSORS if sensor not in sensors}
+        ))
+    out.sort(key=lambda s: s.ts)
+    return out
+
+
+class CompressedSink(Sink):
+    """Runs a sink's samples through a Compressor first, same name as the wrapped sink"""
+
+    def __init__(self, inner: Sink, compressor: Compressor):
+        super().__init__()
+        self.inner = inner
+        self.compressor = compressor
+        self.name = inner.name
+
+    def start(self):
+        self.inner.start()
+
+    def stop(self, timeout: float = 10.0):
+        for sample in self.compressor.flush():
+            self.inner.offer(sample)
+        self.inner.stop(timeout=timeout)
+
+    def handle(self, sample: Sample):
+        for kept in self.compressor.process(sample):
+            self.inner.offer(kept)
+
+    def get_stats(self) -> Dict:
+        return {**self.inner.get_stats(), "compression": self.compressor.get_stats()}
+
+
+def compressed(sink: Sink, mode: str) -> Sink:
+    """sink wrapped in a CompressedSink, or as it is when mode is "off" """
+    if mode == "off":
+        return sink
+    return CompressedSink(sink, Compressor(mode))
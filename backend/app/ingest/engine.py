@@ -0,0 +1,154 @@
+"""Ingestion engine: source -> parse -> fan-out.
+
+The source is the DeviceManager: every ESP32SerialReader reads whole
+chunks off its port and splits them into lines, then parse_line turns each
+line into a Sample, all on that reader's thread. The engine is the fan-out
+stage. It hands each Sample to every registered sink (database, websocket,
+file, metrics). Both the API server and the standalone
+`python -m app.serial_reader` script go through it, so there is only one
+hot path.
+
+Before the fan-out each sample gets its device's send time (ClockAligner)
+and waits in the ReorderBuffer until it can go out in ts order. A timer
+thread releases what is ready when no new samples come in.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from app import metrics
+from app.config.settings import settings
+from app.ingest.clock import ClockAligner
+from app.ingest.reorder import ReorderBuffer
+from app.ingest.sinks import Sink
+from app.serial.parser import Sample
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionEngine:
+    """Routes samples from the device manager to a set of sinks"""
+
+    def __init__(
+        self,
+        source,
+        sinks: Iterable[Sink] = (),
+        align_clocks: bool = settings.clock_align_enabled,
+        reorder_delay_s: float = settings.ingest_reorder_delay_s
+    ):
+        self.source = source
+        # replaced, never mutated, so publish() can iterate without a lock
+        self._sinks: Tuple[Sink, ...] = tuple(sinks)
+        self.clocks = ClockAligner() if align_clocks else None
+        self.reorder = ReorderBuffer(reorder_delay_s) if reorder_delay_s > 0 else None
+        # one thread at a time hands released samples on, so they stay in order
+        self._release_lock = threading.Lock()
+        self._stop_release = threading.Event()
+        self._release_thread: Optional[threading.Thread] = None
+        self.running = False
+        self.published = 0
+        self.started_at: Optional[float] = None
+
+    @property
+    def sinks(self) -> Tuple[Sink, ...]:
+        return self._sinks
+
+    def get_sink(self, name: str) -> Optional[Sink]:
+        return next((sink for sink in self._sinks if sink.name == name), None)
+
+    def add_sink(self, sink: Sink):
+        if self.get_sink(sink.name):
+            raise ValueError(f"Sink '{sink.name}' is already registered")
+        if self.running:
+            sink.start()
+        self._sinks = self._sinks + (sink,)
+
+    def remove_sink(self, name: str) -> bool:
+        sink = self.get_sink(name)
+        if sink is None:
+            return False
+        self._sinks = tuple(s for s in self._sinks if s is not sink)
+        if self.running:
+            sink.stop()
+        return True
+
+    def publish(self, sample: Sample):
+        # runs on whichever reader thread produced the sample
+        self.published += 1
+        if sample.ts is None:
+            sample.ts = datetime.now(timezone.utc)
+        if self.clocks is not None:
+            self.clocks.align(sample)
+        if self.reorder is None:
+            self._fan_out(sample)
+            return
+        self.reorder.push(sample)
+        self._release()
+
+    def _release(self, flush: bool = False):
+        with self._release_lock:
+            ready = self.reorder.flush() if flush else self.reorder.pop_ready()
+            for sample in ready:
+                self._fan_out(sample)
+
+    def _release_loop(self):
+        # releases the tail when the devices go quiet
+        interval = self.reorder.delay_s / 2
+        while not self._stop_release.wait(interval):
+            self._release()
+
+    def _fan_out(self, sample: Sample):
+        started = time.perf_counter() if metrics.ENABLED else 0.0
+        for sink in self._sinks:
+            sink.offer(sample)
+        if metrics.ENABLED:
+            metrics.PUBLISH_SECONDS.observe(time.perf_counter() - started)
+
+    def start(self):
+        if self.running:
+            return
+        for sink in self._sinks:
+            sink.start()
+        self.source.on_reading = self.publish
+        if self.reorder is not None:
+            self._stop_release.clear()
+            self._release_thread = threading.Thread(
+                target=self._release_loop, name="ingest-reorder", daemon=True
+            )
+            self._release_thread.start()
+        self.running = True
+        self.started_at = time.monotonic()
+        logger.info("Ingestion started with sinks: %s",
+                    ", ".join(sink.name for sink in self._sinks))
+
+    def stop(self):
+        # readers first so nothing new arrives, then let the sinks drain
+        if not self.running:
+            return
+        self.source.stop_discovery()
+        self.source.disconnect_all()
+        self.source.on_reading = None
+        if self.reorder is not None:
+            self._stop_release.set()
+            if self._release_thread:
+                self._release_thread.join(timeout=5.0)
+            self._release_thread = None
+            self._release(flush=True)
+        for sink in self._sinks:
+            sink.stop()
+        self.running = False
+        logger.info("Ingestion stopped after %d samples", self.published)
+
+    def get_stats(self) -> Dict:
+        uptime = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "running": self.running,
+            "published": self.published,
+            "uptime_s": round(uptime, 1),
+            "devices": len(self.source.devices),
+            "clock": self.clocks.get_stats() if self.clocks is not None else None,
+            "reorder": self.reorder.get_stats() if self.reorder is not None else None,
+            "sinks": {sink.name: sink.get_stats() for sink in self._sinks}
+        }
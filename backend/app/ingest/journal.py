@@ -0,0 +1,290 @@
+"""Append-only on-disk journal of parsed samples.
+
+Every sample is appended here before anything touches the database, so a
+postgres outage (or a crash) can't lose data. The journal is a directory of
+segment files named after the offset of their first record:
+
+    journal/
+        journal.id                   random id, keys the committed offset in the db
+        00000000000000000000.seg
+        00000000000000052113.seg     active segment, appended to
+
+A record is a little-endian header (payload length, crc32 of the payload)
+followed by the payload: receive time, device_ts_ms, the three sensor values
+(NaN for missing) and the device id. Offsets count records, not bytes.
+Segments roll over once they pass segment_bytes, and whole segments are
+deleted once everything in them is committed to the database (see
+app.db.journal_replay).
+
+Each append is a single unbuffered write(), so a record is with the OS as
+soon as append() returns and survives the process crashing; fsync=True
+also makes flush() push it to the disk. On open the active segment is
+scanned and a torn record at the end (power loss in the middle of a write)
+is cut off. A bad record inside a closed segment can't be that, and the
+length in its header can't be trusted either, so read() skips the rest of
+that segment and counts the records as corrupt instead of stopping there.
+"""
+import logging
+import math
+import os
+import struct
+import threading
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from app.serial.parser import Sample
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("<II")  # payload length, crc32
+BODY = struct.Struct("<dqdddH")  # ts, device_ts_ms, temp_c, hum_pct, distance_cm, device length
+NO_DEVICE_TS = -(2 ** 63)
+SEGMENT_SUFFIX = ".seg"
+NAN = float("nan")
+
+
+def encode_sample(sample: Sample) -> bytes:
+    device = sample.device.encode("utf-8") if sample.device else b""
+    ts = sample.ts.timestamp() if sample.ts else datetime.now(timezone.utc).timestamp()
+    body = BODY.pack(
+        ts,
+        NO_DEVICE_TS if sample.device_ts_ms is None else sample.device_ts_ms,
+        NAN if sample.temp_c is None else sample.temp_c,
+        NAN if sample.hum_pct is None else sample.hum_pct,
+        NAN if sample.distance_cm is None else sample.distance_cm,
+        len(device)
+    ) + device
+    return HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode_sample(body: bytes) -> Sample:
+    ts, device_ts_ms, temp_c, hum_pct, distance_cm, device_len = BODY.unpack_from(body)
+    device = body[BODY.size:BODY.size + device_len].decode("utf-8") if device_len else None
+    return Sample(
+        device_ts_ms=None if device_ts_ms == NO_DEVICE_TS else device_ts_ms,
+        temp_c=None if math.isnan(temp_c) else temp_c,
+        hum_pct=None if math.isnan(hum_pct) else hum_pct,
+        distance_cm=None if math.isnan(distance_cm) else distance_cm,
+        device=device,
+        ts=datetime.fromtimestamp(ts, timezone.utc)
+    )
+
+
+def read_record(f: BinaryIO) -> Optional[bytes]:
+    """Next payload, or None at the end of the data (including a torn or corrupt record)"""
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    length, crc = HEADER.unpack(header)
+    body = f.read(length)
+    if len(body) < length or zlib.crc32(body) != crc:
+        return None
+    return body
+
+
+class Journal:
+    """Segmented append-only sample log, safe to append from several reader threads"""
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024,
+                 max_bytes: int = 0, fsync: bool = False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes  # 0 = no limit, otherwise oldest segments go first
+        self.fsync = fsync
+        self.journal_id = ""
+        self.next_offset = 0
+        self.appended = 0
+        self.discarded = 0  # records lost to max_bytes
+        self.corrupt = 0  # records skipped by read() because they didn't decode
+        self._lock = threading.Lock()
+        self._segments: List[int] = []  # base offsets, oldest first
+        self._active: Optional[BinaryIO] = None
+        self._active_size = 0
+        self._read_cursor: Optional[Tuple[int, int, int]] = None  # (offset, segment base, file position)
+
+    @property
+    def is_open(self) -> bool:
+        return self._active is not None
+
+    def _segment_path(self, base: int) -> str:
+        return os.path.join(self.directory, f"{base:020d}{SEGMENT_SUFFIX}")
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        id_path = os.path.join(self.directory, "journal.id")
+        if os.path.exists(id_path):
+            with open(id_path, encoding="utf-8") as f:
+                self.journal_id = f.read().strip()
+        else:
+            self.journal_id = uuid.uuid4().hex
+            with open(id_path, "w", encoding="utf-8") as f:
+                f.write(self.journal_id)
+
+        self._segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+        )
+        if not self._segments:
+            self._segments = [0]
+        base = self._segments[-1]
+        path = self._segment_path(base)
+
+        # find the end of the last good record in the active segment
+        count, good_end = 0, 0
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                while read_record(f) is not None:
+                    count += 1
+                    good_end = f.tell()
+            if good_end < os.path.getsize(path):
+                logger.warning("Journal: cutting off a torn record at the end of %s", path)
+                os.truncate(path, good_end)
+
+        self.next_offset = base + count
+        self._active = open(path, "ab", buffering=0)
+        self._active_size = good_end
+        logger.info("Journal %s opened at offset %d (%d segment(s))",
+                    self.directory, self.next_offset, len(self._segments))
+
+    def close(self):
+        with self._lock:
+            if self._active:
+                self._flush_locked()
+                self._active.close()
+            self._active = None
+
+    def append(self, sample: Sample) -> int:
+        """Append one record, returns its offset"""
+        record = encode_sample(sample)
+        with self._lock:
+            if self._active_size >= self.segment_bytes:
+                self._roll_locked()
+            self._active.write(record)
+            self._active_size += len(record)
+            offset = self.next_offset
+            self.next_offset += 1
+            self.appended += 1
+        return offset
+
+    def flush(self):
+        # records are already with the OS, this gets them onto the disk with fsync=True
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._active.flush()
+        if self.fsync:
+            os.fsync(self._active.fileno())
+
+    def _roll_locked(self):
+        self._flush_locked()
+        self._active.close()
+        self._segments.append(self.next_offset)
+        self._active = open(self._segment_path(self.next_offset), "ab", buffering=0)
+        self._active_size = 0
+        if self.max_bytes:
+            self._enforce_max_bytes_locked()
+
+    def _enforce_max_bytes_locked(self):
+        # disk guard for very long outages: drop the oldest closed segments
+        while len(self._segments) > 1 and self.size_bytes() > self.max_bytes:
+            base, next_base = self._segments[0], self._segments[1]
+            os.remove(self._segment_path(base))
+            self._segments.pop(0)
+            self.discarded += next_base - base
+            logger.error("Journal over %d bytes, dropped %d unreplayed records",
+                         self.max_bytes, next_base - base)
+
+    @property
+    def first_offset(self) -> int:
+        return self._segments[0]
+
+    def read(self, offset: int, max_records: int) -> Tuple[List[Sample], int]:
+        """Up to max_records flushed samples starting at offset, plus the offset after them"""
+        with self._lock:
+            segments = list(self._segments)
+        offset = max(offset, segments[0])
+
+        cursor = self._read_cursor
+        if cursor and cursor[0] == offset and cursor[1] in segments:
+            # sequential reads pick up where the last one stopped
+            base, position, record_offset = cursor[1], cursor[2], offset
+        else:
+            base = max(b for b in segments if b <= offset)
+            position, record_offset = 0, base
+
+        samples: List[Sample] = []
+        body = None
+        while True:
+            with open(self._segment_path(base), "rb") as f:
+                f.seek(position)
+                while len(samples) < max_records:
+                    position = f.tell()
+                    body = read_record(f)
+                    if body is None:
+                        break
+                    if record_offset >= offset:
+                        try:
+                            samples.append(decode_sample(body))
+                        except (struct.error, ValueError) as e:
+                            # crc matched but the payload doesn't decode, skip just this one
+                            self.corrupt += 1
+                            logger.error("Journal: skipping undecodable record %d: %s", record_offset, e)
+                    record_offset += 1
+                else:
+                    position = f.tell()
+
+            index = segments.index(base)
+            if body is None and index + 1 < len(segments) and record_offset < segments[index + 1]:
+                # closed segment ends early: corrupt record, the rest of the segment is lost
+                skipped = segments[index + 1] - record_offset
+                self.corrupt += skipped
+                logger.error("Journal: corrupt record at offset %d in %s, skipping %d record(s)",
+                             record_offset, self._segment_path(base), skipped)
+                record_offset = base = segments[index + 1]
+                position = 0
+                continue
+
+            # move on to the next segment once this one is exhausted
+            if (len(samples) < max_records and index + 1 < len(segments)
+                    and record_offset >= segments[index + 1]):
+                base, position = segments[index + 1], 0
+                continue
+            break
+
+        next_offset = max(offset, record_offset)
+        self._read_cursor = (next_offset, base, position)
+        return samples, next_offset
+
+    def release(self, committed: int) -> int:
+        """Delete segments whose records are all below committed, returns how many"""
+        removed = 0
+        with self._lock:
+            while len(self._segments) > 1 and self._segments[1] <= committed:
+                os.remove(self._segment_path(self._segments.pop(0)))
+                removed += 1
+        return removed
+
+    def size_bytes(self) -> int:
+        total = 0
+        for base in self._segments:
+            try:
+                total += os.path.getsize(self._segment_path(base))
+            except OSError:
+                pass
+        return total
+
+    def get_stats(self) -> Dict:
+        return {
+            "directory": self.directory,
+            "journal_id": self.journal_id,
+            "first_offset": self.first_offset,
+            "next_offset": self.next_offset,
+            "segments": len(self._segments),
+            "size_bytes": self.size_bytes(),
+            "appended": self.appended,
+            "discarded": self.discarded,
+            "corrupt": self.corrupt
+        }
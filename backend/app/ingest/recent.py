@@ -0,0 +1,144 @@
+"""Recent samples kept in memory, one fixed-size ring buffer per (device, sensor).
+
+Filled by RecentSink on ingest and preloaded from the database at startup,
+so /readings/latest and /readings/recent never hit postgres. Each buffer is
+two preallocated array('d') (timestamps in epoch seconds, values), so memory
+per sensor stays fixed at capacity * 16 bytes no matter how long the server
+runs.
+"""
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.config.settings import settings
+from app.db.persistence import SENSOR_UNITS
+from app.serial.parser import Sample
+
+SeriesKey = Tuple[str, str]  # (device, sensor), device is "" when unknown
+
+
+class RingBuffer:
+    """Fixed-capacity (ts, value) buffer, oldest entries are overwritten"""
+
+    __slots__ = ("capacity", "ts", "values", "head", "count")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.ts = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.head = 0  # next slot to write
+        self.count = 0
+
+    def append(self, ts: float, value: float):
+        head = self.head
+        self.ts[head] = ts
+        self.values[head] = value
+        self.head = (head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _slot(self, i: int) -> int:
+        # slot of the i-th oldest entry
+        return (self.head - self.count + i) % self.capacity
+
+    def last(self) -> Optional[Tuple[float, float]]:
+        if not self.count:
+            return None
+        slot = (self.head - 1) % self.capacity
+        return self.ts[slot], self.values[slot]
+
+    def since(self, start_ts: float) -> List[Tuple[float, float]]:
+        """Entries with ts >= start_ts, oldest first (binary search, ts is append order)"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[self._slot(mid)] < start_ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        ts, values = self.ts, self.values
+        return [(ts[slot], values[slot]) for slot in map(self._slot, range(lo, self.count))]
+
+    def nbytes(self) -> int:
+        return self.ts.itemsize * len(self.ts) + self.values.itemsize * len(self.values)
+
+
+class RecentCache:
+    """Ring buffers keyed by (device, sensor)"""
+
+    def __init__(self, capacity: int = settings.recent_buffer_size):
+        self.capacity = capacity
+        self.buffers: Dict[SeriesKey, RingBuffer] = {}
+        self._lock = threading.Lock()
+
+    def _buffer(self, key: SeriesKey) -> RingBuffer:
+        # caller must hold the lock
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = RingBuffer(self.capacity)
+        return buffer
+
+    def add_sample(self, sample: Sample):
+        ts = sample.ts.timestamp() if sample.ts else time.time()
+        device = sample.device or ""
+        with self._lock:
+            for sensor in SENSOR_UNITS:
+                value = getattr(sample, sensor)
+                if value is not None:
+                    self._buffer((device, sensor)).append(ts, value)
+
+    def preload(self, rows: Iterable[Tuple[str, str, float, float]]):
+        """Fill from (device, sensor, ts, value) rows ordered by ts (warm start)
+
+        Runs in the background at startup, so live samples may already be in
+        a buffer. Rows from before the first of them go in front, the rest is
+        already there.
+        """
+        with self._lock:
+            live = {key: buffer.since(float("-inf")) for key, buffer in self.buffers.items()}
+            for key in live:
+                self.buffers[key] = RingBuffer(self.capacity)
+            for device, sensor, ts, value in rows:
+                key = (device or "", sensor)
+                entries = live.get(key)
+                if entries and ts >= entries[0][0]:
+                    continue
+                self._buffer(key).append(ts, value)
+            for key, entries in live.items():
+                buffer = self._buffer(key)
+                for ts, value in entries:
+                    buffer.append(ts, value)
+
+    def keys(self, device: Optional[str] = None, sensor: Optional[str] = None) -> List[SeriesKey]:
+        with self._lock:
+            return sorted(
+                key for key in self.buffers
+                if (device is None or key[0] == device) and (sensor is None or key[1] == sensor)
+            )
+
+    def latest(self, key: SeriesKey) -> Optional[Tuple[float, float]]:
+        with self._lock:
+            buffer = self.buffers.get(key)
+            return buffer.last() if buffer else None
+
+    def since(self, key: SeriesKey, start_ts: float) -> List[Tuple[float, float]]:
+        with self._lock:
+            buffer = self.buffers.get(key)
+            return buffer.since(start_ts) if buffer else []
+
+    def clear(self):
+        with self._lock:
+            self.buffers.clear()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "series": len(self.buffers),
+                "capacity_per_series": self.capacity,
+                "samples": sum(b.count for b in self.buffers.values()),
+                "memory_bytes": sum(b.nbytes() for b in self.buffers.values())
+            }
+
+
+recent_cache = RecentCache()
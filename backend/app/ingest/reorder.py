@@ -0,0 +1,90 @@
+"""Reorder buffer between clock alignment and the sinks.
+
+With device-clock timestamps samples no longer reach the engine in ts
+order: devices interleave, and a clock model that gets corrected steps
+back a little. The buffer keeps samples on a heap by ts and releases the
+ones older than the watermark (now - delay_s) in ts order, so every sink
+sees a sorted, append-only stream and compression, sessions and the
+rollups never have to deal with a point in the past.
+
+A sample that is still older than the last one released for its device
+(it arrived more than delay_s late) goes out with that device's last ts
+instead and is counted as late. Devices are never compared with each
+other, each one's stream is only sorted on its own, and that is all the
+per-series sinks need. If the buffer holds max_samples the oldest go out
+early.
+"""
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+from app.serial.parser import Sample
+
+
+class ReorderBuffer:
+    """Holds samples for delay_s and hands them back sorted by ts"""
+
+    def __init__(
+        self,
+        delay_s: float = settings.ingest_reorder_delay_s,
+        max_samples: int = settings.ingest_sink_queue_size
+    ):
+        self.delay_s = delay_s
+        self.max_samples = max_samples
+        self._heap: List[Tuple[datetime, int, Sample]] = []
+        self._order = itertools.count()  # ties keep arrival order
+        self._lock = threading.Lock()
+        self.last_released: Dict[Optional[str], datetime] = {}  # per device
+        self.pushed = 0
+        self.released = 0
+        self.late = 0
+        self.forced = 0
+        self.max_depth = 0
+
+    def push(self, sample: Sample):
+        with self._lock:
+            heapq.heappush(self._heap, (sample.ts, next(self._order), sample))
+            self.pushed += 1
+            self.max_depth = max(self.max_depth, len(self._heap))
+
+    def pop_ready(self, now: Optional[float] = None) -> List[Sample]:
+        """Samples older than the watermark, oldest first"""
+        watermark = datetime.fromtimestamp((now or time.time()) - self.delay_s, timezone.utc)
+        ready = []
+        with self._lock:
+            heap = self._heap
+            while heap and (heap[0][0] <= watermark or len(heap) > self.max_samples):
+                if heap[0][0] > watermark:
+                    self.forced += 1
+                ready.append(self._release(heapq.heappop(heap)[2]))
+        return ready
+
+    def flush(self) -> List[Sample]:
+        # everything, on shutdown
+        with self._lock:
+            ready = [self._release(heapq.heappop(self._heap)[2]) for _ in range(len(self._heap))]
+        return ready
+
+    def _release(self, sample: Sample) -> Sample:
+        last = self.last_released.get(sample.device)
+        if last is not None and sample.ts < last:
+            sample.ts = last
+            self.late += 1
+        self.last_released[sample.device] = sample.ts
+        self.released += 1
+        return sample
+
+    def get_stats(self) -> Dict:
+        return {
+            "delay_s": self.delay_s,
+            "depth": len(self._heap),
+            "max_depth": self.max_depth,
+            "pushed": self.pushed,
+            "released": self.released,
+            "late": self.late,
+            "forced": self.forced
+        }
@@ -0,0 +1,229 @@
+"""Desk occupancy sessions, detected incrementally from distance_cm.
+
+The ultrasonic sensor reads short when someone sits at the desk and long
+when the chair is empty. Thresholds with a gap between them (hysteresis)
+plus a minimum duration keep a noisy reading or a quick lean back from
+flipping the state:
+
+    present  distance < session_present_below_cm for session_enter_s
+    away     distance > session_away_above_cm for session_leave_s
+
+Readings between the two thresholds keep the current state and neither
+confirm nor cancel a pending change. A state change
+is dated back to when the new condition started, not when it was confirmed.
+No samples for session_gap_s ends the session at the last sample.
+
+SessionDetector only turns readings into SessionChange events. SessionSink
+runs it on its own thread and hands the events to a store
+(app.db.sessions.SessionStore) that keeps the sessions and session_days
+tables current, so the API never scans raw readings.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.config.settings import settings
+from app.ingest.sinks import Sink
+from app.serial.parser import Sample
+
+logger = logging.getLogger(__name__)
+
+PRESENT = "present"
+AWAY = "away"
+SESSION_STATES = (PRESENT, AWAY)
+
+
+@dataclass(slots=True)
+class SessionChange:
+    # ended is None while the session is still open
+    device: str
+    state: str
+    started: float  # epoch seconds
+    ended: Optional[float] = None
+
+
+@dataclass(slots=True)
+class _DeviceState:
+    state: Optional[str] = None
+    started: float = 0.0
+    last_seen: Optional[float] = None
+    candidate: Optional[str] = None
+    candidate_since: float = 0.0
+
+
+class SessionDetector:
+    """Per-device hysteresis state machine over distance readings"""
+
+    def __init__(
+        self,
+        present_below_cm: float = settings.session_present_below_cm,
+        away_above_cm: float = settings.session_away_above_cm,
+        enter_s: float = settings.session_enter_s,
+        leave_s: float = settings.session_leave_s,
+        gap_s: float = settings.session_gap_s
+    ):
+        if present_below_cm > away_above_cm:
+            raise ValueError("present_below_cm must not be above away_above_cm")
+        self.present_below_cm = present_below_cm
+        self.away_above_cm = away_above_cm
+        self.enter_s = enter_s
+        self.leave_s = leave_s
+        self.gap_s = gap_s
+        self._devices: Dict[str, _DeviceState] = {}
+        self._lock = threading.Lock()
+
+    def restore(self, device: str, state: str, started: float, last_seen: float):
+        # picks up a session that was still open when the process stopped
+        with self._lock:
+            self._devices[device] = _DeviceState(state=state, started=started, last_seen=last_seen)
+
+    def update(self, device: str, ts: float, distance_cm: float) -> List[SessionChange]:
+        changes: List[SessionChange] = []
+        with self._lock:
+            current = self._devices.get(device)
+            if current is None:
+                current = self._devices[device] = _DeviceState()
+
+            if current.last_seen is not None and ts - current.last_seen > self.gap_s:
+                if current.state is not None:
+                    changes.append(SessionChange(device, current.state, current.started, current.last_seen))
+                current.state = current.candidate = None
+            if current.last_seen is not None and ts < current.last_seen:
+                return changes  # out of order, the state already moved past it
+            current.last_seen = ts
+
+            if distance_cm < self.present_below_cm:
+                observed = PRESENT
+            elif distance_cm > self.away_above_cm:
+                observed = AWAY
+            else:
+                observed = None
+
+            if observed is None:
+                return changes  # in between, doesn't confirm or cancel anything
+            if observed == current.state:
+                current.candidate = None
+                return changes
+            if current.candidate != observed:
+                current.candidate, current.candidate_since = observed, ts
+            needed = self.enter_s if observed == PRESENT else self.leave_s
+            if ts - current.candidate_since < needed:
+                return changes
+
+            if current.state is not None:
+                changes.append(SessionChange(device, current.state, current.started,
+                                             current.candidate_since))
+            current.state, current.started = observed, current.candidate_since
+            current.candidate = None
+            changes.append(SessionChange(device, observed, current.started))
+        return changes
+
+    def expire(self, now: float) -> List[SessionChange]:
+        """Ends sessions of devices that went quiet for longer than gap_s"""
+        changes = []
+        with self._lock:
+            for device, current in self._devices.items():
+                if (current.state is not None and current.last_seen is not None
+                        and now - current.last_seen > self.gap_s):
+                    changes.append(SessionChange(device, current.state, current.started, current.last_seen))
+                    current.state = current.candidate = None
+        return changes
+
+    def open_sessions(self, device: Optional[str] = None) -> List[SessionChange]:
+        """Sessions still going, ended is set to the last reading"""
+        with self._lock:
+            return [
+                SessionChange(name, current.state, current.started, current.last_seen)
+                for name, current in self._devices.items()
+                if current.state is not None and (device is None or name == device)
+            ]
+
+
+class SessionSink(Sink):
+    # runs the detector off the reader threads, the store writes the changes
+    name = "sessions"
+    threaded = True
+
+    def __init__(self, detector: SessionDetector, store,
+                 checkpoint_s: float = settings.session_checkpoint_s):
+        super().__init__()
+        self.detector = detector
+        self.store = store
+        self.checkpoint_s = checkpoint_s
+        self._pending: List[SessionChange] = []
+        self._last_checkpoint = time.monotonic()
+        self._restored = False
+        self.changes = 0
+        self.failures = 0  # exceptions caught in the detector or the store
+        self.lost = 0  # changes dropped because the store failed on them
+
+    def handle_batch(self, samples: List[Sample]):
+        # never raises: the detector is stateful, a batch handed to it twice
+        # (Sink._run retrying sample by sample) would be counted twice
+        if not self._restored:
+            # on the worker thread, so a slow db doesn't hold up startup
+            try:
+                for change in self.store.load_open():
+                    self.detector.restore(change.device, change.state, change.started, change.ended)
+            except Exception:
+                self.failures += 1
+                logger.exception("Could not restore open sessions, starting without them")
+            self._restored = True
+        for sample in samples:
+            if sample.distance_cm is not None:
+                try:
+                    self._pending.extend(self.detector.update(
+                        sample.device or "", sample.ts.timestamp(), sample.distance_cm
+                    ))
+                except Exception:
+                    self.failures += 1
+                    logger.exception("Session detector failed on %r", sample)
+        try:
+            self._pending.extend(self.detector.expire(time.time()))
+        except Exception:
+            self.failures += 1
+            logger.exception("Session detector failed to expire sessions")
+
+        checkpoint = time.monotonic() - self._last_checkpoint >= self.checkpoint_s
+        if not self._pending and not checkpoint:
+            return
+        # kept until the store takes them, so a db outage only delays them
+        if not self._write(self.detector.open_sessions() if checkpoint else []):
+            return
+        self.changes += len(self._pending)
+        self._pending = []
+        if checkpoint:
+            self._last_checkpoint = time.monotonic()
+
+    def _write(self, open_sessions: List[SessionChange]) -> bool:
+        try:
+            return self.store.write(self._pending, open_sessions)
+        except Exception:
+            # not the db being away (write() returns False for that), the same
+            # changes would fail again on every batch
+            self.failures += 1
+            self.lost += len(self._pending)
+            logger.exception("Session store failed, dropping %d session changes", len(self._pending))
+            self._pending = []
+            return False
+
+    def close(self):
+        if self._write(self.detector.open_sessions()):
+            self._pending = []
+        elif self._pending:
+            logger.error("Lost %d session changes on shutdown", len(self._pending))
+
+    def get_stats(self) -> Dict:
+        return {
+            **super().get_stats(),
+            "changes": self.changes,
+            "pending": len(self._pending),
+            "failures": self.failures,
+            "lost": self.lost,
+            "open": len(self.detector.open_sessions())
+        }
+
+
+session_detector = SessionDetector()
@@ -0,0 +1,267 @@
+"""Sinks for the ingestion engine.
+
+Every parsed Sample is offered to each sink. Sinks that only hand the
+sample off to something that already queues (the write-behind writer, the
+event loop) run inline on the reader thread. Sinks that do real work of
+their own (files) set threaded = True and get a bounded queue plus a
+worker thread, so a slow disk can't stall serial reads. When that queue is
+full the oldest samples are dropped.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from app.config.settings import settings
+from app.serial.parser import Sample
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# expected failures (disk full, a closed loop, a bad value) are logged in one
+# line, anything else with its traceback. Neither stops the sink or the reader
+SINK_ERRORS = (OSError, RuntimeError, ValueError, TypeError)
+
+
+class Sink:
+    """Base class, subclasses implement handle() (and handle_batch() if they can do better)"""
+
+    name = "sink"
+    threaded = False
+
+    def __init__(self, queue_size: int = settings.ingest_sink_queue_size):
+        self.queue_size = queue_size
+        self._queue: Deque[Sample] = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.received = 0
+        self.handled = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self):
+        if not self.threaded or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._work_loop, name=f"sink-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        # threaded sinks drain their queue first
+        if self._thread:
+            with self._lock:
+                self._stopping = True
+                self._not_empty.notify()
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                logger.warning("Sink %s did not drain in %.1fs", self.name, timeout)
+            self._thread = None
+        self.close()
+
+    def offer(self, sample: Sample):
+        # called on the reader thread for every sample
+        if not self.threaded:
+            self.received += 1
+            self._run([sample])
+            return
+
+        with self._lock:
+            self.received += 1
+            if len(self._queue) >= self.queue_size:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(sample)
+            self._not_empty.notify()
+
+    def _work_loop(self):
+        while True:
+            with self._lock:
+                self._not_empty.wait_for(lambda: self._stopping or self._queue)
+                if self._stopping and not self._queue:
+                    return
+                batch = list(self._queue)
+                self._queue.clear()
+            self._run(batch)
+
+    def _run(self, batch: List[Sample]):
+        retry_each = False
+        try:
+            self.handle_batch(batch)
+            self.handled += len(batch)
+        except SINK_ERRORS as e:
+            self.errors += len(batch)
+            logger.error("Sink %s failed on %d samples: %s", self.name, len(batch), e)
+        except Exception:
+            if len(batch) > 1:
+                # most likely one bad sample, don't lose the rest of the batch with it
+                retry_each = True
+            else:
+                self.errors += 1
+                logger.exception("Sink %s failed on a sample: %r", self.name, batch[0])
+        if retry_each:
+            for sample in batch:
+                self._run([sample])
+
+    def handle_batch(self, samples: List[Sample]):
+        for sample in samples:
+            self.handle(sample)
+
+    def handle(self, sample: Sample):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def get_stats(self) -> Dict:
+        return {
+            "threaded": self.threaded,
+            "queue_depth": len(self._queue),
+            "received": self.received,
+            "handled": self.handled,
+            "dropped": self.dropped,
+            "errors": self.errors
+        }
+
+
+class DbSink(Sink):
+    # hands samples to the write-behind writer, which batches them on its own thread
+    name = "db"
+
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def start(self):
+        self.writer.start()
+
+    def stop(self, timeout: float = 10.0):
+        # flushes whatever is still queued
+        self.writer.stop(timeout=timeout)
+
+    def handle(self, sample: Sample):
+        self.writer.submit(sample)
+
+    def get_stats(self) -> Dict:
+        return {**super().get_stats(), "writer": self.writer.get_stats()}
+
+
+class WebSocketSink(Sink):
+    # passes samples to the event loop, the ConnectionManager fans them out per client
+    name = "websocket"
+
+    def __init__(self, manager, loop=None):
+        super().__init__()
+        self.manager = manager
+        self.loop = loop  # set once the event loop is running
+
+    def handle(self, sample: Sample):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.manager.publish_sample, sample)
+
+
+class FileSink(Sink):
+    # appends every sample as one json line (NDJSON)
+    name = "file"
+    threaded = True
+
+    def __init__(self, path: str, queue_size: int = settings.ingest_sink_queue_size):
+        super().__init__(queue_size)
+        self.path = path
+        self._file = None
+
+    def start(self):
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        super().start()
+
+    def handle_batch(self, samples: List[Sample]):
+        dumps = orjson.dumps if orjson is not None else _dumps_stdlib
+        self._file.write(b"".join(dumps(sample.to_dict()) + b"\n" for sample in samples))
+        self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+        self._file = None
+
+
+class MetricsSink(Sink):
+    # per-device sample counts and rates
+    name = "metrics"
+
+    def __init__(self, window_s: float = 10.0):
+        super().__init__()
+        self.window_s = window_s
+        self._devices: Dict[str, Dict] = {}
+        self._stats_lock = threading.Lock()
+
+    def handle(self, sample: Sample):
+        now = time.monotonic()
+        device = sample.device or ""
+        with self._stats_lock:
+            stats = self._devices.get(device)
+            if stats is None:
+                stats = self._devices[device] = {
+                    "samples": 0, "window_start": now, "window_samples": 0, "rate_hz": 0.0
+                }
+            stats["samples"] += 1
+            stats["window_samples"] += 1
+            stats["last_seen"] = now
+            elapsed = now - stats["window_start"]
+            if elapsed >= self.window_s:
+                stats["rate_hz"] = stats["window_samples"] / elapsed
+                stats["window_start"] = now
+                stats["window_samples"] = 0
+
+    def get_stats(self) -> Dict:
+        now = time.monotonic()
+        with self._stats_lock:
+            devices = {
+                device: {
+                    "samples": stats["samples"],
+                    "rate_hz": round(stats["rate_hz"], 2),
+                    "last_seen_s_ago": round(now - stats["last_seen"], 2)
+                }
+                for device, stats in self._devices.items()
+            }
+        return {**super().get_stats(), "devices": devices}
+
+
+class RecentSink(Sink):
+    # keeps the in-memory ring buffers (app.ingest.recent) up to date
+    name = "recent"
+
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
+
+    def handle(self, sample: Sample):
+        self.cache.add_sample(sample)
+
+    def get_stats(self) -> Dict:
+        return {**super().get_stats(), "cache": self.cache.get_stats()}
+
+
+class CallbackSink(Sink):
+    # calls a plain function for every sample (standalone script, benchmarks)
+    def __init__(self, callback: Callable[[Sample], None], name: str = "callback"):
+        super().__init__()
+        self.callback = callback
+        self.name = name
+
+    def handle(self, sample: Sample):
+        self.callback(sample)
+
+
+def _dumps_stdlib(data: Dict) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
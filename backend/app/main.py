@@ -1,126 +1,367 @@
 # main fastapi app
+#
+# importing this module only builds the app and its routes. the database
+# engines, the ingestion pipeline and the device connections are created in
+# lifespan(), and whatever needs the network (pool pre-warm, recent cache
+# warm start, serial auto-connect) runs in the background after the server
+# is already answering. python -m benchmarks.bench_startup measures both.
 import asyncio
-import json
 import logging
+import time
 from contextlib import asynccontextmanager
-from datetime import datetime, timezone
-from typing import List
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.exc import SQLAlchemyError
 
-from app.api import readings, serial
-from app.db.database import check_db_connection
-from app.db.persistence import save_reading_to_db
-from app.serial.serial_reader import esp32_reader
+from app import metrics
+from app.api import readings, serial, sessions
+from app.db.database import check_db_connection_async
+from app.db.db import engines_created, get_async_engine, get_async_sessionmaker, get_engine
+from app.db.history import fetch_recent_async
+from app.db.maintenance import partition_maintainer
+from app.db.query_cache import query_cache
+from app.db.sessions import SessionStore
+from app.db.journal_replay import JournalReplayer, create_db_writer
+from app.config.settings import settings
+from app.ingest.compression import compressed
+from app.ingest.engine import IngestionEngine
+from app.ingest.recent import recent_cache
+from app.ingest.sessions import SessionSink, session_detector
+from app.ingest.sinks import DbSink, FileSink, MetricsSink, RecentSink, Sink, WebSocketSink
+from app.serial.device_manager import device_manager
+from app.serial.parser import Sample
+from app.serial.serial_reader import ESP32SerialReader
+from app.stream.binary import SENSORS as STREAM_SENSORS, SUBPROTOCOL
+from app.stream.bus import BusSubscriber
+from app.stream.manager import ConnectionManager
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-class ConnectionManager:
-    # handles websocket connections
+manager = ConnectionManager()
 
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+# "bus" runs one ingest process (app.serial_reader --bus) for any number of api workers
+INGEST_MODES = ("inline", "bus")
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info("WebSocket client connected. Total: %d", len(self.active_connections))
 
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            logger.info("WebSocket client disconnected. Total: %d", len(self.active_connections))
+def create_ingestion(db_writer, loop: asyncio.AbstractEventLoop) -> IngestionEngine:
+    # every ESP32 sample goes through here: db (write-behind), recent cache, websocket clients, metrics.
+    # db and websocket can be compressed (Settings.compression_db / compression_ws)
+    ingestion = IngestionEngine(
+        device_manager,
+        [
+            compressed(DbSink(db_writer), settings.compression_db),
+            RecentSink(recent_cache),
+            compressed(WebSocketSink(manager, loop), settings.compression_ws),
+            MetricsSink()
+        ]
+    )
+    if settings.ingest_file_path:
+        ingestion.add_sink(FileSink(settings.ingest_file_path))
+    if settings.sessions_enabled:
+        # raw samples, compression would move the session boundaries
+        ingestion.add_sink(SessionSink(session_detector, SessionStore()))
+    return ingestion
 
-    async def broadcast(self, data: dict):
-        # send data to all connected clients
-        if not self.active_connections:
-            return
 
-        message = json.dumps(data)
-        disconnected = []
+def on_bus_sample(sample: Sample, websocket: Sink):
+    # bus mode: what the recent and websocket sinks do in inline mode, on the event loop.
+    # the bus carries raw samples, compression_ws applies to this worker's clients only
+    recent_cache.add_sample(sample)
+    websocket.offer(sample)
 
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except (RuntimeError, ConnectionError) as e:
-                logger.warning("Failed to send to client: %s", e)
-                disconnected.append(connection)
 
-        for connection in disconnected:
-            self.disconnect(connection)
+def on_bus_connect():
+    # invalidations sent while this worker wasn't listening are lost
+    query_cache.clear(notify=False)
 
 
-manager = ConnectionManager()
-EVENT_LOOP = None  # yeah yeah i know globals are bad
+def on_bus_invalidate(invalidations):
+    # the ingest process (or another worker) committed rows
+    query_cache.invalidate_many(invalidations, notify=False)
+
 
+def register_gauges(ingestion: Optional[IngestionEngine], db_writer,
+                    bus: Optional[BusSubscriber] = None) -> List:
+    # evaluated on every /metrics scrape, nothing runs in between.
+    # the pools are looked up then too, so registering doesn't create the engines
+    gauges = [
+        metrics.gauge("deskbuddy_query_cache_hit_ratio", "History query cache hits / lookups",
+                      lambda: query_cache.get_stats()["hit_ratio"] or 0.0),
+        metrics.gauge("deskbuddy_query_cache_bytes", "Approximate memory held by the history query cache",
+                      lambda: query_cache.get_stats()["bytes"]),
+    ]
+    for name, get_pool in (("sync", lambda: get_engine().pool), ("async", lambda: get_async_engine().pool)):
+        labels = {"pool": name}
+        gauges += [
+            metrics.gauge("deskbuddy_db_pool_checked_out", "Connections in use",
+                          lambda get_pool=get_pool: get_pool().checkedout(), labels),
+            metrics.gauge("deskbuddy_db_pool_size", "Configured pool size",
+                          lambda get_pool=get_pool: get_pool().size(), labels),
+            metrics.gauge("deskbuddy_db_pool_overflow", "Connections opened past the pool size",
+                          lambda get_pool=get_pool: get_pool().overflow(), labels),
+        ]
+    if bus is not None:
+        gauges += [
+            metrics.gauge("deskbuddy_bus_connected", "1 while subscribed to the ingest bus",
+                          lambda: int(bus.connected)),
+            metrics.gauge("deskbuddy_bus_samples_received", "Samples received from the ingest bus",
+                          lambda: bus.received),
+        ]
+    elif isinstance(db_writer, JournalReplayer):
+        gauges.append(metrics.gauge("deskbuddy_journal_pending_samples",
+                                    "Journaled samples not yet in the db", db_writer.pending))
+    else:
+        gauges += [
+            metrics.gauge("deskbuddy_db_queue_depth", "Rows waiting in the write-behind queue",
+                          lambda: db_writer.get_stats()["queue_depth"]),
+            metrics.gauge("deskbuddy_db_rows_dropped", "Rows dropped by the write-behind queue",
+                          lambda: db_writer.get_stats()["rows_dropped"]),
+        ]
+    for sink in ingestion.sinks if ingestion is not None else ():
+        labels = {"sink": sink.name}
+        gauges += [
+            metrics.gauge("deskbuddy_sink_queue_depth", "Samples queued for a sink",
+                          lambda sink=sink: sink.get_stats()["queue_depth"], labels),
+            metrics.gauge("deskbuddy_sink_dropped", "Samples a sink dropped",
+                          lambda sink=sink: sink.dropped, labels),
+        ]
+    gauges += [
+        metrics.gauge("deskbuddy_devices_connected", "Connected ESP32 devices",
+                      lambda: len(device_manager.devices)),
+        metrics.gauge("deskbuddy_ws_clients", "Connected websocket clients",
+                      lambda: len(manager.clients)),
+        metrics.gauge("deskbuddy_ws_slow_disconnects", "Websocket clients dropped for being too slow",
+                      lambda: manager.slow_disconnects),
+    ]
+    return gauges
 
-def on_reading_callback(data: dict):
-    # gets called whenever ESP32 sends data
+
+async def warm_start_recent_cache():
+    # preload the ring buffers so dashboards get their backfill without a db query
+    minutes = settings.recent_warm_start_minutes
+    if minutes <= 0:
+        return
+    since = datetime.now(timezone.utc) - timedelta(minutes=minutes)
     try:
-        save_reading_to_db(data)
-    except (ValueError, RuntimeError) as e:
-        logger.error("Failed to save reading: %s", e)
+        async with get_async_sessionmaker()() as db:
+            rows = await asyncio.wait_for(fetch_recent_async(db, since), timeout=10.0)
+    except (SQLAlchemyError, OSError, asyncio.TimeoutError) as e:
+        logger.warning("Recent cache warm start failed: %s", e)
+        return
+    recent_cache.preload(rows)
+    logger.info("Recent cache preloaded with %d readings", len(rows))
+
 
-    # broadcast to websocket clients
-    if EVENT_LOOP:
-        try:
-            asyncio.run_coroutine_threadsafe(manager.broadcast(data), EVENT_LOOP)
-        except RuntimeError as e:
-            logger.error("Failed to broadcast: %s", e)
+def _prewarm_sync_pool(count: int):
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(get_engine().connect())
+    finally:
+        for conn in connections:
+            conn.close()  # back to the pool, still open
+
+
+async def _prewarm_async_pool(count: int):
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(await get_async_engine().connect())
+    finally:
+        for conn in connections:
+            await conn.close()
+
+
+async def prewarm_pools(count: int = settings.db_pool_prewarm):
+    # opens pooled connections for both engines so nobody waits on a connect later
+    if count <= 0:
+        return
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(asyncio.to_thread(_prewarm_sync_pool, count), _prewarm_async_pool(count)),
+            timeout=30.0
+        )
+    except (SQLAlchemyError, OSError, asyncio.TimeoutError) as e:
+        logger.warning("Connection pool pre-warm failed: %s", e)
+        return
+    logger.info("Connection pools pre-warmed with %d connections each in %.0f ms",
+                count, (time.perf_counter() - started) * 1000)
+
+
+def auto_connect_device():
+    port = ESP32SerialReader.find_esp32_port()
+    if port is None:
+        logger.info("Serial auto-connect: no ESP32 found")
+        return
+    device_manager.connect(port)
+
+
+async def background_startup(devices: bool = True):
+    # recent_cache.preload merges with live samples that arrive in the meantime
+    await asyncio.gather(prewarm_pools(), warm_start_recent_cache())
+    if devices and settings.serial_auto_connect:
+        await asyncio.to_thread(auto_connect_device)
+    if devices and settings.device_discovery:
+        device_manager.start_discovery()
 
 
 @asynccontextmanager
-async def lifespan(_app: FastAPI):
+async def lifespan(app: FastAPI):
     # startup/shutdown stuff
-    global EVENT_LOOP
     logger.info("Starting up...")
-    EVENT_LOOP = asyncio.get_running_loop()
-    esp32_reader.on_reading = on_reading_callback
+    if settings.ingest_mode not in INGEST_MODES:
+        raise ValueError(f"Unknown ingest_mode '{settings.ingest_mode}', expected one of {INGEST_MODES}")
+    ingestion = db_writer = bus = websocket = None
+    if settings.ingest_mode == "bus":
+        # python -m app.serial_reader --bus owns the ports, the db writer and maintenance
+        loop = asyncio.get_running_loop()
+        websocket = compressed(WebSocketSink(manager, loop), settings.compression_ws)
+        bus = BusSubscriber(lambda sample: on_bus_sample(sample, websocket),
+                            on_bus_invalidate, on_bus_connect)
+        bus.start()
+        # imports in this worker go to the other workers through the ingest process
+
+        def send_upstream(invalidations):
+            loop.call_soon_threadsafe(bus.send_invalidations, invalidations)
+        query_cache.add_listener(send_upstream)
+    else:
+        db_writer = create_db_writer()
+        ingestion = create_ingestion(db_writer, asyncio.get_running_loop())
+        ingestion.start()
+        partition_maintainer.start()
+    app.state.ingestion, app.state.db_writer, app.state.bus = ingestion, db_writer, bus
+    app.state.bus_websocket = websocket
+    gauges = register_gauges(ingestion, db_writer, bus)
+    startup = asyncio.create_task(background_startup(devices=ingestion is not None))
     yield
     logger.info("Shutting down...")
-    esp32_reader.disconnect()
+    await startup
+    if bus is not None:
+        query_cache.remove_listener(send_upstream)
+        await bus.stop()
+        websocket.stop()  # the compressor's pending points
+    else:
+        partition_maintainer.stop()
+        # disconnects the readers, then flushes whatever is still queued
+        await asyncio.to_thread(ingestion.stop)
+    for gauge in gauges:
+        metrics.registry.unregister(gauge)
+    if engines_created():
+        await get_async_engine().dispose()
 
 
-app = FastAPI(title="DeskBuddy API", lifespan=lifespan)
+def get_ingestion(request: Request) -> Optional[IngestionEngine]:
+    # None in bus mode, the ingest process has it
+    return request.app.state.ingestion
 
-app.include_router(readings.router)
-app.include_router(serial.router)
 
-# CORS for frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def get_db_writer(request: Request):
+    return request.app.state.db_writer
 
 
-@app.get("/health")
-async def health():
+def get_bus(request: Request) -> Optional[BusSubscriber]:
+    return request.app.state.bus
+
+
+router = APIRouter()
+
+
+@router.get("/health")
+async def health(db_writer=Depends(get_db_writer), bus: Optional[BusSubscriber] = Depends(get_bus)):
     # check if everything is working
-    db_ok = check_db_connection()
-    return {
+    db_ok = await check_db_connection_async()
+    status = {
         "status": "ok",
         "time_utc": datetime.now(timezone.utc).isoformat(),
-        "db_ok": db_ok
+        "db_ok": db_ok,
+        "writer": db_writer.get_stats() if db_writer is not None else None
     }
+    if bus is not None:
+        status["bus"] = bus.get_stats()
+    return status
+
+
+@router.get("/ingest/stats")
+async def ingest_stats(
+    request: Request,
+    ingestion: Optional[IngestionEngine] = Depends(get_ingestion),
+    bus: Optional[BusSubscriber] = Depends(get_bus)
+):
+    # samples published and per-sink counters, in bus mode what this worker received and pushed
+    if ingestion is None:
+        return {"mode": "bus", "bus": bus.get_stats(),
+                "websocket": request.app.state.bus_websocket.get_stats()}
+    return ingestion.get_stats()
+
+
+@router.get("/stream/stats")
+async def stream_stats():
+    # per-client queue depth and lag
+    return manager.get_stats()
 
 
-@app.get("/")
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    # prometheus text exposition format
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/")
 async def root():
     return {"message": "DeskBuddy API is running"}
 
 
-@app.websocket("/stream")
-async def websocket_endpoint(websocket: WebSocket):
-    # websocket for streaming sensor data
-    await manager.connect(websocket)
+@router.websocket("/stream")
+async def websocket_endpoint(
+    websocket: WebSocket,
+    device: Optional[str] = None,
+    sensors: Optional[str] = None
+):
+    # websocket for streaming sensor data. ?device=a,b only sends those desks,
+    # ?sensors=temp_c,distance_cm only those values. offering the deskbuddy.v1
+    # subprotocol switches to batched binary frames (app.stream.binary)
+    wanted = tuple(name for name in sensors.split(",") if name) if sensors else None
+    if wanted is not None and any(name not in STREAM_SENSORS for name in wanted):
+        await websocket.close(code=1008, reason=f"sensors must be among: {', '.join(STREAM_SENSORS)}")
+        return
+    devices = frozenset(name for name in device.split(",") if name) if device else None
+    binary = settings.ws_binary_enabled and SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await manager.connect(websocket, devices, wanted, binary)
     try:
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
         manager.disconnect(websocket)
+
+
+def create_app() -> FastAPI:
+    logging.basicConfig(level=logging.INFO)
+    app = FastAPI(title="DeskBuddy API", lifespan=lifespan)
+
+    app.include_router(router)
+    app.include_router(readings.router)
+    if settings.ingest_mode != "bus":
+        # in bus mode the ports belong to the ingest process, not to this worker
+        app.include_router(serial.router)
+    app.include_router(sessions.router)
+
+    # CORS for frontend
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return app
+
+
+app = create_app()
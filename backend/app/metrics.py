@@ -0,0 +1,197 @@
+"""Prometheus-style metrics for the ingest hot path.
+
+Counters and histograms are plain objects created once at import time, and
+updating one is an attribute add (histograms add a bisect over fixed bucket
+bounds). Nothing is allocated per call. Gauges are callbacks that are only
+evaluated when /metrics is scraped, so things like queue depths cost
+nothing in between.
+
+Updates are not locked. Almost every series is only written from one thread
+(a device's reader, the db writer, the event loop), and an increment lost to
+a thread switch is an acceptable error for monitoring.
+
+With Settings.metrics_enabled off every factory returns a shared no-op
+object, ENABLED is False so call sites can skip their perf_counter() calls,
+and /metrics answers 404.
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.config.settings import settings
+
+ENABLED = settings.metrics_enabled
+
+# seconds, from sub-millisecond parsing up to multi-second db stalls
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _format_labels(labels: Optional[Dict[str, str]], extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in (labels or {}).items()]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    __slots__ = ("name", "labels", "value")
+    kind = "counter"
+
+    def __init__(self, name: str, labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels)} {_format_value(self.value)}"]
+
+
+class Histogram:
+    __slots__ = ("name", "labels", "bounds", "counts", "sum", "count")
+    kind = "histogram"
+
+    def __init__(self, name: str, bounds: Sequence[float] = LATENCY_BUCKETS,
+                 labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.labels = labels
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            labels = _format_labels(self.labels, 'le="%s"' % le)
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels)} {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels)} {self.count}")
+        return lines
+
+
+class Gauge:
+    __slots__ = ("name", "labels", "fn")
+    kind = "gauge"
+
+    def __init__(self, name: str, fn: Callable[[], float], labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.labels = labels
+        self.fn = fn
+
+    def samples(self) -> List[str]:
+        try:
+            value = self.fn()
+        except (AttributeError, RuntimeError, TypeError, ValueError):
+            return []
+        if value is None:
+            return []
+        return [f"{self.name}{_format_labels(self.labels)} {_format_value(value)}"]
+
+
+class NoopMetric:
+    # stands in for every metric when metrics are disabled
+    __slots__ = ()
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+
+NOOP = NoopMetric()
+
+
+class Registry:
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, str, list]] = {}  # name -> (kind, help, series)
+
+    def register(self, metric, help_text: str):
+        kind, _, series = self._families.setdefault(metric.name, (metric.kind, help_text, []))
+        if kind != metric.kind:
+            raise ValueError(f"Metric {metric.name} registered as {kind} and {metric.kind}")
+        series.append(metric)
+        return metric
+
+    def unregister(self, metric):
+        family = self._families.get(getattr(metric, "name", None))
+        if family is not None and metric in family[2]:
+            family[2].remove(metric)
+            if not family[2]:
+                del self._families[metric.name]
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text, series) in self._families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in series:
+                lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, help_text: str, labels: Optional[Dict[str, str]] = None):
+    if not ENABLED:
+        return NOOP
+    return registry.register(Counter(name, labels), help_text)
+
+
+def histogram(name: str, help_text: str, bounds: Sequence[float] = LATENCY_BUCKETS,
+              labels: Optional[Dict[str, str]] = None):
+    if not ENABLED:
+        return NOOP
+    return registry.register(Histogram(name, bounds, labels), help_text)
+
+
+def gauge(name: str, help_text: str, fn: Callable[[], float],
+          labels: Optional[Dict[str, str]] = None):
+    if ENABLED:
+        return registry.register(Gauge(name, fn, labels), help_text)
+    return NOOP
+
+
+# hot-path metrics, shared by every reader / writer
+SERIAL_BYTES = counter("deskbuddy_serial_bytes_total", "Bytes read from serial ports")
+SERIAL_LINES = counter("deskbuddy_serial_lines_total", "Lines read from serial ports")
+SERIAL_SAMPLES = counter("deskbuddy_serial_samples_total", "Lines parsed into samples")
+SERIAL_RECONNECTS = counter("deskbuddy_serial_reconnects_total", "Serial reconnects after a lost port")
+PARSE_ERRORS = {
+    kind: counter("deskbuddy_parse_errors_total", "Lines that were not samples, by reason",
+                  {"kind": kind})
+    for kind in ("decode", "json", "schema")
+}
+PARSE_SECONDS = histogram("deskbuddy_parse_seconds", "Time to parse one line")
+PUBLISH_SECONDS = histogram("deskbuddy_ingest_publish_seconds",
+                            "Time to hand one sample to every sink")
+DB_FLUSH_SECONDS = histogram("deskbuddy_db_flush_seconds", "Time to write one batch (commit included)")
+DB_COMMIT_LAG_SECONDS = histogram("deskbuddy_db_commit_lag_seconds",
+                                  "Serial receive to db commit, oldest sample of each batch")
+DB_POOL_WAIT_SECONDS = histogram("deskbuddy_db_pool_wait_seconds",
+                                 "Time the db writer waited for a pooled connection")
+DB_ROWS = counter("deskbuddy_db_rows_written_total", "Rows written to the raw tables")
+DB_FAILURES = counter("deskbuddy_db_write_failures_total", "Failed batch writes")
+WS_SEND_LAG_SECONDS = histogram("deskbuddy_ws_send_lag_seconds",
+                                "Time from queueing to sending, per websocket message")
+WS_MESSAGES = counter("deskbuddy_ws_messages_sent_total", "Websocket messages sent")
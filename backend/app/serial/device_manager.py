@@ -0,0 +1,184 @@
+# keeps track of every connected ESP32 (one reader per port)
+import logging
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional
+
+from app.config.settings import settings
+from app.serial.parser import Sample
+from app.serial.serial_reader import ESP32SerialReader
+
+logger = logging.getLogger(__name__)
+
+DEVICE_ID_PATTERN = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def device_id_for_port(port_info) -> str:
+    # usb serial number when the adapter has one, otherwise the port name
+    serial_number = getattr(port_info, "serial_number", None)
+    name = serial_number or os.path.basename(port_info.device)
+    return DEVICE_ID_PATTERN.sub("-", name).strip("-") or "device"
+
+
+class DeviceManager:
+    # registry of readers keyed by device id, with optional hot-plug discovery
+
+    def __init__(
+        self,
+        on_reading: Optional[Callable[[Sample], None]] = None,
+        discovery_interval_s: float = settings.device_discovery_interval_s
+    ):
+        self.on_reading = on_reading
+        self.discovery_interval_s = discovery_interval_s
+        self.devices: Dict[str, ESP32SerialReader] = {}
+        self.discovered: set = set()  # ids that discovery may also remove
+        self._ports: Dict[str, str] = {}  # port -> device id, set before the reader connects
+        self._lock = threading.RLock()
+        self._stop_discovery = threading.Event()
+        self._discovery_thread: Optional[threading.Thread] = None
+
+    def _dispatch(self, sample: Sample):
+        # shared by all readers so on_reading can be swapped at any time
+        if self.on_reading:
+            self.on_reading(sample)
+
+    def get(self, device_id: str) -> Optional[ESP32SerialReader]:
+        return self.devices.get(device_id)
+
+    def find_by_port(self, port: str) -> Optional[str]:
+        # also finds a port whose connect is still in progress
+        with self._lock:
+            return self._ports.get(port)
+
+    def primary(self) -> Optional[ESP32SerialReader]:
+        # first connected device, used by the single-device endpoints
+        with self._lock:
+            for reader in self.devices.values():
+                if reader.is_connected:
+                    return reader
+            return next(iter(self.devices.values()), None)
+
+    def connect(
+        self,
+        port: str,
+        baudrate: int = 115200,
+        device_id: Optional[str] = None,
+        auto_reconnect: bool = True
+    ) -> Optional[str]:
+        """Open a reader on port and register it. Returns the device id, None on failure."""
+        existing = self.find_by_port(port)
+        if existing:
+            return existing
+
+        if device_id is None:
+            device_id = os.path.basename(port)
+            for info in ESP32SerialReader.find_esp32_ports():
+                if info.device == port:
+                    device_id = device_id_for_port(info)
+                    break
+        device_id = DEVICE_ID_PATTERN.sub("-", device_id).strip("-") or "device"
+
+        with self._lock:
+            # checked again, another call may have taken the port meanwhile
+            existing = self._ports.get(port)
+            if existing:
+                return existing
+            if device_id in self.devices:
+                # same serial number on two adapters, keep both apart
+                device_id = f"{device_id}-{os.path.basename(port)}"
+            reader = ESP32SerialReader(on_reading=self._dispatch, device_id=device_id)
+            # reserve the id and the port before the (slow) connect so a second call can't race us
+            self.devices[device_id] = reader
+            self._ports[port] = device_id
+
+        if not reader.connect(port, baudrate, auto_reconnect=auto_reconnect):
+            with self._lock:
+                self.devices.pop(device_id, None)
+                self._ports.pop(port, None)
+            return None
+
+        logger.info("Device %s connected on %s", device_id, port)
+        return device_id
+
+    def disconnect(self, device_id: str) -> bool:
+        with self._lock:
+            reader = self.devices.pop(device_id, None)
+            self.discovered.discard(device_id)
+            for port in [port for port, owner in self._ports.items() if owner == device_id]:
+                del self._ports[port]
+        if reader is None:
+            return False
+        reader.disconnect()
+        logger.info("Device %s disconnected", device_id)
+        return True
+
+    def disconnect_all(self):
+        for device_id in list(self.devices):
+            self.disconnect(device_id)
+
+    def list_devices(self) -> List[Dict]:
+        with self._lock:
+            readers = list(self.devices.values())
+        return [
+            {**reader.get_status(), "auto_discovered": reader.device_id in self.discovered}
+            for reader in readers
+        ]
+
+    def discover(self, baudrate: int = 115200) -> Dict[str, List[str]]:
+        """Connect newly plugged ESP32 ports and drop discovered ones that went away."""
+        present = {info.device: info for info in ESP32SerialReader.find_esp32_ports()}
+
+        added = []
+        for port, info in present.items():
+            if self.find_by_port(port):
+                continue
+            device_id = self.connect(port, baudrate, device_id=device_id_for_port(info))
+            if device_id:
+                with self._lock:
+                    self.discovered.add(device_id)
+                added.append(device_id)
+
+        removed = []
+        with self._lock:
+            gone = [
+                device_id for port, device_id in self._ports.items()
+                if device_id in self.discovered and port not in present
+            ]
+        for device_id in gone:
+            self.disconnect(device_id)
+            removed.append(device_id)
+
+        return {"added": added, "removed": removed}
+
+    def start_discovery(self):
+        if self._discovery_thread and self._discovery_thread.is_alive():
+            return
+        self._stop_discovery.clear()
+        self._discovery_thread = threading.Thread(
+            target=self._discovery_loop, name="device-discovery", daemon=True
+        )
+        self._discovery_thread.start()
+
+    def stop_discovery(self):
+        self._stop_discovery.set()
+        if self._discovery_thread:
+            self._discovery_thread.join(timeout=5.0)
+        self._discovery_thread = None
+
+    @property
+    def discovery_running(self) -> bool:
+        return self._discovery_thread is not None and self._discovery_thread.is_alive()
+
+    def _discovery_loop(self):
+        while not self._stop_discovery.is_set():
+            try:
+                changes = self.discover()
+                if changes["added"] or changes["removed"]:
+                    logger.info("Device discovery: %s", changes)
+            except (OSError, RuntimeError) as e:
+                logger.error("Device discovery failed: %s", e)
+            self._stop_discovery.wait(self.discovery_interval_s)
+
+
+device_manager = DeviceManager()
@@ -0,0 +1,183 @@
+# turns raw serial lines from the ESP32 into Sample records
+#
+# Works on bytes/memoryview straight from the read buffer: the Arduino
+# Serial Monitor prefix ("17:09:47.625 -> ") and any other junk before the
+# json object is skipped by scanning for the first '{', and a view of the
+# payload is handed to orjson when it's installed. stdlib json only takes
+# bytes, so that fallback copies the payload once.
+#
+# Values have to be finite numbers and ts_ms has to fit millis() (32 bit,
+# signed or unsigned), anything else is a schema error.
+import json
+import math
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+ParseInput = Union[bytes, bytearray, memoryview]
+
+# millis() is an unsigned long, some sketches print it signed
+TS_MS_MIN = -2 ** 31
+TS_MS_MAX = 2 ** 32 - 1
+
+# memoryview has no find(), re searches any buffer in place
+_OBJECT_START = re.compile(rb"{")
+_BLANK = re.compile(rb"\s*")
+
+
+class LineParseError(ValueError):
+    # kind is "decode" (not utf-8), "json" (not json) or "schema" (json but not a sample)
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+
+
+@dataclass(slots=True)
+class Sample:
+    device_ts_ms: Optional[int] = None
+    temp_c: Optional[float] = None
+    hum_pct: Optional[float] = None
+    distance_cm: Optional[float] = None
+    device: Optional[str] = None
+    ts: Optional[datetime] = None  # server receive time (UTC)
+
+    @classmethod
+    def from_dict(cls, data: Dict, ts: Optional[datetime] = None) -> "Sample":
+        # accepts the ESP32 json shape ("ts_ms") as well as to_dict() output
+        return cls(
+            device_ts_ms=_to_ts_ms(data.get("ts_ms", data.get("device_ts_ms"))),
+            temp_c=_to_float(data.get("temp_c")),
+            hum_pct=_to_float(data.get("hum_pct")),
+            distance_cm=_to_float(data.get("distance_cm")),
+            device=data.get("device"),
+            ts=ts
+        )
+
+    def has_values(self) -> bool:
+        return self.temp_c is not None or self.hum_pct is not None or self.distance_cm is not None
+
+    def to_dict(self) -> Dict:
+        data = {
+            "ts_ms": self.device_ts_ms,
+            "temp_c": self.temp_c,
+            "hum_pct": self.hum_pct,
+            "distance_cm": self.distance_cm,
+            "ts_utc": self.ts.isoformat() if self.ts else None
+        }
+        if self.device is not None:
+            data["device"] = self.device
+        return data
+
+
+def _to_float(value) -> Optional[float]:
+    if value is None:
+        return None
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"not a finite number: {value}")
+    return value
+
+
+def _to_ts_ms(value) -> Optional[int]:
+    if value is None:
+        return None
+    ts_ms = int(value)
+    if not TS_MS_MIN <= ts_ms <= TS_MS_MAX:
+        raise ValueError(f"ts_ms out of range: {ts_ms}")
+    return ts_ms
+
+
+def _loads_stdlib(payload: ParseInput):
+    if isinstance(payload, memoryview):
+        payload = payload.tobytes()
+    return json.loads(payload)
+
+
+if orjson is not None:
+    JSON_BACKEND = "orjson"
+    _loads = orjson.loads
+else:
+    JSON_BACKEND = "json"
+    _loads = _loads_stdlib
+
+
+def set_json_backend(name: str):
+    # mostly for benchmarks, "orjson" or "json"
+    global JSON_BACKEND, _loads
+    if name == "orjson":
+        if orjson is None:
+            raise RuntimeError("orjson is not installed")
+        _loads = orjson.loads
+    elif name == "json":
+        _loads = _loads_stdlib
+    else:
+        raise ValueError(f"Unknown json backend: {name}")
+    JSON_BACKEND = name
+
+
+def parse_line(
+    line: ParseInput,
+    device: Optional[str] = None,
+    ts: Optional[datetime] = None
+) -> Optional[Sample]:
+    """Parse one serial line into a Sample.
+
+    Returns None for blank lines, raises LineParseError for anything that
+    isn't a sensor sample.
+    """
+    is_view = isinstance(line, memoryview)
+    if is_view:
+        found = _OBJECT_START.search(line)
+        start = found.start() if found else -1
+    else:
+        start = line.find(b"{")
+    if start < 0:
+        if _BLANK.fullmatch(line) if is_view else not line.strip():
+            return None
+        raise LineParseError("json", "no json object in line")
+
+    # skip the prefix without copying the rest of the line
+    payload = memoryview(line)[start:] if start else line
+    try:
+        data = _loads(payload)
+    except UnicodeDecodeError as e:
+        raise LineParseError("decode", str(e)) from e
+    except ValueError as e:
+        # orjson reports invalid utf-8 as a json error too
+        kind = "decode" if "utf-8" in str(e).lower() else "json"
+        raise LineParseError(kind, str(e)) from e
+
+    if not isinstance(data, dict):
+        raise LineParseError("schema", "json payload is not an object")
+
+    try:
+        sample = Sample(
+            device_ts_ms=_to_ts_ms(data.get("ts_ms")),
+            temp_c=_to_float(data.get("temp_c")),
+            hum_pct=_to_float(data.get("hum_pct")),
+            distance_cm=_to_float(data.get("distance_cm")),
+            device=device,
+            ts=ts or datetime.now(timezone.utc)
+        )
+    except (TypeError, ValueError, OverflowError) as e:
+        # OverflowError: int() of an Infinity the stdlib json accepts
+        raise LineParseError("schema", f"bad sensor value: {e}") from e
+
+    if not sample.has_values():
+        raise LineParseError("schema", "no sensor values in payload")
+    return sample
+
+
+def raw_line_info(line: ParseInput) -> Dict:
+    # what the reader shows as latest_data for a line that isn't a sample
+    raw = bytes(line)
+    try:
+        return {"raw": raw.decode("utf-8").strip()}
+    except UnicodeDecodeError:
+        return {"raw_bytes": raw.hex()}
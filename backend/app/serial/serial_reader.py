@@ -1,25 +1,87 @@
 # reads data from ESP32 over serial
-import json
-import re
+import logging
+import os
+import selectors
 import threading
 import time
-from typing import Callable, Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Union
 
 import serial
 import serial.tools.list_ports
 
+from app import metrics
+from app.config.settings import settings
+from app.serial.parser import LineParseError, Sample, parse_line, raw_line_info
+
+logger = logging.getLogger(__name__)
+
+READ_MODES = ("event", "poll")
+READ_CHUNK_SIZE = 65536
+MAX_PENDING_LINE = 4096
+RECONNECT_DELAY_S = 2.0  # between attempts to reopen a port that went away
+
+
+class LineSplitter:
+    # collects raw chunks and hands back complete lines (without the newline)
+
+    def __init__(self, max_line: int = MAX_PENDING_LINE):
+        self.max_line = max_line
+        self._pending = bytearray()
+
+    def feed(self, chunk) -> List[bytes]:
+        pending = self._pending
+        pending += chunk
+        lines = []
+        start = 0
+        while True:
+            end = pending.find(b"\n", start)
+            if end < 0:
+                break
+            lines.append(bytes(pending[start:end]))
+            start = end + 1
+        if start:
+            del pending[:start]
+        if len(pending) > self.max_line:
+            # binary noise with no newline in sight, don't let it grow forever
+            pending.clear()
+        return lines
+
+    def clear(self):
+        self._pending.clear()
+
 
 class ESP32SerialReader:
     # handles serial stuff for ESP32
-    def __init__(self, on_reading: Optional[Callable[[Dict], None]] = None):
+    def __init__(
+        self,
+        on_reading: Optional[Callable[[Sample], None]] = None,
+        read_mode: str = settings.serial_read_mode,
+        device_id: Optional[str] = None
+    ):
+        if read_mode not in READ_MODES:
+            raise ValueError(f"Unknown read mode: {read_mode}")
         self.serial_connection: Optional[serial.Serial] = None
         self.port: Optional[str] = None
         self.is_connected: bool = False
-        self.latest_data: Optional[Dict] = None
+        # last Sample, or a {"raw": ...} dict for lines that weren't samples
+        self.latest_data: Optional[Union[Sample, Dict]] = None
         self.read_thread: Optional[threading.Thread] = None
         self.stop_reading: bool = False
         self.on_reading = on_reading
         self.auto_reconnect = False
+        self.baudrate = 115200  # what connect() opened the port with, reconnects reuse it
+        # tagged onto every reading as "device" when set
+        self.device_id = device_id
+        # "event" blocks on the port and reads whole chunks,
+        # "poll" is the old in_waiting + readline + 10ms sleep loop
+        self.read_mode = read_mode
+        self._splitter = LineSplitter()
+        self._read_buffer = bytearray(READ_CHUNK_SIZE)
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._selector_fd: Optional[int] = None
+        self.samples_read = 0
+        self.parse_errors = 0
+        self.line_errors = 0  # lines that raised anything else, while parsing or downstream
 
     @staticmethod
     def list_available_ports() -> List[Dict[str, str]]:
@@ -29,12 +91,13 @@ class ESP32SerialReader:
         ]
 
     @staticmethod
-    def find_esp32_port() -> Optional[str]:
-        # tries to find ESP32 automatically
+    def find_esp32_ports() -> List:
+        # every port that looks like an ESP32 usb-serial chip
         esp32_identifiers = [
-            'CP210', 'CH340', 'CH341', 'UART', 'USB-SERIAL', 'USB2.0-Serial'
+            'CP210', 'CH340', 'CH341', 'UART', 'USB-SERIAL', 'USB2.0-SERIAL'
         ]
 
+        matches = []
         for port in serial.tools.list_ports.comports():
             description = port.description.upper()
             hwid = port.hwid.upper()
@@ -43,8 +106,14 @@ class ESP32SerialReader:
                 identifier in description or identifier in hwid
                 for identifier in esp32_identifiers
             ):
-                return port.device
-        return None
+                matches.append(port)
+        return matches
+
+    @staticmethod
+    def find_esp32_port() -> Optional[str]:
+        # tries to find ESP32 automatically
+        ports = ESP32SerialReader.find_esp32_ports()
+        return ports[0].device if ports else None
 
     def auto_connect(self, baudrate: int = 115200) -> bool:
         # auto find and connect
@@ -73,6 +142,7 @@ class ESP32SerialReader:
             self.serial_connection.reset_output_buffer()
 
             self.port = port
+            self.baudrate = baudrate
             self.is_connected = True
             self.auto_reconnect = auto_reconnect
             self.stop_reading = False
@@ -81,7 +151,7 @@ class ESP32SerialReader:
             return True
 
         except (serial.SerialException, OSError) as e:
-            print(f"Connection error: {e}")
+            logger.error("Connection error on %s: %s", port, e)
             self.is_connected = False
             return False
 
@@ -96,7 +166,7 @@ class ESP32SerialReader:
             try:
                 self.serial_connection.close()
             except (serial.SerialException, OSError) as e:
-                print(f"Close error: {e}")
+                logger.warning("Close error on %s: %s", self.port, e)
 
         self.serial_connection = None
         self.port = None
@@ -107,64 +177,156 @@ class ESP32SerialReader:
         while not self.stop_reading:
             if not self.serial_connection or not self.serial_connection.is_open:
                 if self.auto_reconnect and self.port:
-                    print(f"Attempting to reconnect to {self.port}...")
-                    time.sleep(2.0)
+                    logger.info("Attempting to reconnect to %s...", self.port)
+                    if self._sleep(RECONNECT_DELAY_S):
+                        break
                     try:
                         self.serial_connection = serial.Serial(
-                            port=self.port, baudrate=115200, timeout=2.0,
+                            port=self.port, baudrate=self.baudrate, timeout=2.0,
                             xonxoff=False, rtscts=False, dsrdtr=False
                         )
                         self.is_connected = True
-                        print(f"Reconnected to {self.port}")
+                        metrics.SERIAL_RECONNECTS.inc()
+                        logger.info("Reconnected to %s", self.port)
                     except (serial.SerialException, OSError):
                         continue
                 else:
                     break
 
             try:
-                if self.serial_connection.in_waiting > 0:
-                    line = self.serial_connection.readline()
-                    try:
-                        data_str = line.decode('utf-8').strip()
-                        # Strip Arduino Serial Monitor timestamp
-                        # (e.g., "17:09:47.625 -> ")
-                        data_str = re.sub(
-                            r'^\d{2}:\d{2}:\d{2}\.\d{3}\s*->\s*',
-                            '',
-                            data_str
-                        )
-
-                        if not data_str:
-                            continue
-
-                        try:
-                            data = json.loads(data_str)
-                            self.latest_data = data
-                            if self.on_reading:
-                                self.on_reading(data)
-                        except json.JSONDecodeError:
-                            self.latest_data = {"raw": data_str}
-                    except UnicodeDecodeError:
-                        self.latest_data = {"raw_bytes": line.hex()}
-                time.sleep(0.01)
-            except serial.SerialException:
-                print("Serial connection lost")
-                self.is_connected = False
+                if self.read_mode == "event":
+                    self._read_event()
+                else:
+                    self._read_poll()
+            except serial.SerialException as e:
+                logger.warning("Serial connection to %s lost: %s", self.port, e)
+                # drop the dead port, the branch above reopens it (after a delay)
+                self._close_port()
                 if not self.auto_reconnect:
                     break
-            except (UnicodeDecodeError, json.JSONDecodeError, OSError) as e:
-                print(f"Read error: {e}")
+            except OSError as e:
+                logger.warning("Read error on %s: %s", self.port, e)
                 time.sleep(0.1)
 
+        self._close_selector()
+
+    def _sleep(self, seconds: float) -> bool:
+        # short steps so disconnect() doesn't wait out the whole delay, True once stopped
+        deadline = time.monotonic() + seconds
+        while not self.stop_reading and time.monotonic() < deadline:
+            time.sleep(0.1)
+        return self.stop_reading
+
+    def _close_port(self):
+        self.is_connected = False
+        self._close_selector()
+        conn, self.serial_connection = self.serial_connection, None
+        if conn is not None:
+            try:
+                conn.close()
+            except (serial.SerialException, OSError) as e:
+                logger.debug("Close error on %s: %s", self.port, e)
+
+    def _read_poll(self):
+        try:
+            waiting = self.serial_connection.in_waiting
+        except OSError as e:
+            # the ioctl fails once the device is gone, same as a failing read
+            raise serial.SerialException(f"in_waiting failed: {e}") from e
+        if waiting > 0:
+            line = self.serial_connection.readline()
+            metrics.SERIAL_BYTES.inc(len(line))
+            self._handle_line(line)
+        time.sleep(0.01)
+
+    def _read_event(self):
+        # wait until the port is readable, then take everything that's there
+        fd = self._port_fd()
+        if fd is None:
+            # no file descriptor to wait on (windows), let pyserial block
+            # for the first byte instead
+            conn = self.serial_connection
+            chunk = conn.read(max(1, conn.in_waiting))
+            lines = self._splitter.feed(chunk) if chunk else []
+        else:
+            if not self._selector.select(timeout=0.5):
+                return  # wake up now and then to check stop_reading
+            view = memoryview(self._read_buffer)
+            try:
+                count = os.readv(fd, [view])
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # same as pyserial: a failing read means the device went away
+                raise serial.SerialException(f"read failed: {e}") from e
+            if count == 0:
+                raise serial.SerialException("Device reports readiness to read but returned no data")
+            metrics.SERIAL_BYTES.inc(count)
+            lines = self._splitter.feed(view[:count])
+
+        for line in lines:
+            self._handle_line(line)
+
+    def _port_fd(self) -> Optional[int]:
+        try:
+            fd = self.serial_connection.fileno()
+        except (AttributeError, OSError, serial.SerialException):
+            return None
+        if fd != self._selector_fd:
+            self._close_selector()
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(fd, selectors.EVENT_READ)
+            self._selector_fd = fd
+            self._splitter.clear()
+        return fd
+
+    def _close_selector(self):
+        if self._selector:
+            self._selector.close()
+        self._selector = None
+        self._selector_fd = None
+
+    def _handle_line(self, line: bytes):
+        # one bad line (or a bug behind on_reading) must not end the read thread
+        try:
+            self._process_line(line)
+        except Exception:
+            self.line_errors += 1
+            logger.exception("Device %s: failed to handle line %r", self.device_id, bytes(line[:200]))
+
+    def _process_line(self, line: bytes):
+        metrics.SERIAL_LINES.inc()
+        started = time.perf_counter() if metrics.ENABLED else 0.0
+        try:
+            sample = parse_line(line, self.device_id)
+        except LineParseError as e:
+            self.parse_errors += 1
+            metrics.PARSE_ERRORS[e.kind].inc()
+            self.latest_data = raw_line_info(line)
+            return
+        if sample is None:
+            return
+        if metrics.ENABLED:
+            metrics.PARSE_SECONDS.observe(time.perf_counter() - started)
+
+        self.samples_read += 1
+        metrics.SERIAL_SAMPLES.inc()
+        self.latest_data = sample
+        if self.on_reading:
+            self.on_reading(sample)
+
     def get_latest_data(self) -> Optional[Dict]:
-        return self.latest_data
+        latest = self.latest_data
+        return latest.to_dict() if isinstance(latest, Sample) else latest
 
     def get_status(self) -> Dict:
         return {
+            "device_id": self.device_id,
             "connected": self.is_connected,
             "port": self.port,
-            "has_data": self.latest_data is not None
+            "has_data": self.latest_data is not None,
+            "samples_read": self.samples_read,
+            "parse_errors": self.parse_errors,
+            "line_errors": self.line_errors
         }
 
-
-esp32_reader = ESP32SerialReader()
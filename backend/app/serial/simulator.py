@@ -0,0 +1,182 @@
+"""Simulated ESP32 on a pseudo-terminal.
+
+Opens a pty pair and writes ESP32-style JSON lines into the master side at
+a fixed rate (10 Hz up to 10 kHz and beyond). The slave side is a normal
+serial port path, so ESP32SerialReader, the device manager and the
+/serial/connect endpoint all work with it unchanged.
+
+Lines are either generated or replayed from a file of recorded lines,
+e.g. a Serial Monitor log or an NDJSON file from FileSink. Generated lines
+carry smooth fake sensor values and a ts_ms like the firmware's millis():
+the device time the line is due at, a uint32 that wraps after ~49.7 days,
+optionally running drift_ppm fast (or slow) and starting at start_ms, so
+clock alignment can be tried against a crystal that is off or a wrap a
+few seconds in. Lines are sent in small bursts so high rates don't depend
+on sleep() precision.
+
+POSIX only. Run it on its own and connect the backend to the printed port:
+
+    python -m app.serial.simulator --rate 100
+    python -m app.serial.simulator --rate 10 --drift-ppm 150 --start-ms 4294960000
+    python -m app.serial.simulator --replay capture.log --rate 10
+"""
+import argparse
+import math
+import os
+import random
+import threading
+import time
+import tty
+from typing import Dict, List, Optional
+
+from app.ingest.clock import MILLIS_WRAP
+
+TICK_S = 0.005  # how often a burst of lines is written
+LINE_FORMAT = '{"ts_ms":%d,"distance_cm":%.1f,"temp_c":%.1f,"hum_pct":%.0f}\n'
+
+
+def device_millis(elapsed_s: float, start_ms: int = 0, drift_ppm: float = 0.0) -> int:
+    """millis() on a device started start_ms before, elapsed_s of real time later"""
+    return int(start_ms + elapsed_s * 1000.0 * (1.0 + drift_ppm / 1e6)) % MILLIS_WRAP
+
+
+def generated_line(seq: int, rate: float = 1000.0, start_ms: int = 0, drift_ppm: float = 0.0) -> bytes:
+    # line seq of a device sending `rate` lines/s, values drift slowly like a real desk
+    t = seq / rate
+    return (LINE_FORMAT % (
+        device_millis(t, start_ms, drift_ppm),
+        80.0 + 30.0 * math.sin(t / 7.0) + random.uniform(-0.5, 0.5),
+        21.0 + 1.5 * math.sin(t / 60.0),
+        45.0 + 5.0 * math.sin(t / 90.0),
+    )).encode("ascii")
+
+
+def load_replay(path: str) -> List[bytes]:
+    with open(path, "rb") as f:
+        lines = [line.rstrip(b"\r\n") + b"\n" for line in f if line.strip()]
+    if not lines:
+        raise ValueError(f"Nothing to replay in {path}")
+    return lines
+
+
+class SimulatedESP32:
+    """Writes lines into a pty at `rate` lines per second from a background thread"""
+
+    def __init__(self, rate: float = 10.0, replay: Optional[List[bytes]] = None,
+                 record_send_times: bool = False, start_ms: int = 0, drift_ppm: float = 0.0):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.replay = replay
+        self.record_send_times = record_send_times
+        self.start_ms = start_ms
+        self.drift_ppm = drift_ppm
+        # ts_ms -> perf_counter_ns of the first line with it, generated lines only.
+        # above 1 kHz several lines share a millisecond, like on the device
+        self.send_times: Dict[int, int] = {}
+        self.lines_written = 0
+        self.bytes_written = 0
+        self.behind = 0  # lines the writer couldn't get out in time
+        self.port: Optional[str] = None
+        self._master: Optional[int] = None
+        self._slave: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def open(self) -> str:
+        """Create the pty, returns the port path to connect the reader to"""
+        self._master, self._slave = os.openpty()
+        # raw mode right away, otherwise the tty echoes lines back into the
+        # master until a reader opens the port
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        return self.port
+
+    def start(self):
+        if self.port is None:
+            self.open()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="esp32-simulator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+        self._thread = None
+
+    def close(self):
+        self.stop()
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+        self.port = None
+
+    def _line(self, seq: int) -> bytes:
+        if self.replay:
+            return self.replay[seq % len(self.replay)]
+        return generated_line(seq, self.rate, self.start_ms, self.drift_ppm)
+
+    def _run(self):
+        started = time.perf_counter()
+        seq = 0
+        while not self._stop.is_set():
+            due = int((time.perf_counter() - started) * self.rate)
+            if due > seq:
+                burst = []
+                for i in range(seq, due):
+                    burst.append(self._line(i))
+                sent_ns = time.perf_counter_ns()
+                if self.record_send_times and not self.replay:
+                    for i in range(seq, due):
+                        ts_ms = device_millis(i / self.rate, self.start_ms, self.drift_ppm)
+                        self.send_times.setdefault(ts_ms, sent_ns)
+                payload = b"".join(burst)
+                view = memoryview(payload)
+                while view:
+                    view = view[os.write(self._master, view):]
+                self.lines_written += due - seq
+                self.bytes_written += len(payload)
+                seq = due
+                # the write itself took longer than the tick: we're falling behind
+                lag = int((time.perf_counter() - started) * self.rate) - seq
+                self.behind = max(self.behind, lag)
+            self._stop.wait(TICK_S)
+
+    def get_stats(self) -> Dict:
+        return {
+            "port": self.port,
+            "rate_hz": self.rate,
+            "lines_written": self.lines_written,
+            "bytes_written": self.bytes_written,
+            "max_lines_behind": self.behind
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated ESP32 on a pseudo-terminal")
+    parser.add_argument("--rate", type=float, default=10.0, help="lines per second")
+    parser.add_argument("--replay", help="file of recorded lines to loop over")
+    parser.add_argument("--start-ms", type=int, default=0,
+                        help=f"millis() at the first line, e.g. {MILLIS_WRAP - 10_000} to wrap 10s in")
+    parser.add_argument("--drift-ppm", type=float, default=0.0, help="how fast the device clock runs")
+    args = parser.parse_args()
+
+    simulator = SimulatedESP32(args.rate, load_replay(args.replay) if args.replay else None,
+                               start_ms=args.start_ms, drift_ppm=args.drift_ppm)
+    port = simulator.open()
+    simulator.start()
+    print(f"Simulated ESP32 on {port} at {args.rate:g} lines/s, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.close()
+        print(f"Wrote {simulator.lines_written} lines")
+
+
+if __name__ == "__main__":
+    main()
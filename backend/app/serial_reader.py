@@ -1,14 +1,34 @@
-import json
+"""Standalone serial reader: `python -m app.serial_reader [--port PORT] [--bus]`.
+
+Runs the same ingestion engine as the API server (app.ingest) without the
+web part: samples are written through the write-behind queue and logged,
+optionally appended to an NDJSON file.
+
+With --bus it is the ingest process for api workers running with
+INGEST_MODE=bus: it also publishes every sample on the local bus
+(app.stream.bus), keeps the occupancy sessions and runs partition
+maintenance, the parts the api workers leave out in that mode.
+"""
+import argparse
 import logging
-import time
-from datetime import datetime, timezone
+import threading
 from typing import Optional, Dict, Any, Callable
-import serial
+
 import serial.tools.list_ports
-from app.db.db import SessionLocal
-from app.db.models import Reading
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from app.config.settings import settings
+from app.db.journal_replay import create_db_writer
+from app.db.maintenance import partition_maintainer
+from app.db.query_cache import query_cache
+from app.db.sessions import SessionStore
+from app.ingest.compression import compressed
+from app.ingest.engine import IngestionEngine
+from app.ingest.sessions import SessionSink, session_detector
+from app.ingest.sinks import CallbackSink, DbSink, FileSink, MetricsSink
+from app.serial.device_manager import device_manager
+from app.serial.parser import LineParseError, Sample, parse_line
+from app.stream.bus import BusPublisher, BusSink
+
 logger = logging.getLogger(__name__)
 
 
@@ -24,89 +44,104 @@ def detect_port() -> Optional[str]:
 
 
 def parse_line_to_reading(line: str) -> Optional[Dict[str, Any]]:
-    """Parse serial line with optional prefix, extract JSON from first '{'"""
+    """Parse serial line with optional prefix (uses app.serial.parser)"""
     try:
-        line = line.strip()
-        json_start = line.find('{')
-        if json_start == -1:
-            return None
-        
-        payload = json.loads(line[json_start:])
-        if not all(k in payload for k in ['ts_ms', 'distance_cm', 'temp_c', 'hum_pct']):
-            return None
-        
-        return {
-            'ts_utc': datetime.now(timezone.utc).isoformat(),
-            'device_ts_ms': payload['ts_ms'],
-            'distance_cm': float(payload['distance_cm']),
-            'temp_c': float(payload['temp_c']),
-            'hum_pct': float(payload['hum_pct'])
-        }
-    except (json.JSONDecodeError, ValueError, KeyError) as e:
+        sample = parse_line(line.encode('utf-8'))
+    except LineParseError as e:
         logger.warning(f"Parse error: {e}")
         return None
+    if sample is None or None in (sample.device_ts_ms, sample.distance_cm,
+                                  sample.temp_c, sample.hum_pct):
+        return None
+
+    return {
+        'ts_utc': sample.ts.isoformat(),
+        'device_ts_ms': sample.device_ts_ms,
+        'distance_cm': sample.distance_cm,
+        'temp_c': sample.temp_c,
+        'hum_pct': sample.hum_pct
+    }
+
+
+def log_sample(sample: Sample):
+    logger.info(f"{sample.device or '-'}: {sample.distance_cm}cm | "
+                f"{sample.temp_c}°C | {sample.hum_pct}%")
+
 
+def build_engine(on_reading: Optional[Callable[[Sample], None]] = None,
+                 log: bool = True, file_path: Optional[str] = None,
+                 bus_url: Optional[str] = None) -> IngestionEngine:
+    """Engine with the db sink plus whatever the script asked for"""
+    sinks = [compressed(DbSink(create_db_writer()), settings.compression_db), MetricsSink()]
+    if log:
+        sinks.append(CallbackSink(log_sample, name="log"))
+    if file_path:
+        sinks.append(FileSink(file_path))
+    if bus_url:
+        publisher = BusPublisher(bus_url)
+        sinks.append(BusSink(publisher))
+        # the workers cache history, tell them once the rows are committed
+        query_cache.add_listener(publisher.publish_invalidations)
+        if settings.sessions_enabled:
+            sinks.append(SessionSink(session_detector, SessionStore()))
+    if on_reading:
+        sinks.append(CallbackSink(on_reading))
+    return IngestionEngine(device_manager, sinks)
 
-def read_loop(on_reading: Optional[Callable] = None, port: Optional[str] = None, 
-              baud_rate: int = 115200, reconnect_delay: float = 2.0) -> None:
-    """Read loop with auto-reconnect, parse JSON, persist to DB"""
+
+def read_loop(on_reading: Optional[Callable[[Sample], None]] = None, port: Optional[str] = None,
+              baud_rate: int = 115200, reconnect_delay: float = 2.0,
+              file_path: Optional[str] = None, stop_event: Optional[threading.Event] = None,
+              bus_url: Optional[str] = None) -> None:
+    """Read until stop_event is set (or forever), reconnecting as needed.
+
+    With a port the reader reconnects to it on its own; without one, device
+    discovery keeps connecting whatever ESP32 shows up.
+    """
     logger.info("Starting serial reader...")
-    
-    while True:
-        ser = None
-        try:
-            port_to_use = port or detect_port()
-            if not port_to_use:
-                logger.warning(f"No device found, retry in {reconnect_delay}s")
-                time.sleep(reconnect_delay)
-                continue
-            
-            ser = serial.Serial(port_to_use, baud_rate, timeout=1.0)
-            logger.info(f"Connected to {port_to_use}")
-            
-            while ser.is_open:
-                line = ser.readline().decode('utf-8', errors='ignore')
-                reading = parse_line_to_reading(line)
-                
-                if reading:
-                    logger.info(f"{reading['distance_cm']:.1f}cm | "
-                              f"{reading['temp_c']:.1f}°C | {reading['hum_pct']:.0f}%")
-                    
-                    db = SessionLocal()
-                    try:
-                        ts = datetime.fromisoformat(reading['ts_utc'].replace('Z', '+00:00'))
-                        db.add_all([
-                            Reading(ts=ts, sensor='distance', value=reading['distance_cm'], unit='cm'),
-                            Reading(ts=ts, sensor='temperature', value=reading['temp_c'], unit='celsius'),
-                            Reading(ts=ts, sensor='humidity', value=reading['hum_pct'], unit='percent')
-                        ])
-                        db.commit()
-                    except Exception as e:
-                        logger.error(f"DB error: {e}")
-                        db.rollback()
-                    finally:
-                        db.close()
-                    
-                    if on_reading:
-                        on_reading(reading)
-                        
-        except (serial.SerialException, Exception) as e:
-            logger.error(f"Connection error: {e}")
-        finally:
-            if ser and ser.is_open:
-                ser.close()
-            port = None
-            logger.info(f"Reconnecting in {reconnect_delay}s...")
-            time.sleep(reconnect_delay)
-
-
-def start_reader_thread():
+    stop_event = stop_event or threading.Event()
+    # every sample is already on the bus, logging each one too is just noise
+    engine = build_engine(on_reading, log=not bus_url, file_path=file_path, bus_url=bus_url)
+    engine.start()
+    if bus_url:
+        partition_maintainer.start()
+    try:
+        if port:
+            while not device_manager.connect(port, baud_rate):
+                logger.warning(f"Could not open {port}, retry in {reconnect_delay}s")
+                if stop_event.wait(reconnect_delay):
+                    return
+        else:
+            device_manager.discovery_interval_s = reconnect_delay
+            device_manager.start_discovery()
+        stop_event.wait()
+    finally:
+        partition_maintainer.stop()
+        engine.stop()
+
+
+def start_reader_thread(**kwargs):
     """Start reader in background thread"""
-    import threading
-    thread = threading.Thread(target=read_loop, daemon=True)
+    thread = threading.Thread(target=read_loop, kwargs=kwargs, daemon=True)
     thread.start()
     return thread
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Read ESP32 samples into the database")
+    parser.add_argument("--port", help="serial port, auto-detected when left out")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--file", help="also append every sample to this NDJSON file")
+    parser.add_argument("--bus", nargs="?", const=settings.bus_url, metavar="URL",
+                        help=f"publish samples for INGEST_MODE=bus api workers (default {settings.bus_url})")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        read_loop(port=args.port, baud_rate=args.baud, file_path=args.file, bus_url=args.bus)
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
-    read_loop()
+    main()
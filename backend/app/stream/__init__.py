@@ -0,0 +1 @@
+"""WebSocket streaming Package"""
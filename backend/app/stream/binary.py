@@ -0,0 +1,142 @@
+"""Packed binary frames for the /stream websocket (subprotocol deskbuddy.v1).
+
+Clients that offer the subprotocol get one binary message per flush
+interval (Settings.ws_binary_flush_s) carrying every sample since the last
+one, instead of one json text message per sample. All integers are
+little-endian, varints are LEB128 and signed ones zigzag encoded:
+
+    header    "DB" | version u8 (1) | columns u8 | base_ts_ms i64 | devices u16
+    device    name_len u8 | name utf-8 (empty = no device) | samples varint
+              ts deltas: samples x signed varint, ms since the previous
+                         sample (the first one since base_ts_ms)
+              then for each column set in the columns mask, in bit order:
+                presence bitmap, ceil(samples / 8) bytes, bit i = sample i has it
+                signed varint deltas of the present values, the first one from 0
+
+Columns are bit 0 ts_ms (the device clock, as is) and bits 1-3 temp_c,
+hum_pct, distance_cm as fixed point in hundredths. Sensors only change a
+little between samples, so most deltas fit in one byte. decode_frame() is
+the reference decoder.
+"""
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.serial.parser import Sample
+
+SUBPROTOCOL = "deskbuddy.v1"
+VERSION = 1
+MAGIC = b"DB"
+HEADER = struct.Struct("<2sBBqH")
+
+SENSORS = ("temp_c", "hum_pct", "distance_cm")
+COLUMNS = ("ts_ms",) + SENSORS
+ALL_COLUMNS = (1 << len(COLUMNS)) - 1
+SCALE = 100  # sensor values are sent in hundredths
+
+
+def column_mask(sensors: Optional[Iterable[str]] = None) -> int:
+    """ts_ms plus the given sensors (all when None)"""
+    if sensors is None:
+        return ALL_COLUMNS
+    mask = 1
+    for sensor in sensors:
+        mask |= 1 << COLUMNS.index(sensor)
+    return mask
+
+
+def _put_varint(out: bytearray, value: int):
+    value = value << 1 if value >= 0 else (-value << 1) - 1  # zigzag, any size
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (value >> 1) ^ -(value & 1), pos
+        shift += 7
+
+
+def _ts_ms(sample: Sample) -> int:
+    return round(sample.ts.timestamp() * 1000)
+
+
+def encode_frame(samples: List[Sample], columns: int = ALL_COLUMNS) -> bytes:
+    """One frame for a batch of samples, oldest first"""
+    by_device: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        by_device.setdefault(sample.device or "", []).append(sample)
+    base = _ts_ms(samples[0]) if samples else 0
+
+    out = bytearray(HEADER.pack(MAGIC, VERSION, columns, base, len(by_device)))
+    for device, batch in by_device.items():
+        # at most 255 bytes, cut on a character boundary so it still decodes
+        name = device.encode("utf-8")[:255].decode("utf-8", "ignore").encode("utf-8")
+        out.append(len(name))
+        out += name
+        _put_varint(out, len(batch))
+        previous = base
+        for sample in batch:
+            ts = _ts_ms(sample)
+            _put_varint(out, ts - previous)
+            previous = ts
+
+        for bit, column in enumerate(COLUMNS):
+            if not columns & (1 << bit):
+                continue
+            bitmap = bytearray((len(batch) + 7) // 8)
+            deltas = bytearray()
+            previous = 0
+            for i, sample in enumerate(batch):
+                value = sample.device_ts_ms if bit == 0 else getattr(sample, column)
+                if value is None:
+                    continue
+                bitmap[i >> 3] |= 1 << (i & 7)
+                value = value if bit == 0 else round(value * SCALE)
+                _put_varint(deltas, value - previous)
+                previous = value
+            out += bitmap
+            out += deltas
+    return bytes(out)
+
+
+def decode_frame(data: bytes) -> List[Dict]:
+    """Samples of a frame as dicts (ts_utc as epoch ms), the way a client would read it"""
+    magic, version, columns, base, devices = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a deskbuddy v1 frame")
+    pos = HEADER.size
+    samples = []
+    for _ in range(devices):
+        name_len = data[pos]
+        device = data[pos + 1:pos + 1 + name_len].decode("utf-8") or None
+        pos += 1 + name_len
+        count, pos = _get_varint(data, pos)
+        batch = []
+        ts = base
+        for _ in range(count):
+            delta, pos = _get_varint(data, pos)
+            ts += delta
+            batch.append({"device": device, "ts_utc_ms": ts})
+
+        for bit, column in enumerate(COLUMNS):
+            if not columns & (1 << bit):
+                continue
+            bitmap = data[pos:pos + (count + 7) // 8]
+            pos += len(bitmap)
+            value = 0
+            for i, sample in enumerate(batch):
+                if not bitmap[i >> 3] & (1 << (i & 7)):
+                    sample[column] = None
+                    continue
+                delta, pos = _get_varint(data, pos)
+                value += delta
+                sample[column] = value if bit == 0 else value / SCALE
+        samples.extend(batch)
+    return samples
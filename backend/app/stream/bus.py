@@ -0,0 +1,350 @@
+"""Local pub/sub bus between the ingest process and the api workers.
+
+With Settings.ingest_mode = "bus" the api no longer reads serial ports
+itself. `python -m app.serial_reader --bus` owns every port (and the db
+writer, sessions and partition maintenance), and publishes each sample on
+Settings.bus_url:
+
+    unix:/tmp/deskbuddy-bus.sock      unix domain socket (default)
+    tcp:127.0.0.1:8790                loopback tcp, for platforms without unix sockets
+
+Every `uvicorn app.main:app --workers N` worker subscribes and fans the
+samples out to its own /stream clients and recent cache, so dashboard
+connections spread over all cores.
+
+The wire format is NDJSON, one Sample.to_dict() per line. BusSink encodes a
+batch once and writes the same bytes to every subscriber. A subscriber that
+can't take a batch within bus_send_timeout_s is dropped (it reconnects and
+carries on from live data), so one stuck worker can't hold up the others
+for longer than that.
+
+Query cache invalidations travel as their own lines,
+
+    {"invalidate": [[device, sensor, since], ...]}
+
+sent by the ingest process once the rows are committed. Workers send the
+ones from their own writes (imports) up the same connection and the
+publisher passes them on to every subscriber. A worker that (re)connects
+clears its cache, it can't know what it missed.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import stat
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from app.config.settings import settings
+from app.db.query_cache import Invalidation
+from app.ingest.sinks import Sink
+from app.serial.parser import Sample
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def parse_bus_url(url: str) -> Tuple[str, object]:
+    """("unix", path) or ("tcp", (host, port))"""
+    scheme, _, rest = url.partition(":")
+    if scheme == "unix" and rest:
+        return "unix", rest
+    if scheme == "tcp":
+        host, _, port = rest.rpartition(":")
+        if host and port.isdigit():
+            return "tcp", (host, int(port))
+    raise ValueError(f"Invalid bus url '{url}', expected unix:/path or tcp:host:port")
+
+
+def encode_samples(samples: List[Sample]) -> bytes:
+    if orjson is not None:
+        return b"".join(orjson.dumps(sample.to_dict()) + b"\n" for sample in samples)
+    return "".join(json.dumps(sample.to_dict(), separators=(",", ":")) + "\n"
+                   for sample in samples).encode("utf-8")
+
+
+def encode_invalidations(invalidations: List[Invalidation]) -> bytes:
+    message = {"invalidate": [[device, sensor, since.isoformat()]
+                              for device, sensor, since in invalidations]}
+    return json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def decode_line(line: bytes) -> Union[Sample, List[Invalidation]]:
+    """A Sample, or the entries of an invalidation message"""
+    data = orjson.loads(line) if orjson is not None else json.loads(line)
+    if "invalidate" in data:
+        return [(device, sensor, datetime.fromisoformat(since))
+                for device, sensor, since in data["invalidate"]]
+    ts = data.get("ts_utc")
+    return Sample.from_dict(data, ts=datetime.fromisoformat(ts) if ts else None)
+
+
+def send_invalidations(invalidations: List[Invalidation], url: str = settings.bus_url,
+                       timeout: float = settings.bus_send_timeout_s) -> bool:
+    """One-off send for processes that aren't subscribed (the backfill cli), False if nobody listens"""
+    family, address = parse_bus_url(url)
+    try:
+        with socket.socket(socket.AF_UNIX if family == "unix" else socket.AF_INET) as conn:
+            conn.settimeout(timeout)
+            conn.connect(address)
+            conn.sendall(encode_invalidations(invalidations))
+            conn.shutdown(socket.SHUT_WR)
+        return True
+    except OSError as e:
+        logger.debug("Sample bus not reachable (%s), invalidation not sent", e)
+        return False
+
+
+class BusPublisher:
+    """Listening socket plus the connected subscribers, owned by the ingest process"""
+
+    def __init__(self, url: str = settings.bus_url, send_timeout: float = settings.bus_send_timeout_s):
+        self.url = url
+        self.send_timeout = send_timeout
+        self._server: Optional[socket.socket] = None
+        self._subscribers: List[socket.socket] = []
+        self._lock = threading.Lock()
+        # the sink thread and the subscriber readers both broadcast, lines must not interleave
+        self._send_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.bytes_sent = 0
+        self.dropped_subscribers = 0
+        self.invalidations_relayed = 0
+
+    def start(self):
+        if self._server is not None:
+            return
+        family, address = parse_bus_url(self.url)
+        if family == "unix":
+            # a socket file left behind by a previous run
+            if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+                os.unlink(address)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(address)
+        server.listen()
+        self._server = server
+        self._thread = threading.Thread(target=self._accept_loop, name="bus-accept", daemon=True)
+        self._thread.start()
+        logger.info("Sample bus listening on %s", self.url)
+
+    def stop(self):
+        server, self._server = self._server, None
+        if server is None:
+            return
+        server.close()
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for conn in subscribers:
+            conn.close()
+        family, address = parse_bus_url(self.url)
+        if family == "unix" and os.path.exists(address):
+            os.unlink(address)
+
+    def _accept_loop(self):
+        while self._server is not None:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return  # closed by stop()
+            conn.settimeout(self.send_timeout)
+            with self._lock:
+                self._subscribers.append(conn)
+            threading.Thread(target=self._read_loop, args=(conn,), name="bus-subscriber", daemon=True).start()
+            logger.info("Bus subscriber connected. Total: %d", len(self._subscribers))
+
+    def _read_loop(self, conn: socket.socket):
+        # invalidations sent up by a subscriber go out to all of them, nothing else is accepted
+        pending = b""
+        while self._server is not None:
+            try:
+                chunk = conn.recv(65536)
+            except TimeoutError:
+                continue
+            except OSError:
+                break
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                try:
+                    invalidations = decode_line(line)
+                except (ValueError, TypeError) as e:
+                    logger.warning("Bad line from a bus subscriber: %s", e)
+                    continue
+                if isinstance(invalidations, list):
+                    self.publish_invalidations(invalidations)
+                    self.invalidations_relayed += 1
+        self._drop(conn)
+
+    def publish_invalidations(self, invalidations: List[Invalidation]):
+        # query_cache listener in the ingest process, runs after the commit
+        if self.subscribers:
+            self.broadcast(encode_invalidations(invalidations))
+
+    def broadcast(self, data: bytes):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        with self._send_lock:
+            for conn in subscribers:
+                try:
+                    conn.sendall(data)
+                    self.bytes_sent += len(data)
+                except OSError as e:  # timeouts included
+                    logger.warning("Dropping bus subscriber: %s", e)
+                    self.dropped_subscribers += 1
+                    self._drop(conn)
+
+    def _drop(self, conn: socket.socket):
+        with self._lock:
+            if conn in self._subscribers:
+                self._subscribers.remove(conn)
+        conn.close()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def get_stats(self) -> Dict:
+        return {
+            "url": self.url,
+            "subscribers": self.subscribers,
+            "bytes_sent": self.bytes_sent,
+            "dropped_subscribers": self.dropped_subscribers,
+            "invalidations_relayed": self.invalidations_relayed
+        }
+
+
+class BusSink(Sink):
+    # publishes every sample on the bus, on its own thread so the readers never wait on a socket
+    name = "bus"
+    threaded = True
+
+    def __init__(self, publisher: BusPublisher):
+        super().__init__()
+        self.publisher = publisher
+
+    def start(self):
+        self.publisher.start()
+        super().start()
+
+    def handle_batch(self, samples: List[Sample]):
+        if self.publisher.subscribers:
+            self.publisher.broadcast(encode_samples(samples))
+
+    def close(self):
+        self.publisher.stop()
+
+    def get_stats(self) -> Dict:
+        return {**super().get_stats(), "bus": self.publisher.get_stats()}
+
+
+class BusSubscriber:
+    """Reads the bus in an api worker, the callbacks run on the event loop.
+
+    on_connect runs on every (re)connect, before the first line is read.
+    """
+
+    def __init__(
+        self,
+        on_sample: Callable[[Sample], None],
+        on_invalidate: Optional[Callable[[List[Invalidation]], None]] = None,
+        on_connect: Optional[Callable[[], None]] = None,
+        url: str = settings.bus_url,
+        reconnect_s: float = settings.bus_reconnect_s
+    ):
+        self.on_sample = on_sample
+        self.on_invalidate = on_invalidate
+        self.on_connect = on_connect
+        self.url = url
+        self.reconnect_s = reconnect_s
+        self.connected = False
+        self.received = 0
+        self.invalidations = 0
+        self.errors = 0
+        self.reconnects = 0
+        self._task: Optional[asyncio.Task] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _connect(self):
+        family, address = parse_bus_url(self.url)
+        if family == "unix":
+            return await asyncio.open_unix_connection(address, limit=1 << 20)
+        return await asyncio.open_connection(*address, limit=1 << 20)
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await self._connect()
+            except OSError as e:
+                logger.debug("Sample bus not reachable (%s), retrying", e)
+                await asyncio.sleep(self.reconnect_s)
+                continue
+            self.connected = True
+            self._writer = writer
+            logger.info("Subscribed to the sample bus on %s", self.url)
+            if self.on_connect:
+                self.on_connect()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break  # publisher went away
+                    try:
+                        message = decode_line(line)
+                    except (ValueError, TypeError) as e:
+                        self.errors += 1
+                        logger.warning("Bad line on the sample bus: %s", e)
+                        continue
+                    if isinstance(message, Sample):
+                        self.received += 1
+                        self.on_sample(message)
+                    else:
+                        self.invalidations += 1
+                        if self.on_invalidate:
+                            self.on_invalidate(message)
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+                logger.warning("Sample bus connection lost: %s", e)
+            finally:
+                self.connected = False
+                self._writer = None
+                writer.close()
+            self.reconnects += 1
+            await asyncio.sleep(self.reconnect_s)
+
+    def send_invalidations(self, invalidations: List[Invalidation]):
+        """Up to the publisher, which passes them to every worker. Event loop only"""
+        if self._writer is not None:
+            self._writer.write(encode_invalidations(invalidations))
+
+    def get_stats(self) -> Dict:
+        return {
+            "url": self.url,
+            "connected": self.connected,
+            "received": self.received,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+            "reconnects": self.reconnects
+        }
@@ -0,0 +1,246 @@
+# websocket fan-out for live sensor data
+#
+# json clients get one text message per sample. clients that negotiate the
+# binary subprotocol (app.stream.binary) get every sample since the last
+# flush in one packed frame, every ws_binary_flush_s. either way a message
+# is built once per distinct subscription (devices, sensors) and shared by
+# every client that has it.
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, FrozenSet, List, Optional, Tuple, Union
+
+from fastapi import WebSocket
+
+from app import metrics
+from app.config.settings import settings
+from app.serial.parser import Sample
+from app.stream.binary import SENSORS, SUBPROTOCOL, column_mask, encode_frame
+
+Message = Union[str, bytes]
+
+logger = logging.getLogger(__name__)
+
+
+class ClientConnection:
+    # one websocket with its own bounded outbound queue and sender task
+
+    def __init__(self, websocket: WebSocket, queue_size: int, send_timeout: float,
+                 devices: Optional[FrozenSet[str]] = None, sensors: Optional[Tuple[str, ...]] = None,
+                 binary: bool = False):
+        self.websocket = websocket
+        self.devices = devices  # only these devices' samples, None for all
+        self.sensors = sensors  # only these sensors, None for all
+        self.binary = binary
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.queue: Deque[Tuple[Message, float]] = deque()
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.connected_at = time.time()
+        self.sent = 0
+        self.coalesced = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    @property
+    def subscription(self) -> Tuple:
+        return self.devices, self.sensors
+
+    def wants(self, device: Optional[str]) -> bool:
+        return self.devices is None or device in self.devices
+
+    def push(self, message: Message, now: float):
+        # never blocks: when the client can't keep up only the newest messages are kept
+        if len(self.queue) >= self.queue_size:
+            self.queue.popleft()
+            self.coalesced += 1
+        self.queue.append((message, now))
+        self.ready.set()
+
+    def lag(self, now: float) -> float:
+        # how long the oldest queued message has been waiting
+        return now - self.queue[0][1] if self.queue else 0.0
+
+    def get_stats(self, now: float) -> Dict:
+        client = self.websocket.client
+        return {
+            "client": f"{client.host}:{client.port}" if client else None,
+            "devices": sorted(self.devices) if self.devices is not None else None,
+            "sensors": list(self.sensors) if self.sensors is not None else None,
+            "protocol": "binary" if self.binary else "json",
+            "connected_s": round(now - self.connected_at, 1),
+            "queue_depth": len(self.queue),
+            "lag_ms": round(self.lag(time.monotonic()) * 1000, 1),
+            "last_send_lag_ms": round(self.last_lag * 1000, 1),
+            "max_send_lag_ms": round(self.max_lag * 1000, 1),
+            "sent": self.sent,
+            "coalesced": self.coalesced
+        }
+
+
+class ConnectionManager:
+    # handles websocket connections
+
+    def __init__(
+        self,
+        queue_size: int = settings.ws_queue_size,
+        send_timeout: float = settings.ws_send_timeout_s,
+        flush_s: float = settings.ws_binary_flush_s,
+        max_batch: int = settings.ws_binary_max_batch
+    ):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.flush_s = flush_s
+        self.max_batch = max_batch
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.broadcasts = 0
+        self.slow_disconnects = 0
+        self.frames = 0
+        self.frame_bytes = 0
+        self._json_clients = 0
+        self._binary_clients = 0
+        self._pending: List[Sample] = []  # samples for the next binary frame
+        self._flusher: Optional[asyncio.Task] = None
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.clients)
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        devices: Optional[FrozenSet[str]] = None,
+        sensors: Optional[Tuple[str, ...]] = None,
+        binary: bool = False
+    ):
+        await websocket.accept(subprotocol=SUBPROTOCOL if binary else None)
+        client = ClientConnection(websocket, self.queue_size, self.send_timeout,
+                                  devices, sensors, binary)
+        client.task = asyncio.create_task(self._sender(client))
+        self.clients[websocket] = client
+        if binary:
+            self._binary_clients += 1
+            if self._flusher is None or self._flusher.done():
+                self._flusher = asyncio.create_task(self._flush_loop())
+        else:
+            self._json_clients += 1
+        logger.info("WebSocket client connected. Total: %d", len(self.clients))
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        if client.binary:
+            self._binary_clients -= 1
+        else:
+            self._json_clients -= 1
+        if client.task and client.task is not asyncio.current_task():
+            client.task.cancel()
+        logger.info("WebSocket client disconnected. Total: %d", len(self.clients))
+
+    def publish_sample(self, sample: Sample):
+        # must run on the event loop thread
+        if self._json_clients:
+            self.publish(sample.to_dict())
+        if self._binary_clients:
+            self._pending.append(sample)
+            if len(self._pending) >= self.max_batch:
+                self.flush()
+
+    def publish(self, data: dict):
+        # json clients only; serialized once per subscription
+        if not self._json_clients:
+            return
+        now = time.monotonic()
+        device = data.get("device")
+        messages: Dict[Tuple, str] = {}
+        for client in self.clients.values():
+            if client.binary or not client.wants(device):
+                continue
+            message = messages.get(client.sensors)
+            if message is None:
+                payload = data
+                if client.sensors is not None:
+                    payload = {key: value for key, value in data.items()
+                               if key not in SENSORS or key in client.sensors}
+                message = messages[client.sensors] = json.dumps(payload)
+            client.push(message, now)
+        self.broadcasts += 1
+
+    def flush(self):
+        # one binary frame per subscription for everything pending
+        if not self._pending:
+            return
+        samples, self._pending = self._pending, []
+        now = time.monotonic()
+        frames: Dict[Tuple, Optional[bytes]] = {}
+        for client in self.clients.values():
+            if not client.binary:
+                continue
+            key = client.subscription
+            if key not in frames:
+                devices, sensors = key
+                batch = samples if devices is None else [s for s in samples if s.device in devices]
+                if sensors is not None:
+                    batch = [s for s in batch if any(getattr(s, name) is not None for name in sensors)]
+                frames[key] = encode_frame(batch, column_mask(sensors)) if batch else None
+                if frames[key] is not None:
+                    self.frames += 1
+                    self.frame_bytes += len(frames[key])
+            if frames[key] is not None:
+                client.push(frames[key], now)
+
+    async def _flush_loop(self):
+        while self._binary_clients:
+            await asyncio.sleep(self.flush_s)
+            self.flush()
+        self._pending = []
+
+    async def broadcast(self, data: dict):
+        self.publish(data)
+
+    async def _sender(self, client: ClientConnection):
+        websocket = client.websocket
+        try:
+            while True:
+                await client.ready.wait()
+                while client.queue:
+                    message, queued_at = client.queue.popleft()
+                    send = websocket.send_bytes if client.binary else websocket.send_text
+                    await asyncio.wait_for(send(message), client.send_timeout)
+                    client.sent += 1
+                    client.last_lag = time.monotonic() - queued_at
+                    client.max_lag = max(client.max_lag, client.last_lag)
+                    metrics.WS_MESSAGES.inc()
+                    metrics.WS_SEND_LAG_SECONDS.observe(client.last_lag)
+                client.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning("Dropping slow WebSocket client (send took over %.1fs)",
+                           client.send_timeout)
+            self.slow_disconnects += 1
+        except (RuntimeError, ConnectionError) as e:
+            logger.warning("Failed to send to client: %s", e)
+
+        self.disconnect(websocket)
+        try:
+            await websocket.close()
+        except (RuntimeError, ConnectionError):
+            pass
+
+    def get_stats(self) -> Dict:
+        now = time.time()
+        clients = [client.get_stats(now) for client in self.clients.values()]
+        return {
+            "connected_clients": len(clients),
+            "broadcasts": self.broadcasts,
+            "slow_disconnects": self.slow_disconnects,
+            "binary_frames": self.frames,
+            "binary_frame_bytes": self.frame_bytes,
+            "max_lag_ms": max((c["lag_ms"] for c in clients), default=0.0),
+            "clients": clients
+        }
@@ -0,0 +1,172 @@
+"""Speed of the numpy analytics (app.db.analytics) against plain python loops.
+
+Compute: synthetic arrays of --samples samples (10 Hz, temp/hum/distance
+with a few spikes) through every step /readings/analytics runs. The python
+baselines (deque rolling window, per-sample math) run on --python-samples
+and are scaled up to --samples.
+
+With --db it also fills a copy of the readings table in a throwaway schema
+with --samples distance_cm rows (generated inside postgres) and compares
+load_series (packed bytea into numpy) with fetching the same rows through
+SQLAlchemy. From backend/:
+
+    python -m benchmarks.bench_analytics --samples 10000000
+    python -m benchmarks.bench_analytics --samples 10000000 --db --keep
+"""
+import argparse
+import math
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.db import analytics
+from app.db.db import engine
+
+SCHEMA = "bench_analytics"
+START = datetime(2024, 1, 1)
+WINDOW_S = 300.0
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def synthetic(np, samples: int):
+    rng = np.random.default_rng(42)
+    ts = 1_700_000_000.0 + np.arange(samples) * 0.1
+    temp = 22.0 + np.cumsum(rng.normal(0, 0.002, samples)) + rng.normal(0, 0.05, samples)
+    hum = np.clip(45.0 + np.cumsum(rng.normal(0, 0.005, samples)), 5.0, 95.0)
+    distance = 80.0 + rng.normal(0, 0.5, samples)
+    distance[rng.integers(0, samples, max(samples // 100_000, 1))] = 300.0
+    return ts, temp, hum, distance
+
+
+def python_rolling(ts, values):
+    # what a loop over rows would do: deque window, running sums
+    window, total, squares, out = deque(), 0.0, 0.0, []
+    for t, v in zip(ts, values):
+        window.append((t, v))
+        total += v
+        squares += v * v
+        while window[0][0] <= t - WINDOW_S:
+            _, old = window.popleft()
+            total -= old
+            squares -= old * old
+        mean = total / len(window)
+        out.append((mean, math.sqrt(max(squares / len(window) - mean * mean, 0.0))))
+    return out
+
+
+def python_dew_point(temps, hums):
+    out = []
+    for t, h in zip(temps, hums):
+        gamma = math.log(h / 100.0) + 17.62 * t / (243.12 + t)
+        out.append(243.12 * gamma / (17.62 - gamma))
+    return out
+
+
+def compute(np, samples: int, python_samples: int):
+    ts, temp, hum, distance = synthetic(np, samples)
+    steps = [
+        ("rolling mean/std", analytics.rolling_stats, (ts, temp, WINDOW_S)),
+        ("z-scores", analytics.zscores, (ts, distance, WINDOW_S, 10, 1.0)),
+        ("percentiles + stats", analytics.summary, (temp,)),
+        ("dew point", analytics.dew_point, (temp, hum)),
+        ("heat index", analytics.heat_index, (temp, hum)),
+        ("sensor_analytics", analytics.sensor_analytics, (ts, distance, "distance_cm", WINDOW_S, 3.0, 1000, 100)),
+        ("comfort_analytics", analytics.comfort_analytics, ((ts, temp), (ts, hum), 1000)),
+    ]
+    print(f"{samples} samples, numpy\n")
+    print(f"{'step':<22} {'s':>8} {'Msamples/s':>11}")
+    for name, fn, args in steps:
+        _, seconds = timed(fn, *args)
+        print(f"{name:<22} {seconds:>8.3f} {samples / seconds / 1e6:>11.1f}")
+
+    n = min(python_samples, samples)
+    lists = ts[:n].tolist(), temp[:n].tolist(), hum[:n].tolist()
+    scale = samples / n
+    print(f"\npython loops on {n} samples, scaled to {samples}\n")
+    print(f"{'step':<22} {'s':>8} {'vs numpy':>11}")
+    for name, fn, args, numpy_fn, numpy_args in (
+        ("rolling mean/std", python_rolling, (lists[0], lists[1]), analytics.rolling_stats, (ts, temp, WINDOW_S)),
+        ("dew point", python_dew_point, (lists[1], lists[2]), analytics.dew_point, (temp, hum)),
+    ):
+        _, seconds = timed(fn, *args)
+        _, numpy_seconds = timed(numpy_fn, *numpy_args)
+        print(f"{name:<22} {seconds * scale:>8.1f} {seconds * scale / numpy_seconds:>10.0f}x")
+
+
+def fill_table(samples: int):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}"))
+        existing = conn.execute(text(
+            "SELECT count(*) FROM information_schema.tables "
+            "WHERE table_schema = :schema AND table_name = 'readings'"
+        ), {"schema": SCHEMA}).scalar()
+        if existing and conn.execute(text(f"SELECT count(*) FROM {SCHEMA}.readings")).scalar() == samples:
+            print(f"reusing {SCHEMA}.readings ({samples} rows)")
+            return
+        conn.execute(text(f"DROP TABLE IF EXISTS {SCHEMA}.readings"))
+        conn.execute(text(f"CREATE TABLE {SCHEMA}.readings (LIKE public.readings INCLUDING ALL)"))
+
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {SCHEMA}.readings (ts, sensor, value, device_ts_ms, device)
+            SELECT :start + i * interval '100 milliseconds', 'distance_cm',
+                   round((80 + 5 * random())::numeric, 1)::float8, (i * 100 % 2000000000)::int, 'desk-1'
+            FROM generate_series(0, :samples - 1) AS i
+        """), {"start": START, "samples": samples})
+        conn.execute(text(f"ANALYZE {SCHEMA}.readings"))
+    print(f"filled {SCHEMA}.readings with {samples} rows in {time.perf_counter() - started:.1f}s")
+
+
+def load(samples: int, python_samples: int):
+    end = START + timedelta(seconds=samples / 10 + 1)
+    with engine.connect() as conn:
+        conn.execute(text(f"SET search_path TO {SCHEMA}"))
+        (ts, _), seconds = timed(analytics.load_series, conn, "distance_cm", START, end,
+                                 None, samples)
+        print(f"\n{'load_series (packed bytea)':<30} {len(ts):>10} rows {seconds:>7.2f} s "
+              f"{len(ts) / seconds / 1e6:>6.2f} Mrows/s")
+
+        # the same columns as python rows, on a slice
+        n = min(python_samples, samples)
+        started = time.perf_counter()
+        rows = conn.execute(text(
+            "SELECT extract(epoch FROM ts)::float8, value FROM readings "
+            "WHERE sensor = 'distance_cm' AND ts >= :start AND ts < :end ORDER BY ts"
+        ), {"start": START, "end": START + timedelta(seconds=n / 10)}).all()
+        seconds = (time.perf_counter() - started) * samples / max(len(rows), 1)
+        print(f"{'sqlalchemy rows (scaled)':<30} {samples:>10} rows {seconds:>7.2f} s "
+              f"{samples / seconds / 1e6:>6.2f} Mrows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=10_000_000)
+    parser.add_argument("--python-samples", type=int, default=200_000)
+    parser.add_argument("--db", action="store_true", help="also time loading from postgres")
+    parser.add_argument("--keep", action="store_true", help="don't drop the bench schema afterwards")
+    args = parser.parse_args()
+
+    analytics.check_analytics()
+    import numpy
+    compute(numpy, args.samples, args.python_samples)
+    if not args.db:
+        return
+    fill_table(args.samples)
+    try:
+        load(args.samples, args.python_samples)
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
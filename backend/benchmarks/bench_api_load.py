@@ -0,0 +1,84 @@
+"""Load test: many dashboards polling the API at once.
+
+Each simulated dashboard polls /health, /readings/history and / (a plain
+async route that never touches the database) in a loop, like the frontend
+does. The script reports p50/p99/max latency per endpoint. When a route
+blocks the event loop, the latency of / goes up with it, so / doubles as a
+canary for the websocket stream.
+
+Start the API first (uvicorn app.main:app), then from backend/:
+
+    python -m benchmarks.bench_api_load --clients 50 --duration 20
+
+To compare two versions, run it once against each and keep the output.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+ENDPOINTS = {
+    "health": "/health",
+    "history": "/readings/history?sensor=temp_c&bucket=1m",
+    "root": "/",
+}
+
+
+async def dashboard(client: httpx.AsyncClient, interval: float, deadline: float,
+                    latencies: Dict[str, List[float]], errors: Dict[str, int]):
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        for name, path in ENDPOINTS.items():
+            sent = time.perf_counter()
+            try:
+                response = await client.get(path)
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors[name] += 1
+                continue
+            latencies[name].append((time.perf_counter() - sent) * 1000)
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(url: str, clients: int, duration: float, interval: float):
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as client:
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(
+            dashboard(client, interval, deadline, latencies, errors) for _ in range(clients)
+        ))
+
+    print(f"{clients} dashboards polling every {interval}s for {duration}s against {url}")
+    print(f"{'endpoint':<10} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name in ENDPOINTS:
+        values = latencies[name]
+        if not values:
+            print(f"{name:<10} {0:>9} {errors[name]:>7}")
+            continue
+        print(f"{name:<10} {len(values):>9} {errors[name]:>7} {statistics.median(values):>8.1f} "
+              f"{percentile(values, 99):>8.1f} {max(values):>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between polls")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.clients, args.duration, args.interval))
+
+
+if __name__ == "__main__":
+    main()
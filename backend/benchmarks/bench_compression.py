@@ -0,0 +1,93 @@
+"""Compression ratio, reconstruction error and cost of app.ingest.compression.
+
+Feeds an hour of simulated desk data (10 Hz, rounded like the real DHT and
+ultrasonic sensors) through each mode, rebuilds every series from the kept
+points (step for deadband, linear for swinging door) and checks that no
+dropped value is further than its tolerance from the rebuild.
+
+No database needed, from backend/:
+
+    python -m benchmarks.bench_compression --minutes 60 --rate 10
+"""
+import argparse
+import bisect
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.ingest.compression import SENSORS, Compressor
+from app.serial.parser import parse_line
+from app.serial.simulator import generated_line
+
+
+def make_samples(minutes: float, rate: float):
+    start = datetime.now(timezone.utc)
+    samples = []
+    for seq in range(int(minutes * 60 * rate)):
+        sample = parse_line(generated_line(seq, rate), device="desk-1",
+                            ts=start + timedelta(seconds=seq / rate))
+        # what the sensors actually resolve
+        sample.temp_c = round(sample.temp_c, 1)
+        sample.hum_pct = float(round(sample.hum_pct))
+        sample.distance_cm = round(sample.distance_cm, 1)
+        samples.append(sample)
+    return samples
+
+
+def rebuild(points, t, linear: bool):
+    times = [p[0] for p in points]
+    i = bisect.bisect_right(times, t) - 1
+    t0, v0 = points[i]
+    if not linear or i + 1 >= len(points) or t0 == t:
+        return v0
+    t1, v1 = points[i + 1]
+    return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+
+
+def run(mode: str, samples, tolerances, heartbeat_s: float):
+    compressor = Compressor(mode, tolerances, heartbeat_s)
+    kept = []
+    started = time.perf_counter()
+    for sample in samples:
+        kept.extend(compressor.process(sample))
+    kept.extend(compressor.flush())
+    elapsed = time.perf_counter() - started
+
+    worst = {}
+    for sensor in SENSORS:
+        points = sorted((s.ts.timestamp(), getattr(s, sensor)) for s in kept
+                        if getattr(s, sensor) is not None)
+        worst[sensor] = max(
+            abs(rebuild(points, s.ts.timestamp(), mode == "swinging_door") - getattr(s, sensor))
+            for s in samples
+        )
+    return compressor.get_stats(), len(kept), worst, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--minutes", type=float, default=60.0)
+    parser.add_argument("--rate", type=float, default=10.0, help="samples per second")
+    parser.add_argument("--heartbeat", type=float, default=60.0)
+    args = parser.parse_args()
+
+    random.seed(1)
+    samples = make_samples(args.minutes, args.rate)
+    tolerances = {"temp_c": 0.1, "hum_pct": 0.5, "distance_cm": 1.0}
+    print(f"{len(samples)} samples, tolerances {tolerances}, heartbeat {args.heartbeat}s\n")
+    print(f"{'mode':<14} {'kept samples':>12} {'ratio':>7} {'us/sample':>10}  "
+          + "  ".join(f"{s + ' ratio / max err':>26}" for s in SENSORS))
+    ok = True
+    for mode in ("deadband", "swinging_door"):
+        stats, kept, worst, elapsed = run(mode, samples, tolerances, args.heartbeat)
+        per_sensor = "  ".join(
+            f"{stats['sensors'][s]['ratio']:>14} / {worst[s]:>9.4f}" for s in SENSORS
+        )
+        print(f"{mode:<14} {kept:>12} {stats['ratio']:>7} "
+              f"{elapsed / len(samples) * 1e6:>10.2f}  {per_sensor}")
+        ok &= all(worst[s] <= tolerances[s] + 1e-9 for s in SENSORS)
+    print("\nreconstruction within tolerance:", "yes" if ok else "NO")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Throughput and memory of /readings/export (app.db.export).
+
+Fills a copy of the readings table in a throwaway schema with synthetic rows
+(generated inside postgres), then runs each export format in a fresh child
+process and reports output MB/s, rows/s and peak RSS. Peak RSS should stay
+roughly the same whatever --rows is, that's the point of streaming.
+
+Runs the same generator the endpoint streams from, minus the HTTP layer.
+Needs a migrated database, from backend/:
+
+    python -m benchmarks.bench_export --rows 10000000
+    python -m benchmarks.bench_export --rows 10000000 --keep   # reuse the table next time
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.db.db import engine
+from app.db.export import check_export, export_chunks, ExportError
+
+SCHEMA = "bench_export"
+CASES = [
+    ("csv", "none"),
+    ("csv", "gzip"),
+    ("csv", "zstd"),
+    ("parquet", "zstd"),
+    ("arrow", "none"),
+    ("arrow", "zstd"),
+]
+START = datetime(2024, 1, 1)
+
+
+def fill_table(rows: int):
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}"))
+        existing = conn.execute(text(
+            "SELECT count(*) FROM information_schema.tables "
+            "WHERE table_schema = :schema AND table_name = 'readings'"
+        ), {"schema": SCHEMA}).scalar()
+        if existing and conn.execute(text(f"SELECT count(*) FROM {SCHEMA}.readings")).scalar() == rows:
+            print(f"reusing {SCHEMA}.readings ({rows} rows)")
+            return
+        conn.execute(text(f"DROP TABLE IF EXISTS {SCHEMA}.readings"))
+        conn.execute(text(f"CREATE TABLE {SCHEMA}.readings (LIKE public.readings INCLUDING ALL)"))
+
+    # three sensors per sample, one sample a second, like a real desk
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {SCHEMA}.readings (ts, sensor, value, device_ts_ms, device)
+            SELECT :start + (i / 3) * interval '1 second',
+                   (ARRAY['temp_c', 'hum_pct', 'distance_cm'])[i % 3 + 1],
+                   round((20 + 10 * random())::numeric, 1)::float8,
+                   ((i / 3)::bigint * 1000 % 2000000000)::int,
+                   'desk-1'
+            FROM generate_series(0, :rows - 1) AS i
+        """), {"start": START, "rows": rows})
+        conn.execute(text(f"ANALYZE {SCHEMA}.readings"))
+    print(f"filled {SCHEMA}.readings with {rows} rows in {time.perf_counter() - started:.1f}s")
+
+
+def run_case(fmt: str, compression: str, end: datetime, results):
+    # child process, so ru_maxrss is this export's peak and nothing else's
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    engine.dispose(close=False)  # don't share the parent's pooled connections
+    total = 0
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        conn.execute(text(f"SET search_path TO {SCHEMA}"))
+        for chunk in export_chunks(conn, fmt, START, end, compression=compression):
+            total += len(chunk)
+    elapsed = time.perf_counter() - started
+    results.put({
+        "bytes": total,
+        "seconds": elapsed,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "baseline_rss_mb": baseline_kb / 1024,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--keep", action="store_true", help="don't drop the bench schema afterwards")
+    parser.add_argument("--format", action="append", help="only these formats (csv, parquet, arrow)")
+    args = parser.parse_args()
+
+    cases = []
+    for fmt, compression in CASES:
+        if args.format and fmt not in args.format:
+            continue
+        try:
+            check_export(fmt, compression)
+        except ExportError as e:
+            print(f"skipping {fmt}/{compression}: {e}")
+            continue
+        cases.append((fmt, compression))
+
+    fill_table(args.rows)
+    end = START + timedelta(seconds=args.rows // 3 + 1)
+    context = multiprocessing.get_context("fork")
+    try:
+        print(f"\n{args.rows} rows\n")
+        print(f"{'format':<8} {'compression':<12} {'MB':>9} {'s':>8} {'MB/s':>8} "
+              f"{'rows/s':>10} {'peak RSS MB':>12} {'baseline MB':>12}")
+        for fmt, compression in cases:
+            results = context.Queue()
+            child = context.Process(target=run_case, args=(fmt, compression, end, results))
+            child.start()
+            r = results.get()
+            child.join()
+            mb = r["bytes"] / 1e6
+            print(f"{fmt:<8} {compression:<12} {mb:>9.1f} {r['seconds']:>8.1f} "
+                  f"{mb / r['seconds']:>8.1f} {args.rows / r['seconds']:>10.0f} "
+                  f"{r['peak_rss_mb']:>12.1f} {r['baseline_rss_mb']:>12.1f}")
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""End-to-end ingestion benchmark driven by the ESP32 simulator.
+
+The real API runs in this process under uvicorn, against the postgres in
+DATABASE_URL. For each rate a SimulatedESP32 is connected through
+POST /serial/devices, and a websocket client subscribes to
+/stream?device=<id>. The simulator then sends lines for --duration
+seconds. Reported per rate:
+
+* lines/s: samples that made it through the parser (sustained)
+* db rows/s: rows the write-behind writer flushed during the run
+* ws latency p50/p95/p99/max: simulator write -> websocket client receive
+* dropped: lines sent but never parsed, writer drops/failures, and
+  websocket messages coalesced away or never received
+
+Results are also written as JSON (--output) for tracking regressions.
+POSIX only (pty). Rows are written under device ids bench-<rate>, and
+--cleanup deletes them afterwards. From backend/:
+
+    python -m benchmarks.bench_ingest --rates 10 100 1000 10000 --duration 10 --output ingest.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import httpx
+import uvicorn
+import websockets
+from sqlalchemy import text
+
+from app.config.settings import settings
+from app.db.db import engine
+from app.main import app
+from app.serial.simulator import SimulatedESP32
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def writer_settled(stats: Dict) -> bool:
+    # everything handed to the db writer is written (or given up on)
+    if stats.get("mode") == "journal":
+        return stats["pending_samples"] == 0
+    settled = sum(stats[k] for k in ("rows_written", "rows_dropped", "rows_failed"))
+    return settled >= stats["rows_enqueued"]
+
+
+def writer_lost(stats: Dict) -> int:
+    if stats.get("mode") == "journal":
+        return stats["journal"]["discarded"]
+    return stats["rows_dropped"] + stats["rows_failed"]
+
+
+def start_server(port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="bench-uvicorn", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def receive_until(ws, received: Dict[int, int], counts: Dict[str, int], stop: asyncio.Event):
+    # first arrival per ts_ms, matched with the simulator's send_times
+    while not stop.is_set():
+        try:
+            message = await asyncio.wait_for(ws.recv(), timeout=0.2)
+        except asyncio.TimeoutError:
+            continue
+        received.setdefault(json.loads(message)["ts_ms"], time.perf_counter_ns())
+        counts["messages"] += 1
+
+
+async def run_rate(base_url: str, rate: float, duration: float, drain: float) -> Dict:
+    device_id = f"bench-{rate:g}"
+    simulator = SimulatedESP32(rate, record_send_times=True)
+    port = simulator.open()
+    ws_url = base_url.replace("http", "ws", 1) + f"/stream?device={device_id}"
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+        response = await client.post("/serial/devices", json={"port": port, "device_id": device_id})
+        response.raise_for_status()
+        writer_before = (await client.get("/health")).json()["writer"]
+
+        received: Dict[int, int] = {}
+        counts = {"messages": 0}
+        stop = asyncio.Event()
+        async with websockets.connect(ws_url, max_queue=None) as ws:
+            receiver = asyncio.create_task(receive_until(ws, received, counts, stop))
+            started = time.perf_counter()
+            simulator.start()
+            await asyncio.sleep(duration)
+            simulator.stop()
+            sent_for = time.perf_counter() - started
+
+            # let the reader, writer and websocket catch up
+            deadline = time.monotonic() + drain
+            while time.monotonic() < deadline and counts["messages"] < simulator.lines_written:
+                await asyncio.sleep(0.1)
+            elapsed = time.perf_counter() - started
+            ingest = (await client.get("/ingest/stats")).json()
+            stream = (await client.get("/stream/stats")).json()
+            stop.set()
+            await receiver
+
+        device = (await client.get(f"/serial/devices/{device_id}")).json()
+        await client.delete(f"/serial/devices/{device_id}")
+        # wait for the writer to flush the rest of this run
+        deadline = time.monotonic() + drain
+        while True:
+            writer_after = (await client.get("/health")).json()["writer"]
+            if writer_settled(writer_after) or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.1)
+
+    simulator.close()
+    latencies = [
+        (received[ts_ms] - sent) / 1e6 for ts_ms, sent in simulator.send_times.items() if ts_ms in received
+    ]
+    coalesced = sum(c["coalesced"] for c in stream["clients"] if device_id in (c["devices"] or ()))
+    rows_written = writer_after["rows_written"] - writer_before["rows_written"]
+    parsed = device["samples_read"]
+    return {
+        "rate_hz": rate,
+        "duration_s": round(sent_for, 3),
+        "lines_sent": simulator.lines_written,
+        "lines_parsed": parsed,
+        "lines_per_s": round(parsed / sent_for, 1),
+        "parse_errors": device["parse_errors"],
+        "db_rows_written": rows_written,
+        "db_rows_per_s": round(rows_written / elapsed, 1),
+        "ws_received": counts["messages"],
+        "ws_latency_ms": {
+            "p50": round(statistics.median(latencies), 3) if latencies else None,
+            "p95": round(percentile(latencies, 95), 3) if latencies else None,
+            "p99": round(percentile(latencies, 99), 3) if latencies else None,
+            "max": round(max(latencies), 3) if latencies else None,
+        },
+        "dropped": {
+            "serial": simulator.lines_written - parsed,
+            "db": writer_lost(writer_after) - writer_lost(writer_before),
+            "ws_coalesced": coalesced,
+            "ws_missing": parsed - counts["messages"],
+        },
+        "simulator_max_lines_behind": simulator.behind,
+        "published_total": ingest["published"],
+    }
+
+
+async def run(args) -> Dict:
+    server = start_server(args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    try:
+        for rate in args.rates:
+            result = await run_rate(base_url, rate, args.duration, args.drain)
+            results.append(result)
+            latency = result["ws_latency_ms"]
+            print(f"{rate:>8g} Hz  {result['lines_per_s']:>9.1f} lines/s  "
+                  f"{result['db_rows_per_s']:>9.1f} rows/s  "
+                  f"ws p50 {latency['p50']} p99 {latency['p99']} ms  dropped {result['dropped']}")
+    finally:
+        server.should_exit = True
+
+    if args.cleanup:
+        with engine.begin() as conn:
+            for table in ("readings", "samples"):
+                conn.execute(text(f"DELETE FROM {table} WHERE device LIKE 'bench-%'"))
+
+    return {
+        "benchmark": "ingest",
+        "time_utc": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "storage_layout": settings.storage_layout,
+        "serial_read_mode": settings.serial_read_mode,
+        "write_batch_size": settings.write_batch_size,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rates", type=float, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of sending per rate")
+    parser.add_argument("--drain", type=float, default=5.0, help="max seconds to wait for stragglers")
+    parser.add_argument("--port", type=int, default=8765, help="port for the in-process api")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--cleanup", action="store_true", help="delete the bench-* rows afterwards")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Microbenchmark for the serial line parser.
+
+Compares the old per-line path (decode, strip, re.sub for the Serial
+Monitor prefix, json.loads into a dict) with app.serial.parser.parse_line
+on the stdlib json and orjson backends. Each line kind is timed on its own:
+
+* valid: a plain ESP32 json line
+* prefixed: the same line with the "17:09:47.625 -> " timestamp prefix
+* malformed: truncated json
+* noise: random bytes, like a port opened at the wrong baud rate
+
+From backend/:
+
+    python -m benchmarks.bench_parser --number 200000
+"""
+import argparse
+import json
+import os
+import re
+import timeit
+
+from app.serial import parser
+
+LINES = {
+    "valid": b'{"ts_ms":123456,"distance_cm":99.8,"temp_c":17.8,"hum_pct":59}\n',
+    "prefixed": b'17:09:47.625 -> {"ts_ms":123456,"distance_cm":99.8,"temp_c":17.8,"hum_pct":59}\n',
+    "malformed": b'{"ts_ms":123456,"distance_cm":99.8,"temp_\n',
+    "noise": os.urandom(48) + b"\n",
+}
+
+
+def legacy_parse(line: bytes):
+    # what ESP32SerialReader._read_loop used to do for every line
+    try:
+        text = line.decode("utf-8").strip()
+        if not text:
+            return None
+        text = re.sub(r"^\d{2}:\d{2}:\d{2}\.\d{3}\s*->\s*", "", text)
+        return json.loads(text)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+
+
+def fast_parse(line: bytes):
+    try:
+        return parser.parse_line(line)
+    except parser.LineParseError:
+        return None
+
+
+def time_per_line(func, line: bytes, number: int) -> float:
+    # best of 3, in microseconds per line
+    timer = timeit.Timer(lambda: func(line))
+    return min(timer.repeat(repeat=3, number=number)) / number * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--number", type=int, default=100000, help="calls per timing run")
+    args = arg_parser.parse_args()
+
+    backends = ["json"] + (["orjson"] if parser.orjson is not None else [])
+    columns = ["legacy"] + [f"parse_line/{name}" for name in backends]
+    print(f"{'line':<10}" + "".join(f"{c:>20}" for c in columns) + "   (us/line)")
+
+    for kind, line in LINES.items():
+        results = [time_per_line(legacy_parse, line, args.number)]
+        for name in backends:
+            parser.set_json_backend(name)
+            results.append(time_per_line(fast_parse, line, args.number))
+        print(f"{kind:<10}" + "".join(f"{r:>20.3f}" for r in results))
+
+    if parser.orjson is None:
+        print("orjson is not installed, only the stdlib backend was measured")
+
+
+if __name__ == "__main__":
+    main()
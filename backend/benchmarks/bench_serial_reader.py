@@ -0,0 +1,128 @@
+"""Compare the serial reader's "poll" and "event" read modes.
+
+A pty pair stands in for the ESP32: this script writes JSON lines into the
+master side and ESP32SerialReader reads the slave side like a real port.
+For each mode it measures
+
+* throughput: lines/sec when lines are written as fast as possible
+* latency: write-to-callback time for lines paced at --rate Hz
+* idle CPU: CPU time the process burns while the port is silent
+
+POSIX only (needs os.openpty). From backend/:
+
+    python -m benchmarks.bench_serial_reader --lines 20000 --rate 100
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+
+from app.serial.serial_reader import READ_MODES, ESP32SerialReader
+
+LINE = b'{"ts_ms":%d,"distance_cm":99.8,"temp_c":17.8,"hum_pct":59}\n'
+
+
+class Recorder:
+    # callback target: remembers when each sequence number arrived
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.received = {}
+        self.done = threading.Event()
+
+    def __call__(self, sample):
+        self.received[sample.device_ts_ms] = time.perf_counter_ns()
+        if len(self.received) >= self.expected:
+            self.done.set()
+
+
+def open_reader(mode: str, recorder: Recorder):
+    master, slave = os.openpty()
+    reader = ESP32SerialReader(on_reading=recorder, read_mode=mode)
+    if not reader.connect(os.ttyname(slave), auto_reconnect=False):
+        raise RuntimeError("could not open pty slave")
+    return master, slave, reader
+
+
+def close_reader(master: int, slave: int, reader: ESP32SerialReader):
+    reader.disconnect()
+    os.close(master)
+    os.close(slave)
+
+
+def bench_throughput(mode: str, lines: int) -> float:
+    recorder = Recorder(lines)
+    master, slave, reader = open_reader(mode, recorder)
+    try:
+        payload = b"".join(LINE % i for i in range(lines))
+        started = time.perf_counter()
+        view = memoryview(payload)
+        while view:
+            written = os.write(master, view[:4096])
+            view = view[written:]
+        recorder.done.wait(timeout=60)
+        elapsed = time.perf_counter() - started
+    finally:
+        close_reader(master, slave, reader)
+    return len(recorder.received) / elapsed
+
+
+def bench_latency(mode: str, lines: int, rate: float):
+    recorder = Recorder(lines)
+    master, slave, reader = open_reader(mode, recorder)
+    sent = {}
+    try:
+        interval = 1.0 / rate
+        next_at = time.perf_counter()
+        for i in range(lines):
+            sent[i] = time.perf_counter_ns()
+            os.write(master, LINE % i)
+            next_at += interval
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+        recorder.done.wait(timeout=10)
+    finally:
+        close_reader(master, slave, reader)
+
+    latencies = sorted(
+        (recorder.received[i] - sent[i]) / 1e6 for i in sent if i in recorder.received
+    )
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+        "max_ms": latencies[-1],
+    }
+
+
+def bench_idle_cpu(mode: str, seconds: float) -> float:
+    recorder = Recorder(1)
+    master, slave, reader = open_reader(mode, recorder)
+    try:
+        cpu_start = time.process_time()
+        time.sleep(seconds)
+        cpu = time.process_time() - cpu_start
+    finally:
+        close_reader(master, slave, reader)
+    return cpu / seconds * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=20000, help="lines for the throughput run")
+    parser.add_argument("--rate", type=float, default=100.0, help="Hz for the latency run")
+    parser.add_argument("--latency-lines", type=int, default=500)
+    parser.add_argument("--idle", type=float, default=3.0, help="seconds for the idle CPU run")
+    parser.add_argument("--modes", nargs="+", default=list(READ_MODES), choices=READ_MODES)
+    args = parser.parse_args()
+
+    print(f"{'mode':<6} {'lines/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'idle CPU %':>11}")
+    for mode in args.modes:
+        throughput = bench_throughput(mode, args.lines)
+        latency = bench_latency(mode, args.latency_lines, args.rate)
+        idle = bench_idle_cpu(mode, args.idle)
+        print(f"{mode:<6} {throughput:>10.0f} {latency['p50_ms']:>8.2f} "
+              f"{latency['p99_ms']:>8.2f} {latency['max_ms']:>8.2f} {idle:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
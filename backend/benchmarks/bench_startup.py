@@ -0,0 +1,105 @@
+"""Cold start: import time of app.main and time until the API answers.
+
+Each run is a fresh interpreter. Import time is measured inside it, around
+`import app.main`. Time to first response is from spawning uvicorn until
+the first 200 from / (liveness, no database) and from /health (which also
+checks the database). The engines, pool pre-warm and device connects all
+happen in the background, so neither should wait on postgres.
+
+From backend/ (postgres doesn't have to be running):
+
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --max-import-ms 800 --max-health-ms 2500   # CI guard
+
+With a --max-* limit the exit code is 1 when a median is over it.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import app.main; "
+    "print((time.perf_counter() - started) * 1000)"
+)
+
+
+def import_ms() -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], check=True,
+                         capture_output=True, text=True, env={**os.environ, "PYTHONPATH": "."})
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def first_response_ms(port: int, timeout: float):
+    # (ms until / answered, ms until /health answered)
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    root = health = None
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as client:
+            deadline = started + timeout
+            while time.perf_counter() < deadline and (root is None or health is None):
+                path = "/" if root is None else "/health"
+                try:
+                    response = client.get(path)
+                except httpx.TransportError:
+                    time.sleep(0.005)
+                    continue
+                if response.status_code == 200:
+                    elapsed = (time.perf_counter() - started) * 1000
+                    if root is None:
+                        root = elapsed
+                    else:
+                        health = elapsed
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return root, health
+
+
+def summary(name: str, values):
+    values = [v for v in values if v is not None]
+    if not values:
+        print(f"{name:<22} no response")
+        return None
+    median = statistics.median(values)
+    print(f"{name:<22} median {median:8.1f} ms   min {min(values):8.1f}   max {max(values):8.1f}")
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-health-ms", type=float)
+    args = parser.parse_args()
+
+    imports = [import_ms() for _ in range(args.runs)]
+    responses = [first_response_ms(args.port, args.timeout) for _ in range(args.runs)]
+
+    print(f"{args.runs} cold starts\n")
+    import_median = summary("import app.main", imports)
+    summary("first / response", [root for root, _ in responses])
+    health_median = summary("first /health response", [health for _, health in responses])
+
+    failed = []
+    if args.max_import_ms is not None and import_median > args.max_import_ms:
+        failed.append(f"import {import_median:.0f} ms > {args.max_import_ms:.0f} ms")
+    if args.max_health_ms is not None and (health_median is None or health_median > args.max_health_ms):
+        failed.append(f"first /health {health_median} ms > {args.max_health_ms:.0f} ms")
+    if failed:
+        print("\nFAIL: " + "; ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
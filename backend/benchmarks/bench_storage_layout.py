@@ -0,0 +1,108 @@
+"""Compare the narrow (readings) and wide (samples) storage layouts.
+
+Inserts the same synthetic samples into a copy of each table inside a
+throwaway schema, through the same batched insert path the app uses, and
+reports insert throughput and on-disk bytes per sample (heap + indexes).
+
+Needs a migrated database (python -m app.db.init_db), then from backend/:
+
+    python -m benchmarks.bench_storage_layout --samples 200000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from app.db.db import engine
+from app.db.models import Reading, WideReading
+from app.db.persistence import (
+    READING_COLUMNS, SAMPLE_COLUMNS, build_reading_rows, build_sample_row, insert_rows
+)
+
+SCHEMA = "bench_layout"
+
+
+def make_samples(count: int):
+    start = datetime.now(timezone.utc) - timedelta(seconds=count)
+    temp, hum, dist = 21.0, 45.0, 80.0
+    for i in range(count):
+        temp += random.uniform(-0.05, 0.05)
+        hum += random.uniform(-0.1, 0.1)
+        dist = max(2.0, dist + random.uniform(-3, 3))
+        yield start + timedelta(seconds=i), {
+            "ts_ms": i * 1000,
+            "temp_c": round(temp, 1),
+            "hum_pct": round(hum),
+            "distance_cm": round(dist, 1)
+        }
+
+
+def run_layout(name: str, table, columns, build, samples, batch_size: int):
+    rows = []
+    for ts, data in samples:
+        rows.extend(build(data, ts))
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {SCHEMA}.{table.name}"))
+        conn.execute(text(
+            f"CREATE TABLE {SCHEMA}.{table.name} (LIKE public.{table.name} INCLUDING ALL)"
+        ))
+
+    started = time.perf_counter()
+    for offset in range(0, len(rows), batch_size):
+        with engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL search_path TO {SCHEMA}"))
+            insert_rows(conn, rows[offset:offset + batch_size], table, columns)
+    elapsed = time.perf_counter() - started
+
+    with engine.begin() as conn:
+        heap, total = conn.execute(text(
+            f"SELECT pg_table_size('{SCHEMA}.{table.name}'), "
+            f"pg_total_relation_size('{SCHEMA}.{table.name}')"
+        )).first()
+
+    count = len(samples)
+    return {
+        "layout": name,
+        "rows": len(rows),
+        "samples_per_s": count / elapsed,
+        "rows_per_s": len(rows) / elapsed,
+        "heap_bytes_per_sample": heap / count,
+        "total_bytes_per_sample": total / count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=500, help="samples per flush")
+    args = parser.parse_args()
+
+    random.seed(42)
+    samples = list(make_samples(args.samples))
+
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}"))
+    try:
+        results = [
+            run_layout("narrow", Reading.__table__, READING_COLUMNS,
+                       build_reading_rows, samples, args.batch_size * 3),
+            run_layout("wide", WideReading.__table__, SAMPLE_COLUMNS,
+                       lambda data, ts: [build_sample_row(data, ts)], samples, args.batch_size),
+        ]
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+    print(f"{args.samples} samples, {args.batch_size} samples per batch\n")
+    print(f"{'layout':<8} {'rows':>9} {'samples/s':>11} {'rows/s':>11} "
+          f"{'heap B/sample':>14} {'total B/sample':>15}")
+    for r in results:
+        print(f"{r['layout']:<8} {r['rows']:>9} {r['samples_per_s']:>11.0f} {r['rows_per_s']:>11.0f} "
+              f"{r['heap_bytes_per_sample']:>14.1f} {r['total_bytes_per_sample']:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
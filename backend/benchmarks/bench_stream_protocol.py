@@ -0,0 +1,77 @@
+"""Bytes and encode time per sample: json text frames vs binary frames.
+
+Simulates --devices desks at --rate Hz for --seconds, then encodes the
+stream the way ConnectionManager does: one json message per sample, or one
+app.stream.binary frame per --flush interval. Every binary frame is decoded
+again and checked against the samples that went in.
+
+No server needed, from backend/:
+
+    python -m benchmarks.bench_stream_protocol --devices 4 --rate 50 --flush 0.05
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.serial.parser import parse_line
+from app.serial.simulator import generated_line
+from app.stream.binary import encode_frame, decode_frame
+
+
+def make_samples(devices: int, rate: float, seconds: float):
+    start = datetime.now(timezone.utc)
+    samples = []
+    for seq in range(int(seconds * rate)):
+        for d in range(devices):
+            sample = parse_line(generated_line(seq, rate), device=f"desk-{d}",
+                                ts=start + timedelta(seconds=seq / rate, microseconds=d * 37))
+            sample.temp_c = round(sample.temp_c, 2)
+            sample.hum_pct = round(sample.hum_pct, 2)
+            sample.distance_cm = round(sample.distance_cm, 2)
+            samples.append(sample)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=50.0, help="samples per second per device")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--flush", type=float, default=0.05, help="binary flush interval")
+    args = parser.parse_args()
+
+    random.seed(1)
+    samples = make_samples(args.devices, args.rate, args.seconds)
+    n = len(samples)
+
+    started = time.perf_counter()
+    json_bytes = sum(len(json.dumps(s.to_dict()).encode("utf-8")) for s in samples)
+    json_s = time.perf_counter() - started
+
+    per_frame = max(1, round(args.devices * args.rate * args.flush))
+    batches = [samples[i:i + per_frame] for i in range(0, n, per_frame)]
+    started = time.perf_counter()
+    frames = [encode_frame(batch) for batch in batches]
+    binary_s = time.perf_counter() - started
+    binary_bytes = sum(len(f) for f in frames)
+
+    exact = True
+    for batch, frame in zip(batches, frames):
+        decoded = sorted(decode_frame(frame), key=lambda d: (d["ts_utc_ms"], d["device"]))
+        expected = sorted(batch, key=lambda s: (round(s.ts.timestamp() * 1000), s.device))
+        for d, s in zip(decoded, expected):
+            exact &= (d["ts_ms"] == s.device_ts_ms and d["temp_c"] == s.temp_c
+                      and d["hum_pct"] == s.hum_pct and d["distance_cm"] == s.distance_cm)
+
+    print(f"{n} samples from {args.devices} devices, {per_frame} samples per binary frame\n")
+    print(f"{'protocol':<10} {'messages':>9} {'bytes/sample':>13} {'us/sample':>10}")
+    print(f"{'json':<10} {n:>9} {json_bytes / n:>13.1f} {json_s / n * 1e6:>10.2f}")
+    print(f"{'binary':<10} {len(frames):>9} {binary_bytes / n:>13.1f} {binary_s / n * 1e6:>10.2f}")
+    print(f"\n{json_bytes / binary_bytes:.1f}x fewer bytes, {n / len(frames):.0f}x fewer messages")
+    print("binary round trip exact:", "yes" if exact else "NO")
+
+
+if __name__ == "__main__":
+    main()
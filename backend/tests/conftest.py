@@ -0,0 +1,24 @@
+import uuid
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.db.db import get_engine
+
+CLEANUP_TABLES = ("readings", "readings_1m", "readings_1h", "readings_1d")
+
+
+@pytest.fixture
+def db_device():
+    """A device id of its own in the DATABASE_URL postgres, its rows go afterwards"""
+    try:
+        with get_engine().connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except (SQLAlchemyError, OSError) as e:
+        pytest.skip(f"no database: {e}")
+    device = f"test-{uuid.uuid4().hex[:8]}"
+    yield device
+    with get_engine().begin() as conn:
+        for table in CLEANUP_TABLES:
+            conn.execute(text(f"DELETE FROM {table} WHERE device = :device"), {"device": device})
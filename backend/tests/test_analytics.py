@@ -0,0 +1,79 @@
+"""app.db.analytics: the row limit covers a whole request, one request runs at a time.
+
+Needs the postgres in DATABASE_URL and numpy, skipped without them.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.db import analytics
+from app.db.db import get_engine
+from app.db.maintenance import PARTITIONED_TABLES, ensure_partitions
+from app.db.persistence import build_rows, persist_reading_rows
+from app.serial.parser import Sample
+
+pytest.importorskip("numpy")
+
+START = datetime(2026, 10, 14, 8)
+END = START + timedelta(hours=1)
+SAMPLES = 600  # every 6 s, three sensors each
+
+
+@pytest.fixture
+def readings(db_device):
+    rows = []
+    for i in range(SAMPLES):
+        sample = Sample(device_ts_ms=i, temp_c=21.0 + (i % 10) / 10, hum_pct=45.0 - (i % 7) / 2,
+                        distance_cm=80.0 + (i % 13), device=db_device)
+        rows += build_rows(sample, START + i * timedelta(seconds=6))
+    with get_engine().begin() as conn:
+        for parent in PARTITIONED_TABLES:
+            ensure_partitions(conn, START, END, parent=parent)
+        persist_reading_rows(conn, rows)
+    return db_device
+
+
+def test_row_limit_counts_every_sensor(readings, monkeypatch):
+    monkeypatch.setattr(analytics, "MAX_ROWS", 2 * SAMPLES)
+    with get_engine().connect() as conn:
+        two = analytics.analyze(conn, START, END, readings, ["temp_c", "hum_pct"])
+        assert two["samples"] == 2 * SAMPLES
+        assert two["comfort"]["samples"] == SAMPLES
+        # each sensor fits on its own, the three of them don't
+        with pytest.raises(analytics.AnalyticsError, match="per request"):
+            analytics.analyze(conn, START, END, readings)
+
+
+def test_one_sensor_at_a_time_gives_the_same_answer(readings):
+    with get_engine().connect() as conn:
+        together = analytics.analyze(conn, START, END, readings)
+        alone = {sensor: analytics.analyze(conn, START, END, readings, [sensor])["sensors"][sensor]
+                 for sensor in ("temp_c", "hum_pct", "distance_cm")}
+    assert together["sensors"] == alone
+    assert together["samples"] == 3 * SAMPLES
+
+
+def test_requests_take_turns(readings, monkeypatch):
+    running = []
+    overlapped = threading.Event()
+    analyze = analytics.analyze
+
+    def slow_analyze(*args, **kwargs):
+        running.append(1)
+        if len(running) > 1:
+            overlapped.set()
+        time.sleep(0.2)
+        running.pop()
+        return analyze(*args, **kwargs)
+
+    monkeypatch.setattr(analytics, "analyze", slow_analyze)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        analytics.run_analytics(START, END, readings, ["temp_c"]))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 3 and not overlapped.is_set()
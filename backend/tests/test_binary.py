@@ -0,0 +1,92 @@
+"""app.stream.binary: frames and the zigzag varints decode back to what went in."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.serial.parser import Sample
+from app.stream.binary import (
+    ALL_COLUMNS, HEADER, _get_varint, _put_varint, column_mask, decode_frame, encode_frame,
+)
+
+T0 = datetime(2026, 10, 1, 12, tzinfo=timezone.utc)
+
+
+def ms(ts: datetime) -> int:
+    return round(ts.timestamp() * 1000)
+
+
+def expected(sample: Sample, columns: int = ALL_COLUMNS):
+    row = {"device": sample.device, "ts_utc_ms": ms(sample.ts)}
+    for bit, column in enumerate(("ts_ms", "temp_c", "hum_pct", "distance_cm")):
+        if columns & (1 << bit):
+            row[column] = sample.device_ts_ms if bit == 0 else getattr(sample, column)
+    return row
+
+
+@pytest.mark.parametrize("value", [
+    0, 1, -1, 63, -64, 64, -65, 127, 128, -129, 2 ** 31, -2 ** 31, 2 ** 32 - 1,
+    2 ** 63 - 1, -2 ** 63, 2 ** 63, -2 ** 63 - 1, 10 ** 40, -10 ** 40,
+])
+def test_varint_round_trip(value):
+    out = bytearray(b"\x00")
+    _put_varint(out, value)
+    _put_varint(out, 7)
+    decoded, pos = _get_varint(bytes(out), 1)
+    assert decoded == value
+    assert _get_varint(bytes(out), pos) == (7, len(out))
+
+
+def test_small_deltas_take_one_byte():
+    for value in range(-64, 64):
+        out = bytearray()
+        _put_varint(out, value)
+        assert len(out) == 1
+
+
+def test_frame_round_trip():
+    samples = []
+    for i in range(30):
+        samples.append(Sample(
+            device_ts_ms=1000 + 250 * i if i != 4 else None,
+            temp_c=21.0 + (i % 7) / 4 - 1.5,
+            hum_pct=None if i % 3 else 44.25,
+            distance_cm=-12.5 if i == 9 else 80.0 + i * 0.37,
+            device=("desk-1", "desk-2", None)[i % 3],
+            ts=T0 + timedelta(milliseconds=97 * i),
+        ))
+    samples[5].ts = T0 - timedelta(seconds=3)  # out of order, a negative delta
+
+    decoded = decode_frame(encode_frame(samples))
+    by_device = sorted(decoded, key=lambda r: (r["device"] or "", r["ts_utc_ms"]))
+    want = sorted((expected(s) for s in samples), key=lambda r: (r["device"] or "", r["ts_utc_ms"]))
+    assert len(by_device) == len(want)
+    for got, row in zip(by_device, want):
+        for key in ("temp_c", "hum_pct", "distance_cm"):
+            if row[key] is not None:
+                assert got[key] == pytest.approx(round(row[key], 2))
+                row[key] = got[key]
+        assert got == row
+
+
+def test_column_mask_leaves_columns_out():
+    sample = Sample(device_ts_ms=5, temp_c=20.5, hum_pct=40.0, distance_cm=81.0,
+                    device="desk-1", ts=T0)
+    columns = column_mask(["distance_cm"])
+    assert decode_frame(encode_frame([sample], columns)) == [expected(sample, columns)]
+
+
+def test_empty_frame():
+    assert decode_frame(encode_frame([])) == []
+
+
+@pytest.mark.parametrize("device", ["d" * 254 + "é", "ü" * 200, "日本" * 60, "x" * 300])
+def test_long_device_names_are_cut_on_a_character_boundary(device):
+    sample = Sample(device_ts_ms=1, temp_c=20.0, device=device, ts=T0)
+    frame = encode_frame([sample])
+    name_len = frame[HEADER.size]
+    assert name_len <= 255
+    (row,) = decode_frame(frame)
+    name = row["device"]
+    assert device.startswith(name)
+    # the longest whole-character prefix that fits
+    assert len(device[:len(name) + 1].encode("utf-8")) > 255
@@ -0,0 +1,159 @@
+"""app.ingest.journal: framing, recovery after a crash, corrupt records, rotation."""
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.ingest.journal import BODY, HEADER, Journal, decode_sample, encode_sample, read_record
+from app.serial.parser import Sample
+
+T0 = datetime(2026, 10, 1, 12, tzinfo=timezone.utc)
+
+
+def sample(i: int, device: str = "desk-1") -> Sample:
+    return Sample(device_ts_ms=i, temp_c=20.0 + i / 10, hum_pct=None, distance_cm=80.0,
+                  device=device, ts=T0 + timedelta(milliseconds=100 * i))
+
+
+def open_journal(path, **kwargs) -> Journal:
+    journal = Journal(str(path), **kwargs)
+    journal.open()
+    return journal
+
+
+def segment_files(path):
+    return sorted(name for name in os.listdir(path) if name.endswith(".seg"))
+
+
+def read_all(journal: Journal, offset: int = 0):
+    samples, next_offset = journal.read(offset, 1_000_000)
+    return [s.device_ts_ms for s in samples], next_offset
+
+
+def test_record_round_trip():
+    original = sample(7)
+    record = encode_sample(original)
+    length, crc = HEADER.unpack_from(record)
+    body = record[HEADER.size:]
+    assert length == len(body) and crc == zlib.crc32(body)
+    assert decode_sample(body) == original
+
+    empty = Sample(device_ts_ms=None, temp_c=None, device=None, ts=T0)
+    assert decode_sample(encode_sample(empty)[HEADER.size:]) == empty
+
+
+def test_read_record_stops_at_a_bad_crc(tmp_path):
+    record = bytearray(encode_sample(sample(1)))
+    record[-1] ^= 0xFF
+    path = tmp_path / "bad"
+    path.write_bytes(encode_sample(sample(0)) + bytes(record))
+    with open(path, "rb") as f:
+        assert read_record(f) is not None
+        assert read_record(f) is None
+
+
+def test_reopen_resumes_offsets(tmp_path):
+    journal = open_journal(tmp_path)
+    for i in range(5):
+        assert journal.append(sample(i)) == i
+    journal_id = journal.journal_id
+    journal.close()
+
+    journal = open_journal(tmp_path)
+    assert journal.journal_id == journal_id
+    assert journal.next_offset == 5
+    assert journal.append(sample(5)) == 5
+    assert read_all(journal) == ([0, 1, 2, 3, 4, 5], 6)
+
+
+def test_torn_tail_is_cut_off(tmp_path):
+    journal = open_journal(tmp_path)
+    for i in range(3):
+        journal.append(sample(i))
+    journal.close()
+    segment = tmp_path / segment_files(tmp_path)[0]
+    good_size = segment.stat().st_size
+    with open(segment, "ab") as f:
+        f.write(encode_sample(sample(3))[:-4])  # power went out mid-write
+
+    journal = open_journal(tmp_path)
+    assert segment.stat().st_size == good_size
+    assert journal.next_offset == 3
+    journal.append(sample(4))
+    assert read_all(journal) == ([0, 1, 2, 4], 4)
+
+
+def test_corrupt_record_in_a_closed_segment_skips_the_rest_of_it(tmp_path):
+    record_size = len(encode_sample(sample(0)))
+    journal = open_journal(tmp_path, segment_bytes=4 * record_size)
+    for i in range(12):
+        journal.append(sample(i))
+    assert len(segment_files(tmp_path)) == 3  # 0-3, 4-7, 8-11
+
+    first = tmp_path / segment_files(tmp_path)[0]
+    data = bytearray(first.read_bytes())
+    data[record_size + HEADER.size + 2] ^= 0xFF  # inside record 1
+    first.write_bytes(bytes(data))
+
+    assert read_all(journal) == ([0, 4, 5, 6, 7, 8, 9, 10, 11], 12)
+    assert journal.corrupt == 3
+
+
+def test_undecodable_record_is_skipped_alone(tmp_path):
+    journal = open_journal(tmp_path)
+    journal.append(sample(0))
+    # crc is fine, the device name isn't utf-8
+    body = BODY.pack(T0.timestamp(), 1, 1.0, 1.0, 1.0, 2) + b"\xff\xfe"
+    with open(tmp_path / segment_files(tmp_path)[0], "ab") as f:
+        f.write(HEADER.pack(len(body), zlib.crc32(body)) + body)
+    journal.close()
+
+    journal = open_journal(tmp_path)
+    journal.append(sample(2))
+    assert read_all(journal) == ([0, 2], 3)
+    assert journal.corrupt == 1
+
+
+def test_reads_continue_across_segments(tmp_path):
+    record_size = len(encode_sample(sample(0)))
+    journal = open_journal(tmp_path, segment_bytes=3 * record_size)
+    for i in range(10):
+        journal.append(sample(i))
+
+    seen, offset = [], 0
+    while offset < journal.next_offset:
+        samples, offset = journal.read(offset, 4)
+        seen += [s.device_ts_ms for s in samples]
+    assert seen == list(range(10))
+
+
+def test_release_deletes_committed_segments_only(tmp_path):
+    record_size = len(encode_sample(sample(0)))
+    journal = open_journal(tmp_path, segment_bytes=3 * record_size)
+    for i in range(10):
+        journal.append(sample(i))
+    assert len(segment_files(tmp_path)) == 4  # 0, 3, 6, 9
+
+    assert journal.release(5) == 1  # segment 3-5 still holds offset 5
+    assert journal.first_offset == 3
+    assert read_all(journal, 5) == ([5, 6, 7, 8, 9], 10)
+    journal.close()
+
+    journal = open_journal(tmp_path)
+    assert (journal.first_offset, journal.next_offset) == (3, 10)
+
+
+@pytest.mark.parametrize("segments_kept", [2, 3])
+def test_max_bytes_drops_the_oldest_segments(tmp_path, segments_kept):
+    record_size = len(encode_sample(sample(0)))
+    journal = open_journal(tmp_path, segment_bytes=4 * record_size,
+                           max_bytes=segments_kept * 4 * record_size)
+    for i in range(20):
+        journal.append(sample(i))
+
+    # checked when a segment rolls over, the active one fills up on top of max_bytes
+    assert journal.discarded == 20 - 4 * (segments_kept + 1)
+    assert journal.first_offset == journal.discarded
+    # a reader behind the dropped part carries on at the oldest kept record
+    assert read_all(journal) == (list(range(journal.discarded, 20)), 20)
@@ -0,0 +1,144 @@
+"""app.serial.parser against the ESP32's line formats, with either json backend."""
+import json
+import math
+from datetime import datetime, timezone
+
+import pytest
+
+from app.serial import parser
+from app.serial.parser import TS_MS_MAX, TS_MS_MIN, LineParseError, Sample, parse_line
+from app.serial_reader import parse_line_to_reading
+
+TS = datetime(2026, 10, 1, 12, tzinfo=timezone.utc)
+
+LINES = [
+    b'{"ts_ms":1200,"distance_cm":82.5,"temp_c":21.4,"hum_pct":44}',
+    b'17:09:47.625 -> {"ts_ms":1300,"distance_cm":82.1,"temp_c":21.4,"hum_pct":44}',
+    b'  {"ts_ms": 4294967295, "distance_cm": 0, "temp_c": -3.5, "hum_pct": 100.0}\r',
+    b'boot ok {"ts_ms":-5,"distance_cm":1e2,"temp_c":20,"hum_pct":50.5} ',
+]
+
+
+@pytest.fixture(params=["orjson", "json"], autouse=True)
+def json_backend(request):
+    if request.param == "orjson" and parser.orjson is None:
+        pytest.skip("orjson is not installed")
+    previous = parser.JSON_BACKEND
+    parser.set_json_backend(request.param)
+    yield request.param
+    parser.set_json_backend(previous)
+
+
+def old_parse_line_to_reading(line: str):
+    # the decode/find/json.loads parser this module replaced, minus its logging
+    try:
+        line = line.strip()
+        json_start = line.find('{')
+        if json_start == -1:
+            return None
+        payload = json.loads(line[json_start:])
+        if not all(k in payload for k in ['ts_ms', 'distance_cm', 'temp_c', 'hum_pct']):
+            return None
+        return {
+            'device_ts_ms': payload['ts_ms'],
+            'distance_cm': float(payload['distance_cm']),
+            'temp_c': float(payload['temp_c']),
+            'hum_pct': float(payload['hum_pct'])
+        }
+    except (json.JSONDecodeError, ValueError, KeyError):
+        return None
+
+
+def test_plain_line():
+    sample = parse_line(LINES[0], device="desk-1", ts=TS)
+    assert sample == Sample(device_ts_ms=1200, temp_c=21.4, hum_pct=44.0, distance_cm=82.5,
+                            device="desk-1", ts=TS)
+    assert isinstance(sample.hum_pct, float)
+
+
+def test_serial_monitor_prefix():
+    sample = parse_line(LINES[1], ts=TS)
+    assert (sample.device_ts_ms, sample.distance_cm) == (1300, 82.1)
+
+
+@pytest.mark.parametrize("line", LINES)
+def test_memoryview_bytearray_and_bytes_agree(line):
+    expected = parse_line(line, ts=TS)
+    buffer = bytearray(b"xx" + line + b"\nyy")
+    view = memoryview(buffer)[2:2 + len(line)]
+    assert parse_line(view, ts=TS) == expected
+    assert parse_line(bytearray(line), ts=TS) == expected
+
+
+@pytest.mark.parametrize("line", [b"", b"   ", b"\r", memoryview(b" \t ")])
+def test_blank_lines(line):
+    assert parse_line(line) is None
+
+
+@pytest.mark.parametrize("line,kind", [
+    (b"ESP32 booting...", "json"),
+    (memoryview(b"ESP32 booting..."), "json"),
+    (b'{"ts_ms": 1, "temp_c": ', "json"),
+    (b'17:09:47.625 -> {"ts_ms":1,"temp_c":21.4,"note":"\xff\xfe"}', "decode"),
+    (b"[1, 2, 3]", "json"),  # no '{' at all
+    (b'{"ts_ms": 5}', "schema"),
+    (b'x {"a": [1, {"b": 2}]}', "schema"),
+    (b'{"ts_ms": 1, "temp_c": "warm"}', "schema"),
+    (b'{"ts_ms": "soon", "temp_c": 20}', "schema"),
+    (b'{"ts_ms": 1, "temp_c": [20]}', "schema"),
+])
+def test_error_kinds(line, kind):
+    with pytest.raises(LineParseError) as error:
+        parse_line(line)
+    assert error.value.kind == kind
+
+
+@pytest.mark.parametrize("value", ["NaN", "Infinity", "-Infinity", "1e400"])
+def test_non_finite_values_are_rejected(json_backend, value):
+    line = b'{"ts_ms": 1, "temp_c": %s, "hum_pct": 40}' % value.encode()
+    # orjson refuses them while decoding, the stdlib json lets them through to the schema check
+    kind = "json" if json_backend == "orjson" else "schema"
+    with pytest.raises(LineParseError) as error:
+        parse_line(line)
+    assert error.value.kind == kind
+
+
+@pytest.mark.parametrize("ts_ms,ok", [
+    (TS_MS_MIN, True), (TS_MS_MAX, True), (0, True),
+    (TS_MS_MIN - 1, False), (TS_MS_MAX + 1, False), (2 ** 63, False),
+])
+def test_ts_ms_range(ts_ms, ok):
+    line = b'{"ts_ms": %d, "temp_c": 20}' % ts_ms
+    if ok:
+        assert parse_line(line).device_ts_ms == ts_ms
+    else:
+        with pytest.raises(LineParseError) as error:
+            parse_line(line)
+        assert error.value.kind == "schema"
+
+
+def test_infinite_ts_ms_is_a_schema_error():
+    # the stdlib json accepts Infinity, int() of it overflows
+    parser.set_json_backend("json")
+    with pytest.raises(LineParseError) as error:
+        parse_line(b'{"ts_ms": Infinity, "temp_c": 20}')
+    assert error.value.kind == "schema"
+
+
+def test_from_dict_checks_values_too():
+    assert Sample.from_dict({"device_ts_ms": 5, "temp_c": "21.5"}).temp_c == 21.5
+    with pytest.raises(ValueError):
+        Sample.from_dict({"ts_ms": 1, "temp_c": math.inf})
+    with pytest.raises(ValueError):
+        Sample.from_dict({"ts_ms": TS_MS_MAX + 1, "temp_c": 20})
+
+
+@pytest.mark.parametrize("line", LINES)
+def test_same_readings_as_the_old_parser(line):
+    old = old_parse_line_to_reading(line.decode("utf-8"))
+    new = parse_line_to_reading(line.decode("utf-8"))
+    assert new.pop("ts_utc")
+    assert new == old
+    sample = parse_line(line)
+    assert (sample.device_ts_ms, sample.distance_cm, sample.temp_c, sample.hum_pct) == (
+        old["device_ts_ms"], old["distance_cm"], old["temp_c"], old["hum_pct"])
@@ -0,0 +1,59 @@
+"""The simulator's ts_ms behaves like the firmware's millis().
+
+From backend/: python -m pytest tests
+"""
+import os
+import select
+import sys
+import time
+
+import pytest
+
+from app.ingest.clock import MILLIS_WRAP, DeviceClock
+from app.serial.parser import parse_line
+from app.serial.simulator import SimulatedESP32, generated_line
+
+RATE = 10.0
+
+
+def test_generated_lines_follow_the_device_clock():
+    start_ms = MILLIS_WRAP - 250
+    ts_ms = [parse_line(generated_line(seq, RATE, start_ms, drift_ppm=500.0)).device_ts_ms
+             for seq in range(10)]
+    assert ts_ms[0] == start_ms
+    assert ts_ms[3] < 1000  # wrapped
+    unwrapped = [ms + MILLIS_WRAP if ms < start_ms else ms for ms in ts_ms]
+    steps = [b - a for a, b in zip(unwrapped, unwrapped[1:])]
+    assert all(100 <= step <= 101 for step in steps)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs a pty")
+def test_aligned_output_is_monotonic_and_evenly_spaced():
+    # wraps about a second in, the aligner has to carry on through it
+    simulator = SimulatedESP32(RATE, start_ms=MILLIS_WRAP - 1000, drift_ppm=200.0)
+    fd = os.open(simulator.open(), os.O_RDONLY | os.O_NOCTTY)
+    clock = DeviceClock()
+    raw, aligned = [], []
+    pending = b""
+    simulator.start()
+    try:
+        deadline = time.monotonic() + 2.5
+        while time.monotonic() < deadline:
+            if not select.select([fd], [], [], 0.1)[0]:
+                continue
+            received = time.time()
+            pending += os.read(fd, 65536)
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                sample = parse_line(line)
+                raw.append(sample.device_ts_ms)
+                aligned.append(clock.wall_time(sample.device_ts_ms, received))
+    finally:
+        os.close(fd)
+        simulator.close()
+
+    assert len(aligned) >= 20
+    assert max(raw) > MILLIS_WRAP - 1000 and min(raw) < 1000
+    steps = [b - a for a, b in zip(aligned, aligned[1:])]
+    assert all(step > 0 for step in steps)
+    assert all(abs(step - 1 / RATE) < 0.2 / RATE for step in steps)
@@ -102,3 +102,20 @@ export async function getSerialData() {
     throw error;
   }
 }
+
+export async function getHistory(sensor, { from, to, bucket = '1m', maxPoints = 1000 } = {}) {
+  try {
+    const params = new URLSearchParams({ sensor, bucket, max_points: maxPoints });
+    if (from) params.set('from', from);
+    if (to) params.set('to', to);
+    const response = await fetch(`${API_BASE_URL}/readings/history?${params}`);
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.detail || 'Failed to get history');
+    }
+    return await response.json();
+  } catch (error) {
+    console.error('Error getting history:', error);
+    throw error;
+  }
+}